@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+'''End to end benchmarks of fs_radar on a synthetic tree:
+
+- startup: time to scan the tree and to watch its directories, memory
+  (RSS and Python heap) used per thousand watches
+- latency: p50/p99 time from the write of a file to the spawn of the
+  command of its group
+- storms: events per second handled by FsRadar and dispatched to the
+  groups after a mass save, a checkout and a tar extraction
+
+Run it from the root of the project, optionally saving the results to
+compare them with another run (see benchmarks.compare):
+
+    python -m benchmarks.bench_end_to_end --output before.json
+'''
+
+import argparse
+import asyncio
+from functools import partial
+import io
+import json
+import os
+from os.path import join, relpath
+import platform
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from fs_radar import FsRadar, FsRadarEvent
+from fs_radar.cmd_launch_pad import CmdLaunchPad
+from fs_radar.fanotify_backend import FanotifyBackend
+from fs_radar.groups import get_dirs_to_watch, make_launch_pads_notifier
+from fs_radar.observer import Observer
+from fs_radar.path_dispatcher import PathDispatcher
+from fs_radar.stat_poller import StatPoller
+from fs_radar.watch_backend import InotifyBackend
+
+from benchmarks.synthetic_tree import make_tree
+
+BACKENDS = {
+    'inotify': InotifyBackend,
+    'poll': StatPoller,
+    'fanotify': FanotifyBackend,
+}
+
+
+class CountingTarget:
+    '''Dispatch target counting the paths it receives'''
+
+    def __init__(self):
+        self.count = 0
+
+    def add_item_to_process(self, path):
+        self.count += 1
+
+
+def percentile(values, q):
+    '''Return the `q`-th percentile (nearest rank) of `values`'''
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def get_rss_kb():
+    with open('/proc/self/status') as fp:
+        for line in fp:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def get_max_queued_events():
+    try:
+        with open('/proc/sys/fs/inotify/max_queued_events') as fp:
+            return int(fp.read())
+    except (OSError, ValueError):
+        return 16384
+
+
+def make_radar(basedir, target, backend):
+    '''Create a FsRadar dispatching the *.txt files to `target`'''
+    dispatcher = PathDispatcher()
+    dispatcher.add(target, ['*.txt'])
+
+    observer = Observer()
+    observer.subscribe(FsRadarEvent.FILE_MATCH, make_launch_pads_notifier(dispatcher, basedir))
+
+    return FsRadar(lambda path: True, observer, backend=BACKENDS[backend]())
+
+
+def watch_tree(fsr, basedir):
+    dirs = [os.path.abspath(join(basedir, path)) for path in get_dirs_to_watch(basedir, lambda path: True)]
+    for path in dirs:
+        fsr.add_watch(path)
+    return dirs
+
+
+def bench_startup(basedir, backend):
+    scan_start = time.perf_counter()
+    dirs = list(get_dirs_to_watch(basedir, lambda path: True))
+    scan_time = time.perf_counter() - scan_start
+
+    rss_before = get_rss_kb()
+    with make_radar(basedir, CountingTarget(), backend) as fsr:
+        watch_start = time.perf_counter()
+        for path in dirs:
+            fsr.add_watch(os.path.abspath(join(basedir, path)))
+        watch_time = time.perf_counter() - watch_start
+        rss_after = get_rss_kb()
+
+    tracemalloc.start()
+    with make_radar(basedir, CountingTarget(), backend) as fsr:
+        heap_before = tracemalloc.get_traced_memory()[0]
+        for path in dirs:
+            fsr.add_watch(os.path.abspath(join(basedir, path)))
+        heap_after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {
+        'dirs': len(dirs),
+        'scan_s': scan_time,
+        'dirs_per_s': len(dirs) / scan_time,
+        'watch_s': watch_time,
+        'rss_kb_per_1k_watches': (rss_after - rss_before) * 1000 / len(dirs),
+        'heap_kb_per_1k_watches': (heap_after - heap_before) / 1024 * 1000 / len(dirs),
+    }
+
+
+def bench_latency(basedir, files, backend, samples, interval):
+    loop = asyncio.new_event_loop()
+    spawned = {}
+    written = {}
+
+    lp = CmdLaunchPad(': {}', options={
+        'bash_profile': os.devnull,
+        'discard_if_already_running': False,
+        'name': 'latency',
+    }, loop=loop)
+    run_process = lp.run_process
+
+    def run_process_and_record(cmd_line):
+        run_process(cmd_line)
+        spawned.setdefault(cmd_line[2:], time.monotonic())
+
+    lp.run_process = run_process_and_record
+
+    def write_files():
+        for path in files[:samples]:
+            time.sleep(interval)
+            with open(path, 'wb') as fp:
+                fp.write(b'latency')
+            written[relpath(path, basedir)] = time.monotonic()
+
+    async def wait_spawns():
+        writer = threading.Thread(target=write_files)
+        writer.start()
+        deadline = time.monotonic() + samples * interval + 10
+        while len(spawned) < samples and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        writer.join()
+
+    with make_radar(basedir, lp, backend) as fsr:
+        watch_tree(fsr, basedir)
+        fsr.attach(loop)
+        try:
+            loop.run_until_complete(wait_spawns())
+        finally:
+            fsr.detach()
+            lp.close()
+            loop.close()
+
+    latencies = [(spawned[path] - written[path]) * 1000 for path in written if path in spawned]
+    if not latencies:
+        return {'samples': 0}
+
+    return {
+        'samples': len(latencies),
+        'missed': len(written) - len(latencies),
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies),
+    }
+
+
+def storm_mass_save(basedir, files, limit):
+    '''Save again (most of) the files of the tree'''
+    for path in files[:limit]:
+        with open(path, 'wb') as fp:
+            fp.write(b'saved')
+
+
+def storm_checkout(basedir, files, limit):
+    '''Replace a third of the files and add new directories with files,
+    like switching branch'''
+    count = limit // 3
+    for path in files[:count]:
+        os.unlink(path)
+    for path in files[:count]:
+        with open(path + '.new.txt', 'wb') as fp:
+            fp.write(b'checkout')
+    for i in range(count // 10):
+        dir_path = join(os.path.dirname(files[i * 10]), 'checkout_%d' % i)
+        os.mkdir(dir_path)
+        with open(join(dir_path, 'file.txt'), 'wb') as fp:
+            fp.write(b'checkout')
+
+
+def storm_tar_extraction(basedir, files, limit, tree_args):
+    '''Extract a tarball holding a tree like the watched one in the
+    watched tree'''
+    with tarfile.open(fileobj=io.BytesIO(make_archive(**tree_args))) as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(join(basedir, 'extracted'), filter='data')
+        else:
+            tar.extractall(join(basedir, 'extracted'))
+
+
+def make_archive(depth, fanout, files_per_dir):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        make_tree(join(tmpdir, 'tree'), depth, fanout, files_per_dir)
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w') as tar:
+            tar.add(join(tmpdir, 'tree'), arcname='tree')
+        return data.getvalue()
+
+
+def bench_storm(workdir, tree_args, backend, storm):
+    '''Create a tree, watch it, cause the `storm` of events while the
+    events are not read and measure how long it takes to handle them'''
+    basedir = join(workdir, 'storm')
+    dirs, files = make_tree(basedir, **tree_args)
+    # leave some room in the inotify queue (every file costs a few events)
+    limit = min(len(files), get_max_queued_events() // 4)
+
+    target = CountingTarget()
+    with make_radar(basedir, target, backend) as fsr:
+        watch_tree(fsr, basedir)
+        if backend != 'poll':
+            fsr.backend.read()  # forget the events of the creation of the tree
+        watches_before = len(fsr.wds)
+
+        storm(basedir, files, limit)
+
+        events_count = 0
+        overflow = False
+        start = time.perf_counter()
+        while True:
+            events = fsr.backend.read()
+            if not events:
+                break
+            events_count += len(events)
+            overflow = overflow or any(event.wd == -1 for event in events)
+            fsr.on_events(events)
+        elapsed = time.perf_counter() - start
+        new_watches = len(fsr.wds) - watches_before
+
+    shutil.rmtree(basedir)
+
+    return {
+        'events': events_count,
+        'matches': target.count,
+        'new_watches': new_watches,
+        'seconds': elapsed,
+        'events_per_s': events_count / elapsed if elapsed else 0,
+        'matches_per_s': target.count / elapsed if elapsed else 0,
+        'overflow': overflow,
+    }
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(prog='bench_end_to_end', description=__doc__.split('\n')[0])
+    parser.add_argument('--depth', type=int, default=3, help='depth of the synthetic tree')
+    parser.add_argument('--fanout', type=int, default=8, help='subdirectories per directory')
+    parser.add_argument('--files', type=int, default=10, help='files per directory')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='inotify')
+    parser.add_argument('--samples', type=int, default=100, help='writes measured for the latency')
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between two measured writes')
+    parser.add_argument('--scenarios', default='startup,latency,mass_save,checkout,tar_extraction',
+                        help='comma separated scenarios to run')
+    parser.add_argument('--output', help='save the results, as JSON, in this file')
+    return parser
+
+
+def main(argv):
+    args = get_args_parser().parse_args(argv[1:])
+    scenarios = args.scenarios.split(',')
+    tree_args = {'depth': args.depth, 'fanout': args.fanout, 'files_per_dir': args.files}
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'backend': args.backend,
+            'tree': tree_args,
+        },
+    }
+
+    with tempfile.TemporaryDirectory(prefix='fs_radar_bench_') as workdir:
+        cwd = os.getcwd()
+        basedir = join(workdir, 'tree')
+        dirs, files = make_tree(basedir, **tree_args)
+        os.chdir(basedir)
+        try:
+            if 'startup' in scenarios:
+                results['startup'] = bench_startup(basedir, args.backend)
+            if 'latency' in scenarios:
+                results['latency'] = bench_latency(basedir, files, args.backend, args.samples, args.interval)
+
+            storms = {
+                'mass_save': storm_mass_save,
+                'checkout': storm_checkout,
+                'tar_extraction': partial(storm_tar_extraction, tree_args=tree_args),
+            }
+            for name, storm in storms.items():
+                if name in scenarios:
+                    results.setdefault('storms', {})[name] = bench_storm(workdir, tree_args, args.backend, storm)
+        finally:
+            os.chdir(cwd)
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
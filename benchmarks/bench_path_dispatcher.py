@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+'''Compare the cost of matching paths against many groups of rules using
+a linear scan of path filters and the PathDispatcher.
+
+Run it from the root of the project:
+
+    python -m benchmarks.bench_path_dispatcher
+'''
+
+import random
+from timeit import timeit
+
+from fs_radar.path_dispatcher import PathDispatcher
+from fs_radar.path_filter import makePathFilter
+
+
+def make_group_rules(i):
+    return [
+        './pkg%d/**/*.py' % i,
+        '*.ext%d' % i,
+        'gen%d/' % i,
+        '!pkg%d/vendor/' % i,
+        '+pkg%d/vendor/keep.py' % i,
+    ]
+
+
+def make_paths(groups_count, count, seed=0):
+    rnd = random.Random(seed)
+    paths = []
+    for _ in range(count):
+        i = rnd.randrange(groups_count * 2)  # half of the paths match nothing
+        paths.append(rnd.choice([
+            'pkg%d/sub/module.py' % i,
+            'pkg%d/vendor/lib.py' % i,
+            'some/dir/file.ext%d' % i,
+            'a/gen%d/out.o' % i,
+            'unrelated/path/file.txt',
+        ]))
+    return paths
+
+
+def bench(groups_count, paths_count=2000, repeat=3):
+    groups = {i: make_group_rules(i) for i in range(groups_count)}
+    paths = make_paths(groups_count, paths_count)
+
+    filters = [(i, makePathFilter(rules)) for i, rules in groups.items()]
+    dispatcher = PathDispatcher(cache_size=0)  # measure the matching, not the cache
+    for i, rules in groups.items():
+        dispatcher.add(i, rules)
+
+    def linear():
+        for path in paths:
+            [i for i, f in filters if f(path)]
+
+    def dispatch():
+        for path in paths:
+            dispatcher.match(path)
+
+    linear_time = min(timeit(linear, number=1) for _ in range(repeat))
+    dispatch_time = min(timeit(dispatch, number=1) for _ in range(repeat))
+
+    return linear_time / paths_count, dispatch_time / paths_count
+
+
+def main():
+    print('%8s %16s %16s %8s' % ('groups', 'linear (us/path)', 'dispatch (us/path)', 'speedup'))
+    for groups_count in (1, 10, 50, 200, 1000):
+        linear_time, dispatch_time = bench(groups_count)
+        print('%8d %16.2f %18.2f %8.1fx' % (
+            groups_count, linear_time * 1e6, dispatch_time * 1e6, linear_time / dispatch_time
+        ))
+
+
+if __name__ == '__main__':
+    main()
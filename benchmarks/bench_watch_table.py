@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+'''Compare the memory used to remember the watched directories by a dict
+of the paths and by the WatchTable, and the cost of their lookups.
+
+Run it from the root of the project:
+
+    python -m benchmarks.bench_watch_table
+'''
+
+import tracemalloc
+from timeit import timeit
+
+from fs_radar.watch_table import WatchTable
+
+
+def make_paths(count, fanout=10, root='/home/user/projects/monorepo'):
+    '''Return the paths of `count` directories of a tree `fanout` wide'''
+    paths = [root]
+    i = 0
+    while len(paths) < count:
+        parent = paths[i]
+        for j in range(fanout):
+            paths.append('%s/dir_%d' % (parent, j))
+        i += 1
+    return paths[:count]
+
+
+def measure(make):
+    '''Return the value built by `make` and the memory it holds, in bytes'''
+    tracemalloc.start()
+    value = make()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def bench(count, lookups=10000):
+    paths = make_paths(count)
+
+    # build the paths inside the measures, only what is kept is counted
+    def make_dict():
+        return {wd: path for wd, path in enumerate(make_paths(count), 1)}
+
+    def make_table():
+        table = WatchTable()
+        for wd, path in enumerate(make_paths(count), 1):
+            table[wd] = path
+        return table
+
+    wds, dict_size = measure(make_dict)
+    table, table_size = measure(make_table)
+
+    step = max(count // lookups, 1)
+    sample = range(1, count + 1, step)
+    dict_time = timeit(lambda: [wds[wd] for wd in sample], number=1) / len(sample)
+    table_time = timeit(lambda: [table[wd] for wd in sample], number=1) / len(sample)
+
+    # rename a directory holding a tenth of the tree
+    old_path, new_path = paths[1], paths[1] + '.moved'
+
+    def move_in_dict():
+        prefix = old_path + '/'
+        for wd, path in wds.items():
+            if path == old_path or path.startswith(prefix):
+                wds[wd] = new_path + path[len(old_path):]
+
+    dict_move_time = timeit(move_in_dict, number=1)
+    table_move_time = timeit(lambda: table.move(old_path, new_path), number=1)
+
+    return dict_size, table_size, dict_time, table_time, dict_move_time, table_move_time
+
+
+def main():
+    print('%10s %12s %13s %13s %14s %15s %16s' % (
+        'dirs', 'dict (B/dir)', 'table (B/dir)', 'dict (us/get)', 'table (us/get)', 'dict move (ms)', 'table move (ms)'
+    ))
+    for count in (10000, 100000, 1000000):
+        dict_size, table_size, dict_time, table_time, dict_move_time, table_move_time = bench(count)
+        print('%10d %12.0f %13.0f %13.2f %14.2f %15.1f %16.1f' % (
+            count, dict_size / count, table_size / count, dict_time * 1e6, table_time * 1e6,
+            dict_move_time * 1e3, table_move_time * 1e3
+        ))
+
+
+if __name__ == '__main__':
+    main()
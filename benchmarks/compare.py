@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+'''Compare two results files of benchmarks.bench_end_to_end:
+
+    python -m benchmarks.compare before.json after.json
+'''
+
+import json
+import sys
+
+# metrics where a higher value is better
+HIGHER_IS_BETTER = ('_per_s',)
+# metrics where a lower value is better
+LOWER_IS_BETTER = ('_s', '_ms', '_kb_per_1k_watches')
+
+
+def flatten(results, prefix=''):
+    '''Return {dotted.name: value} of the numeric values in `results`'''
+    values = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            values.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(before, after):
+    '''Yield (metric, before, after, relative change, verdict) for the
+    metrics in both `before` and `after` (meta data excluded). The verdict
+    is 'better', 'worse' or '' (unchanged or neither)'''
+    before = flatten({k: v for k, v in before.items() if k != 'meta'})
+    after = flatten({k: v for k, v in after.items() if k != 'meta'})
+
+    for name in sorted(set(before) & set(after)):
+        old, new = before[name], after[name]
+        change = (new - old) / old if old else 0
+        if new == old:
+            verdict = ''
+        elif name.endswith(HIGHER_IS_BETTER):
+            verdict = 'better' if new > old else 'worse'
+        elif name.endswith(LOWER_IS_BETTER):
+            verdict = 'better' if new < old else 'worse'
+        else:
+            verdict = ''
+        yield name, old, new, change, verdict
+
+
+def main(argv):
+    if len(argv) != 3:
+        sys.exit(__doc__.strip())
+
+    with open(argv[1]) as fp:
+        before = json.load(fp)
+    with open(argv[2]) as fp:
+        after = json.load(fp)
+
+    print('%-45s %14s %14s %9s' % ('metric', 'before', 'after', 'change'))
+    for name, old, new, change, verdict in compare(before, after):
+        print('%-45s %14.4g %14.4g %+8.1f%% %s' % (name, old, new, change * 100, verdict))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,41 @@
+'''Generate synthetic directory trees for the benchmarks'''
+
+import os
+from os.path import join
+
+
+def make_tree(basedir, depth=3, fanout=8, files_per_dir=10, file_size=64):
+    '''Create under `basedir` a tree `depth` levels deep where every
+    directory has `fanout` subdirectories and `files_per_dir` files.
+
+    @return tuple (directories, files) the paths created (basedir included)
+    '''
+    content = b'x' * file_size
+    dirs = [basedir]
+    files = []
+    level = [basedir]
+
+    os.makedirs(basedir, exist_ok=True)
+    for current_depth in range(depth + 1):
+        next_level = []
+        for path in level:
+            for i in range(files_per_dir):
+                file_path = join(path, 'file_%d.txt' % i)
+                with open(file_path, 'wb') as fp:
+                    fp.write(content)
+                files.append(file_path)
+            if current_depth < depth:
+                for i in range(fanout):
+                    dir_path = join(path, 'dir_%d' % i)
+                    os.mkdir(dir_path)
+                    next_level.append(dir_path)
+        dirs.extend(next_level)
+        level = next_level
+
+    return dirs, files
+
+
+def count_tree(depth, fanout, files_per_dir):
+    '''Return the number of (directories, files) `make_tree` creates'''
+    dirs = sum(fanout ** i for i in range(depth + 1))
+    return dirs, dirs * files_per_dir
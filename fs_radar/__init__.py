@@ -1,22 +1,62 @@
-from collections import namedtuple
+from collections import Counter, OrderedDict, namedtuple
+import errno
+from functools import lru_cache
 import logging
+from operator import attrgetter
 import os
 from os.path import join
+from time import time_ns
 
 from chromalog.mark.helpers.simple import important
-from inotify_simple import INotify, flags, masks
+from inotify_simple import flags
+
+from fs_radar.stat_poller import StatPoller
+from fs_radar.watch_backend import InotifyBackend
+from fs_radar.watch_table import WatchTable
 
 logger = logging.getLogger(__spec__.name)
 
 FsRadarEvent = namedtuple('FsRadarEvent', ['FILE_MATCH', 'FILE_GONE'])
 
+# events changing the entries of the watched directory
+MASK_DIR_CHANGED = flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO
+
+# after a queue overflow the files modified since the last read, minus
+# this margin (timestamps' granularity), are considered changed
+RESYNC_MARGIN_NS = 10 ** 9
+
+# seconds to wait for the MOVED_TO paired to a MOVED_FROM before deciding
+# that the entry was moved out of the watched directories
+MOVE_PAIRING_TIMEOUT = 0.1
+# max number of MOVED_FROM waiting for their MOVED_TO
+MAX_PENDING_MOVES = 1024
+
 
 class FsRadar:
 
-    def __init__(self, dir_filter, observer):
-        self.inotify = INotify()
-        self.watch_flags = flags.CREATE | flags.DELETE | flags.MODIFY | flags.DELETE_SELF
-        self.watch_flags = masks.ALL_EVENTS
+    def __init__(self, dir_filter, observer, cache_size=4096, max_watches=None, poll_interval=2,
+                 max_poll_interval=None, backend=None, subtree_filter=None):
+        '''
+        @param func dir_filter given the path of a new directory, return
+                    whether it must be watched
+        @param Observer observer where to notify the FsRadarEvent events
+        @param int cache_size size of the cache of `dir_filter` decisions
+        @param int max_watches max number of watches of `backend` to use,
+                   the directories exceeding it are polled (default: no
+                   limit besides the kernel one)
+        @param int poll_interval seconds between two polls of a busy directory
+        @param int max_poll_interval seconds between two polls of a quiet
+                   directory (default: 16 times `poll_interval`)
+        @param WatchBackend backend source of the events (default: inotify)
+        @param func subtree_filter given the path of a new directory, return
+                    whether it or its descendants may be watched (default:
+                    only the descendants of watched directories may be)
+        '''
+        self.backend = backend if backend is not None else InotifyBackend()
+        # where the directories go when the backend is out of watches
+        self.poller = self.backend if self.backend.polled else StatPoller(poll_interval, max_poll_interval)
+        self.max_watches = max_watches if self.backend.limited_watches else None
+        self.watches_count = 0
         self.watch_flags = \
             flags.CREATE | \
             flags.DELETE | \
@@ -27,20 +67,117 @@ class FsRadar:
             flags.MOVED_TO | \
             flags.EXCL_UNLINK
 
-        self.wds = {}
-        self.dir_filter = dir_filter
+        self.wds = WatchTable()
+        # (inode, mtime) of the directories watched by the backend as of the last read
+        self.dir_index = {}
+        self.last_read_ns = time_ns()
+        self.cache_size = cache_size
+        self.set_dir_filter(dir_filter, subtree_filter)
         self.observer = observer
+        self.loop = None
+        # cookie => (path, is dir, timeout handle) of the MOVED_FROM events
+        # waiting for their MOVED_TO
+        self.pending_moves = OrderedDict()
+        # EventRecorder writing the events read, if any
+        self.recorder = None
+        # counters exposed by the metrics
+        self.events_by_mask = Counter()
+        self.queue_overflows = 0
+
+    def set_dir_filter(self, dir_filter, subtree_filter=None):
+        '''Use `dir_filter` to decide whether a new directory must be watched
+        (and `subtree_filter` whether to look for watchable directories under
+        it). Its decisions are kept in a LRU cache (emptied by the next call).'''
+        self.dir_filter = lru_cache(maxsize=self.cache_size)(dir_filter)
+        self.subtree_filter = subtree_filter
 
-    def add_watch(self, path):
+    def add_watch(self, path, poll=False):
+        '''Watch `path` using the backend or, if `poll` is True or the
+        backend is out of watches, by polling it'''
         if not ((self.watch_flags & flags.ONLYDIR) and not os.path.isdir(path)):
-            wd = self.inotify.add_watch(path, self.watch_flags)
+            if not poll and self.max_watches is not None and self.watches_count >= self.max_watches:
+                poll = True
+
+            if not poll or self.backend.polled:
+                try:
+                    wd = self.backend.add_watch(path, self.watch_flags)
+                except OSError as e:
+                    if e.errno != errno.ENOSPC:
+                        raise
+                    logger.warning('Out of watches, from now on new directories will be polled')
+                    self.max_watches = self.watches_count
+                    poll = True
+                else:
+                    poll = False
+                    if wd not in self.wds:  # the same directory gets the same wd
+                        self.watches_count += 1
+
+            if poll:
+                wd = self.poller.add_watch(path)
+                logger.debug('Poll %s', important(path))
+            else:
+                logger.debug('Watch %s', important(path))
+                if not self.is_polled(wd):
+                    self.update_dir_index(wd, path)
+
             self.wds[wd] = path
-            logger.debug('Watch %s', important(path))
 
     def rm_watch(self, wd):
         logger.debug('Stop Watching %s', important(self.wds[wd]))
-        self.inotify.rm_watch(wd)
-        self.wds.pop(wd)
+        self.get_backend(wd).rm_watch(wd)
+        self.forget_watch(wd)
+
+    def forget_watch(self, wd):
+        '''Remove the watch descriptor `wd` (already removed from its
+        backend) from the watches' table'''
+        if self.get_backend(wd) is self.backend:
+            self.watches_count -= 1
+        self.dir_index.pop(wd, None)
+        return self.wds.pop(wd)
+
+    def rm_rejected_watches(self):
+        '''Stop watching the directories the dir filter no longer accepts
+        (e.g. after a call to set_dir_filter)
+
+        @return list the paths no longer watched
+        '''
+        paths = []
+        for wd, path in list(self.wds.items()):
+            if not self.dir_filter(path):
+                try:
+                    self.rm_watch(wd)
+                except OSError:
+                    # already gone, the IGNORED event will find it forgotten
+                    self.forget_watch(wd)
+                paths.append(path)
+        return paths
+
+    def get_subtree_wds(self, path):
+        '''Return the watch descriptors of `path` and of its descendants'''
+        return self.wds.get_subtree_wds(path)
+
+    def move_watches(self, old_path, new_path):
+        '''The directory at `old_path` was renamed `new_path`: rewrite the
+        paths of the watches of its subtree (the watches themselves follow
+        the directories).
+
+        @return list the watch descriptors moved
+        '''
+        wds = self.wds.move(old_path, new_path)
+        for wd in wds:
+            backend = self.get_backend(wd)
+            if backend.tracks_paths:
+                backend.rename_watch(wd, self.wds[wd])
+        logger.debug('Moved %d watches to %s', len(wds), important(new_path))
+        return wds
+
+    def is_polled(self, wd):
+        '''Is the watch descriptor `wd` handled by a polling backend?'''
+        return wd < 0
+
+    def get_backend(self, wd):
+        '''Return the backend of the watch descriptor `wd`'''
+        return self.poller if self.is_polled(wd) else self.backend
 
     def __enter__(self):
         return self
@@ -49,16 +186,119 @@ class FsRadar:
         self.close()
 
     def close(self):
-        logger.debug('Close inotify descriptor')
-        return self.inotify.close()
+        self.backend.close()
+        if self.poller is not self.backend:
+            self.poller.close()
+
+    def attach(self, loop):
+        '''Handle the events of the backends inside the event loop `loop`'''
+        self.loop = loop
+        self.backend.attach(loop, self.on_events)
+        if self.poller is not self.backend:
+            self.poller.attach(loop, self.on_events)
+
+    def detach(self):
+        '''Stop handling the events'''
+        self.backend.detach()
+        if self.poller is not self.backend:
+            self.poller.detach()
+        self.loop = None
+
+    def update_dir_index(self, wd, path):
+        '''Remember inode and mtime of the directory watched by `wd`'''
+        if self.backend.offline:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.dir_index.pop(wd, None)
+        else:
+            self.dir_index[wd] = (st.st_ino, st.st_mtime_ns)
+
+    def on_events(self, events):
+        '''Handle the `events` reported by a backend'''
+        previous_read_ns, self.last_read_ns = self.last_read_ns, time_ns()
+        changed_wds = set()
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        if self.recorder is not None:
+            self.recorder.record(events, self.wds)
+        self.events_by_mask.update(map(attrgetter('mask'), events))
+
+        for event in events:
+            if debug:
+                logger.debug('New event: %r', event)
+                for flag in flags.from_mask(event.mask):
+                    logger.debug('-> flag: %s', flag)
+            if flags.Q_OVERFLOW & event.mask:
+                self.on_queue_overflow(previous_read_ns)
+                continue
+            if MASK_DIR_CHANGED & event.mask and not self.is_polled(event.wd):
+                changed_wds.add(event.wd)
+            self.on_watch_event(event)
+
+        for wd in changed_wds:
+            if wd in self.wds:
+                self.update_dir_index(wd, self.wds[wd])
+
+    def on_queue_overflow(self, last_read_ns):
+        '''Some events were lost: look for what changed since
+        `last_read_ns` (nanoseconds since the epoch) in the watched
+        directories and emit the events we missed.
+
+        Only the directories whose inode or mtime changed are checked for
+        new subdirectories, but every watched directory is looked for
+        recently modified files (a file written in place doesn't change
+        the mtime of its directory). Unwatched subtrees are never entered.
+        '''
+        self.queue_overflows += 1
+        if self.backend.offline:
+            logger.warning('Event queue overflow (the file system is not checked)')
+            return
+
+        logger.warning('Event queue overflow, looking for lost changes')
+        since_ns = last_read_ns - RESYNC_MARGIN_NS
+
+        for wd, path in list(self.wds.items()):
+            if self.is_polled(wd) or wd not in self.wds:
+                continue
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+
+            if st is None or (wd in self.dir_index and st.st_ino != self.dir_index[wd][0]):
+                # the IGNORED event got lost too
+                try:
+                    self.backend.rm_watch(wd)
+                except OSError:
+                    pass
+                self.forget_watch(wd)
+                self.on_file_gone(path)
+                continue
+
+            dir_changed = (st.st_ino, st.st_mtime_ns) != self.dir_index.get(wd)
+            self.dir_index[wd] = (st.st_ino, st.st_mtime_ns)
+
+            for entry in self.list_dir(path):
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if dir_changed and self.wds.get_wd(entry.path) is None:
+                            self.on_new_dir(entry.path)
+                    elif entry.stat(follow_symlinks=False).st_mtime_ns >= since_ns:
+                        self.on_file_write(entry.path)
+                except OSError:
+                    continue
 
     def on_watch_event(self, event):
         MASK_NEW_DIR = flags.CREATE | flags.ISDIR
 
-        if logging.getLogger().isEnabledFor(logging.DEBUG):
-            logger.debug('New event: %r', event)
-            for flag in flags.from_mask(event.mask):
-                logger.debug('-> flag: %s', flag)
+        if event.wd not in self.wds:
+            # the watch was removed while its events were queued (e.g. the
+            # directory moved out in the same batch)
+            logger.debug('Event of a watch already removed, ignored')
+            return
 
         if MASK_NEW_DIR == MASK_NEW_DIR & event.mask:
             new_dir_path = join(self.wds[event.wd], event.name)
@@ -71,22 +311,124 @@ class FsRadar:
             # we are watching a file
             logger.debug('Watching file, file touched')
             self.on_file_write(self.wds[event.wd])
+        elif flags.MOVED_FROM & event.mask:
+            self.on_moved_from(event)
+        elif flags.MOVED_TO & event.mask:
+            self.on_moved_to(event)
         elif flags.IGNORED & event.mask:
             # inotify_rm_watch was called automatically
             # (file/directory removed/unmounted)
-            path = self.wds[event.wd]
-            self.wds.pop(event.wd)
+            path = self.forget_watch(event.wd)
             self.on_file_gone(path)
 
     def on_new_dir(self, path):
-        if self.dir_filter(path):
-            self.add_watch(path)
+        '''Watch the new directory at `path` and its subdirectories'''
+        stack = [path]
+        while stack:
+            path = stack.pop()
+            watched = self.dir_filter(path)
+            if watched:
+                self.add_watch(path)
+            elif not (self.subtree_filter and self.subtree_filter(path)):
+                continue
 
             # If files have been added immediately to the directory we
             # missed the events, so we emit them artificially (with
             # the risk of having some repeated events)
-            for fName in os.listdir(path):
-                self.on_file_write(join(new_dir_path, fName))
+            for entry in self.list_dir(path):
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir:
+                    stack.append(entry.path)
+                elif watched:
+                    self.on_file_write(entry.path)
+
+    def on_moved_from(self, event):
+        '''An entry was moved away from a watched directory, maybe to
+        another one: wait for the MOVED_TO with the same cookie'''
+        path = join(self.wds[event.wd], event.name)
+        is_dir = bool(flags.ISDIR & event.mask)
+
+        if not event.cookie:
+            # the backend can't pair the events
+            self.on_moved_out(path, is_dir)
+            return
+
+        handle = self.loop.call_later(MOVE_PAIRING_TIMEOUT, self.on_move_expired, event.cookie) if self.loop else None
+        self.pending_moves[event.cookie] = (path, is_dir, handle)
+
+        if len(self.pending_moves) > MAX_PENDING_MOVES:
+            self.on_move_expired(next(iter(self.pending_moves)))
+
+    def on_move_expired(self, cookie):
+        '''No MOVED_TO came for the MOVED_FROM with `cookie`: the entry
+        left the watched directories'''
+        path, is_dir, handle = self.pending_moves.pop(cookie)
+        if handle:
+            handle.cancel()
+        self.on_moved_out(path, is_dir)
+
+    def expire_pending_moves(self):
+        '''Stop waiting for the MOVED_TO events'''
+        for cookie in list(self.pending_moves):
+            self.on_move_expired(cookie)
+
+    def on_moved_to(self, event):
+        path = join(self.wds[event.wd], event.name)
+        is_dir = bool(flags.ISDIR & event.mask)
+        pending = self.pending_moves.pop(event.cookie, None) if event.cookie else None
+
+        if pending is None:
+            self.on_moved_in(path, is_dir)
+            return
+
+        old_path, _, handle = pending
+        if handle:
+            handle.cancel()
+
+        self.on_file_gone(old_path)
+        if not is_dir:
+            self.on_file_write(path)
+            return
+
+        moved_wds = self.move_watches(old_path, path)
+        if not moved_wds:
+            self.on_new_dir(path)
+        for wd in moved_wds:
+            dir_path = self.wds[wd]
+            if not self.dir_filter(dir_path):
+                self.rm_watch(wd)
+                continue
+            for entry in self.list_dir(dir_path):
+                try:
+                    if not entry.is_dir(follow_symlinks=False):
+                        self.on_file_write(entry.path)
+                except OSError:
+                    continue
+
+    def on_moved_out(self, path, is_dir):
+        '''The entry at `path` was moved out of the watched directories'''
+        if is_dir:
+            for wd in self.get_subtree_wds(path):
+                try:
+                    self.rm_watch(wd)
+                except OSError:
+                    self.forget_watch(wd)
+        self.on_file_gone(path)
+
+    def on_moved_in(self, path, is_dir):
+        '''The entry at `path` was moved in from somewhere not watched'''
+        if is_dir:
+            self.on_new_dir(path)
+        else:
+            self.on_file_write(path)
+
+    def list_dir(self, path):
+        '''Return the entries of the directory at `path` (none if the
+        events don't come from the file system)'''
+        return [] if self.backend.offline else _scandir(path)
 
     def on_file_write(self, path):
         '''A write /directory at `path` was either unlinked, moved or unmounted'''
@@ -96,7 +438,19 @@ class FsRadar:
         '''The file/directory at `path` was either unlinked, moved or unmounted'''
         self.observer.notify(FsRadarEvent.FILE_GONE, path)
 
-    def run_forever(self):
-        while True:
-            for event in self.inotify.read(read_delay=30, timeout=2000):
-                self.on_watch_event(event)
+    def run_forever(self, loop):
+        '''Handle the events until the event loop `loop` is stopped'''
+        self.attach(loop)
+        try:
+            loop.run_forever()
+        finally:
+            self.detach()
+
+
+def _scandir(path):
+    '''Return the entries of the directory at `path` (none if it's gone)'''
+    try:
+        with os.scandir(path) as it:
+            return list(it)
+    except OSError:
+        return []
@@ -1,23 +1,34 @@
 #!/usr/bin/env python
 
 import argparse
-from itertools import chain
+import asyncio
 import logging
-from multiprocessing import Queue
 import os
 from os.path import relpath
 import sys
-import threading
 
 import chromalog
+from inotify_simple import flags
 
 from fs_radar import FsRadar, FsRadarEvent
-from fs_radar.cmd_launch_pad import CmdLaunchPad
-from fs_radar.config import load_from_toml, ConfigException
+from fs_radar.config import load_from_toml, ConfigException, SHAREABLE_CONFIGURATIONS
+from fs_radar.event_log import EventRecorder, ReplayBackend
+from fs_radar.fanotify_backend import FanotifyBackend
+from fs_radar.groups import (
+    get_dir_filter, get_dirs_to_watch, get_rules, get_subtree_filter, make_launch_pad, make_launch_pads_notifier
+)
 from fs_radar.logging_config import BASE, VERBOSE, QUIET
+from fs_radar.metrics import (
+    MetricsServer, collect_launch_pads_metrics, collect_radar_metrics, collect_scheduler_metrics
+)
 from fs_radar.observer import Observer
-from fs_radar.path_filter import makePathFilter, makeDirFilter
-from fs_radar.picky_eater import PickyEater, bulk_consume
+from fs_radar.path_dispatcher import PathDispatcher
+from fs_radar.path_filter import makeDirFilter, makeSubtreeFilter
+from fs_radar.scheduler import ProcessScheduler
+from fs_radar.stat_poller import StatPoller
+from fs_radar.tree_index import TreeIndex, make_index_key
+from fs_radar.watch_backend import InotifyBackend, get_fs_type, is_inotify_blind
+from fs_radar.watch_budget import get_watches_budget, get_subtree_roots, sort_dirs_by_priority
 
 logger = logging.getLogger(__spec__.name)
 
@@ -30,34 +41,19 @@ class NoPathsToWatchException(FsRadarException):
     pass
 
 
-class BaseDirNotExistsException(FsRadarException):
+class DaemonNotRunningException(FsRadarException):
     pass
 
 
-def get_subdirs(path):
-    '''Generator to iterate over the subdirectories under `path`.
-    The root (`path`) is the first element yielded'''
-
-    return (x[0] for x in os.walk(path))
-
-
-def get_dirs_to_watch(basedir, path_filter):
-    '''
-    Generator to iterate over all the directories that are matched
-    by `path_filter`.
-    It yields paths relative to `basedir`.
-    '''
-
-    for path in get_subdirs(basedir):
-        if path_filter(os.path.relpath(path, basedir)):
-            yield path
+class BaseDirNotExistsException(FsRadarException):
+    pass
 
 
 def get_config(args):
     '''Get the watch configuration for FsRadar'''
 
     if args.config:
-        return load_from_toml(args.config)
+        return load_from_toml(args.config[0])
     else:
         cfg = {'fs_radar': {'basedir': ''}, 'group': {'default': {}}}
         cfg['fs_radar']['basedir'] = args.basedir
@@ -68,16 +64,15 @@ def get_config(args):
         return cfg
 
 
-def get_dir_filter(groups):
-    return makeDirFilter(sorted(set(chain(
-        *(d['rules'] for d in groups.values())
-    ))))
+def is_exclusion_rule(rule):
+    '''Does `rule` exclude paths (or restore excluded ones)?'''
+    return rule.startswith('!') or rule.startswith('+')
 
 
-def make_launch_pads_notifier(picky_launch_pads, basedir):
-    '''Request a command execution from each launch_pad whose
-    filters match `path`'''
-    return lambda ev: bulk_consume(picky_launch_pads, relpath(ev.data, basedir))
+def make_abspath_filter(path_filter, basedir):
+    '''Adapt `path_filter`, that accepts paths relative to `basedir`,
+    to accept absolute paths'''
+    return lambda path: path_filter(relpath(path, basedir))
 
 
 def get_args_parser():
@@ -87,9 +82,9 @@ def get_args_parser():
     parser.add_argument('-b', '--basedir', action='store',
                               default=os.path.abspath(os.getcwd()),
                               help='the base directory of the files to watch')
-    parser.add_argument('-c', '--config', action='store', default=None,
+    parser.add_argument('-c', '--config', action='append', default=[],
                               type=lambda config_path: os.path.join(os.getcwd(), config_path),
-                              help='path to a config file')
+                              help='path to a config file (it can be repeated with --daemon)')
     parser.add_argument('-i', '--include', action='append', default=[],
                               help='include this path')
     parser.add_argument('-e', '--exclude', action='append', default=[],
@@ -105,6 +100,29 @@ def get_args_parser():
                                    'Any occurrence of {} is replaced by the path of the file')
     parser.add_argument('-q', '--quiet', action='store_true', default=False,
                               help='Keep output to a minimum')
+    parser.add_argument('--record', action='store', metavar='FILE', type=os.path.abspath,
+                        help='write the file system events to FILE (see --replay)')
+    parser.add_argument('--replay', action='store', metavar='FILE', type=os.path.abspath,
+                        help='instead of watching basedir, feed the events recorded in FILE '
+                             '(by --record) to the configured groups, then exit')
+    parser.add_argument('--speed', action='store', type=float, default=1,
+                        help='replay the events N times faster (0: as fast as possible)')
+    parser.add_argument('--daemon', action='store_true', default=False,
+                        help='host the projects of every config file in a single process '
+                             '(more can be registered later through the control socket)')
+    parser.add_argument('--socket', action='store', metavar='PATH', type=os.path.abspath,
+                        help='control socket of the daemon (default: fs_radar.sock '
+                             'in $XDG_RUNTIME_DIR or /tmp/fs_radar-UID.sock)')
+    parser.add_argument('--register', action='store', metavar='CONFIG', type=os.path.abspath,
+                        help='ask the daemon to host the project of CONFIG')
+    parser.add_argument('--unregister', action='store', metavar='CONFIG', type=os.path.abspath,
+                        help='ask the daemon to stop hosting the project of CONFIG')
+    parser.add_argument('--list-projects', action='store_true', default=False,
+                        help='list the projects hosted by the daemon')
+    parser.add_argument('--max-concurrent-processes', action='store', type=int, default=0, metavar='N',
+                        help='let the daemon run at most N commands at once (default: no limit)')
+    parser.add_argument('--max-load', action='store', type=float, metavar='LOAD',
+                        help='let the daemon start a command only while the load average is below LOAD')
     return parser
 
 
@@ -121,58 +139,390 @@ def setup_logs(args):
     chromalog.basicConfig(**log_conf)
 
 
-def get_pairs_filter2launch_pads(cfg):
-    '''Generate a list o pairs (path_filter, launch pad)'''
+def get_pairs_rules2launch_pads(cfg):
+    '''Generate a list o pairs (rules, launch pad)'''
     for name, group in cfg['group'].items():
-        path_filter = makePathFilter(group['rules'])
-        lp = CmdLaunchPad(group['cmd'], options={**group, 'name': name})
-        yield (path_filter, lp)
+        yield make_launch_pad(name, group)
+
+
+def make_watch_backend(cfg, basedir):
+    '''Create the backend chosen by the option `backend`: "inotify",
+    "fanotify", "poll" or "auto" (poll if inotify can't see the changes
+    on the file system of `basedir`, e.g. NFS or FUSE, else inotify)'''
+    backend = cfg['fs_radar'].get('backend', 'auto')
+    poll_interval = cfg['fs_radar'].get('poll_interval', 2)
+
+    if backend == 'auto':
+        fs_type = get_fs_type(basedir)
+        backend = 'poll' if is_inotify_blind(fs_type) else 'inotify'
+        logger.info('File system %s, watch backend %s', fs_type, backend)
+
+    if backend == 'inotify':
+        return InotifyBackend()
+    elif backend == 'fanotify':
+        try:
+            return FanotifyBackend()
+        except OSError as e:
+            raise ConfigException('The fanotify backend is not available: %s' % e.strerror) from None
+    elif backend == 'poll':
+        return StatPoller(poll_interval, cfg['fs_radar'].get('max_poll_interval'))
+    else:
+        raise ConfigException('Unknown watch backend \'%s\'' % backend)
+
+
+def make_metrics_server(cfg, fsr, launch_pads, scheduler=None):
+    '''Return the MetricsServer configured by the option `metrics`, if any'''
+    address = cfg['fs_radar'].get('metrics')
+    if not address:
+        return None
+
+    try:
+        return MetricsServer(
+            address,
+            lambda: collect_radar_metrics(fsr) + collect_launch_pads_metrics(launch_pads) +
+            (collect_scheduler_metrics(scheduler) if scheduler else [])
+        )
+    except ValueError as e:
+        raise ConfigException(e) from None
+
+
+def make_scheduler(cfg):
+    '''Return the ProcessScheduler configured by the options
+    `max_concurrent_processes`, `max_load` and `min_available_memory_mb`,
+    if any'''
+    options = cfg['fs_radar']
+    if not any(options.get(key) for key in ('max_concurrent_processes', 'max_load', 'min_available_memory_mb')):
+        return None
+
+    min_available_memory = options.get('min_available_memory_mb')
+    return ProcessScheduler(
+        max_processes=options.get('max_concurrent_processes') or 0,
+        max_load=options.get('max_load'),
+        min_available_memory=min_available_memory * 1024 * 1024 if min_available_memory else None
+    )
+
+
+def split_dirs_by_watch_budget(paths, cfg, budget):
+    '''Split `paths` in the directories to watch with inotify and the ones
+    to poll, because they exceed the `budget` of inotify watches.
+
+    @return tuple (paths to watch, paths to poll)
+    '''
+    if budget is None or len(paths) <= budget:
+        return paths, []
+
+    paths = sort_dirs_by_priority(paths, cfg['group'], cfg['fs_radar']['basedir'])
+    paths_to_watch, paths_to_poll = paths[:budget], paths[budget:]
+
+    roots = get_subtree_roots(paths_to_poll)
+    logger.warning(
+        '%d directories exceed the inotify watches available (%d): they will be polled '
+        '(%d subtrees, see `poll_interval`)', len(paths_to_poll), budget, len(roots)
+    )
+    for root in roots:
+        logger.warning('Polled subtree: %s', root)
+
+    return paths_to_watch, paths_to_poll
+
 
+class ConfigReloader:
+    '''Watch the config file and apply its changes without restarting:
+    only the launch pads of the groups that changed are stopped or
+    started and only the directories the new rules accept (or reject)
+    are watched (or not anymore).
 
-def start(cfg):
+    The options of the field [fs_radar] that aren't shared with the
+    groups (e.g. basedir or backend) require a restart.
+    '''
+
+    # seconds to wait for the editor to finish writing the file
+    RELOAD_DELAY = 0.1
+
+    def __init__(self, config_path, cfg, fsr, dispatcher, launch_pads, index=None, scheduler=None):
+        '''
+        @param string config_path path of the config file
+        @param dict cfg the config in use
+        @param FsRadar fsr
+        @param PathDispatcher dispatcher where the launch pads are registered
+        @param list launch_pads the launch pads running (updated in place)
+        @param TreeIndex index the index of the tree, if any
+        @param ProcessScheduler scheduler shared by the launch pads, if any
+        '''
+        self.config_path = config_path
+        self.cfg = cfg
+        self.fsr = fsr
+        self.dispatcher = dispatcher
+        self.launch_pads = launch_pads
+        self.index = index
+        self.scheduler = scheduler
+        self.loop = None
+        self.reload_handle = None
+
+        config_dir = os.path.dirname(config_path)
+        self.backend = StatPoller(1) if is_inotify_blind(get_fs_type(config_dir)) else InotifyBackend()
+        self.backend.add_watch(config_dir, flags.CLOSE_WRITE | flags.MOVED_TO)
+
+    def attach(self, loop):
+        self.loop = loop
+        self.backend.attach(loop, self.on_events)
+
+    def close(self):
+        if self.loop:
+            self.backend.detach()
+        if self.reload_handle:
+            self.reload_handle.cancel()
+            self.reload_handle = None
+        self.backend.close()
+        self.loop = None
+
+    def on_events(self, events):
+        name = os.path.basename(self.config_path)
+        if any(event.name == name for event in events):
+            if self.reload_handle:
+                self.reload_handle.cancel()
+            self.reload_handle = self.loop.call_later(self.RELOAD_DELAY, self.reload)
+
+    def reload(self):
+        '''Load the config file again and apply it
+
+        @return bool whether the config was valid
+        '''
+        self.reload_handle = None
+        try:
+            cfg = load_from_toml(self.config_path)
+        except (ConfigException, OSError) as e:
+            logger.error('Config not reloaded: %s', e)
+            return False
+
+        self.apply(cfg)
+        return True
+
+    def apply(self, cfg):
+        '''Switch from the current config to `cfg`'''
+        old_cfg = self.cfg
+
+        # the global options not shared with the groups can't change
+        fixed = set(old_cfg['fs_radar']) | set(cfg['fs_radar'])
+        fixed.difference_update(SHAREABLE_CONFIGURATIONS)
+        changed = sorted(key for key in fixed if old_cfg['fs_radar'].get(key) != cfg['fs_radar'].get(key))
+        if changed:
+            logger.warning('Restart fs_radar to apply the changes of %s', ', '.join(changed))
+        cfg['fs_radar'] = {
+            **{key: value for key, value in cfg['fs_radar'].items() if key not in fixed},
+            **{key: value for key, value in old_cfg['fs_radar'].items() if key in fixed},
+        }
+
+        old_groups, new_groups = old_cfg['group'], cfg['group']
+        launch_pads = {lp.options['name']: lp for lp in self.launch_pads}
+
+        for name, group in old_groups.items():
+            if new_groups.get(name) != group:
+                lp = launch_pads[name]
+                self.dispatcher.remove(lp)
+                self.launch_pads.remove(lp)
+                lp.close()
+                logger.info('Group %s stopped', name)
+
+        for name, group in new_groups.items():
+            if old_groups.get(name) != group:
+                rules, lp = make_launch_pad(name, group)
+                lp.attach(self.loop, self.scheduler)
+                self.dispatcher.add(lp, rules)
+                self.launch_pads.append(lp)
+                logger.info('Group %s started', name)
+
+        self.cfg = cfg
+
+        old_rules, new_rules = get_rules(old_groups), get_rules(new_groups)
+        if old_rules != new_rules:
+            self.update_watches(old_rules, new_rules)
+
+    def update_watches(self, old_rules, new_rules):
+        '''Watch the directories accepted by `new_rules` but not by
+        `old_rules` and stop watching the ones they reject'''
+        basedir = self.cfg['fs_radar']['basedir']
+        dir_filter = makeDirFilter(new_rules)
+        subtree_filter = makeSubtreeFilter(new_rules)
+        self.fsr.set_dir_filter(
+            make_abspath_filter(dir_filter, basedir),
+            make_abspath_filter(subtree_filter, basedir)
+        )
+        if self.index:
+            self.index.key = make_index_key(basedir, new_rules)
+
+        removed = self.fsr.rm_rejected_watches()
+
+        added_rules = set(new_rules) - set(old_rules)
+        removed_rules = set(old_rules) - set(new_rules)
+        if any(map(is_exclusion_rule, added_rules | removed_rules)):
+            # the exclusions changed, any directory may be accepted now
+            scan_filter = subtree_filter
+        elif added_rules:
+            # look only where the new rules may match
+            scan_filter = makeSubtreeFilter(list(added_rules) + list(filter(is_exclusion_rule, new_rules)))
+        else:
+            scan_filter = None
+
+        added = 0
+        if scan_filter:
+            for path in get_dirs_to_watch(
+                basedir,
+                dir_filter,
+                subtree_filter=scan_filter,
+                workers=self.cfg['fs_radar'].get('scan_workers')
+            ):
+                path = os.path.abspath(path)
+                if self.fsr.wds.get_wd(path) is None:
+                    self.fsr.add_watch(path)
+                    added += 1
+
+        logger.info('Config reloaded: %d directories watched, %d not anymore', added, len(removed))
+
+
+def start(cfg, config_path=None, record_path=None, replay_path=None, replay_speed=1):
     '''Start the program.
 
     This function will continue to run until an exception is raised
-    (commonly KeyboardInterrupt via CTRL-C).
+    (commonly KeyboardInterrupt via CTRL-C) or, when replaying the events
+    recorded at `replay_path`, until the replay ends.
+
+    @param string config_path the config file, reloaded when it changes
+    @param string record_path where to record the events, if anywhere
+    @param string replay_path event log to replay, if any
+    @param float replay_speed how much faster than recorded to replay
     '''
     basedir = cfg['fs_radar']['basedir']
     os.chdir(basedir)
 
     dir_filter = get_dir_filter(cfg['group'])
+    cache_size = cfg['fs_radar'].get('cache_size', 4096)
+
+    dispatcher = PathDispatcher(cache_size=cache_size)
+    launch_pads = []
+    for rules, lp in get_pairs_rules2launch_pads(cfg):
+        dispatcher.add(lp, rules)
+        launch_pads.append(lp)
 
-    paths_to_watch = list(get_dirs_to_watch(basedir, dir_filter))
+    index_file = None if replay_path else cfg['fs_radar'].get('index_file')
+    changed_paths = []
+    gone_paths = []
+    index = None
+
+    if replay_path:
+        backend = ReplayBackend(replay_path, replay_speed)
+        paths_to_watch = [path for path in backend.paths if dir_filter(relpath(path, basedir))]
+        logger.info('Replaying %d events', len(backend))
+    elif index_file:
+        index = TreeIndex.load(index_file, basedir, make_index_key(basedir, get_rules(cfg['group'])))
+        file_filter = make_abspath_filter(dispatcher.match, basedir)
+        paths_to_watch, changed_paths, gone_paths = index.refresh(
+            make_abspath_filter(dir_filter, basedir),
+            make_abspath_filter(get_subtree_filter(cfg['group']), basedir),
+            file_filter,
+            workers=cfg['fs_radar'].get('scan_workers')
+        )
+    else:
+        paths_to_watch = list(get_dirs_to_watch(
+            basedir,
+            dir_filter,
+            subtree_filter=get_subtree_filter(cfg['group']),
+            workers=cfg['fs_radar'].get('scan_workers')
+        ))
 
     if not paths_to_watch:
         raise NoPathsToWatchException('Nothing to watch')
 
     logger.debug('Paths to watch: %r', paths_to_watch)
 
-    picky_launch_pads = []
-    launch_pads = []
-    for path_filter, lp in get_pairs_filter2launch_pads(cfg):
-        plp = PickyEater(path_filter, lp.add_item_to_process)
-
-        launch_pads.append(lp)
-        picky_launch_pads.append(plp)
-
     observer = Observer()
-    on_file_match = make_launch_pads_notifier(picky_launch_pads, basedir)
+    on_file_match = make_launch_pads_notifier(dispatcher, basedir)
     observer.subscribe(FsRadarEvent.FILE_MATCH, on_file_match)
 
-    with FsRadar(dir_filter, observer) as fsr:
+    if index:
+        observer.subscribe(FsRadarEvent.FILE_MATCH, index.on_path_touched)
+        observer.subscribe(FsRadarEvent.FILE_GONE, index.on_path_touched)
+
+    if not replay_path:
+        backend = make_watch_backend(cfg, basedir)
+    if backend.limited_watches:
+        budget = get_watches_budget(cfg['fs_radar'].get('max_watches'))
+    else:
+        budget = None
+    paths_to_watch, paths_to_poll = split_dirs_by_watch_budget(paths_to_watch, cfg, budget)
+
+    loop = asyncio.new_event_loop()
+
+    with FsRadar(
+        make_abspath_filter(dir_filter, basedir),
+        observer,
+        cache_size=cache_size,
+        max_watches=budget,
+        poll_interval=cfg['fs_radar'].get('poll_interval', 2),
+        max_poll_interval=cfg['fs_radar'].get('max_poll_interval'),
+        backend=backend,
+        subtree_filter=make_abspath_filter(get_subtree_filter(cfg['group']), basedir)
+    ) as fsr:
         for path in paths_to_watch:
             fsr.add_watch(os.path.abspath(path))
+        for path in paths_to_poll:
+            fsr.add_watch(os.path.abspath(path), poll=True)
+
+        scheduler = make_scheduler(cfg)
+        metrics_server = make_metrics_server(cfg, fsr, launch_pads, scheduler)
+
+        reloader = None
+        if config_path and not replay_path:
+            reloader = ConfigReloader(config_path, cfg, fsr, dispatcher, launch_pads, index, scheduler)
+
+        if record_path:
+            fsr.recorder = EventRecorder(record_path)
+        if replay_path:
+            backend.on_finished = lambda: stop_when_idle(loop, launch_pads)
 
         try:
-            end_event = threading.Event()
+            if scheduler:
+                scheduler.attach(loop)
             for lp in launch_pads:
-                lp.set_end_event(end_event)
-                lp.start()
-
-            fsr.run_forever()
+                lp.attach(loop, scheduler)
+            if reloader:
+                reloader.attach(loop)
+
+            if metrics_server:
+                loop.run_until_complete(metrics_server.start())
+                logger.info('Metrics available at %s', metrics_server.get_url())
+
+            # changes happened while we were not running (the files deleted
+            # meanwhile are gone, as if deleted now)
+            for path in changed_paths:
+                loop.call_soon(fsr.on_file_write, path)
+            for path in gone_paths:
+                loop.call_soon(fsr.on_file_gone, path)
+
+            fsr.run_forever(loop)
         finally:
-            end_event.set()
-            [lp.join() for lp in launch_pads]
+            if reloader:
+                reloader.close()
+            [lp.close() for lp in launch_pads]
+            if scheduler:
+                scheduler.close()
+            if metrics_server:
+                metrics_server.close()
+            loop.close()
+            if fsr.recorder:
+                fsr.recorder.close()
+            if index:
+                index.update(set(os.path.normpath(path) for path in fsr.wds.values()), file_filter)
+                index.save(index_file)
+            logger.debug('Dispatch cache: %r', dispatcher.cache_info())
+            logger.debug('Directory filter cache: %r', fsr.dir_filter.cache_info())
+
+
+def stop_when_idle(loop, launch_pads, interval=0.1):
+    '''Stop the event loop `loop` once no launch pad has work to do'''
+    if any(lp.is_busy() for lp in launch_pads):
+        loop.call_later(interval, stop_when_idle, loop, launch_pads, interval)
+    else:
+        loop.stop()
 
 
 def main(argv):
@@ -182,13 +532,50 @@ def main(argv):
     setup_logs(args)
     logger.debug('Arguments: %r', args)
 
+    # imported here, the daemon uses the helpers of this module
+    from fs_radar.daemon import Daemon, get_default_socket_path, send_command
+
+    if args.register or args.unregister or args.list_projects:
+        if args.register:
+            command = 'register %s' % args.register
+        elif args.unregister:
+            command = 'unregister %s' % args.unregister
+        else:
+            command = 'list'
+        try:
+            success, lines = send_command(args.socket or get_default_socket_path(), command)
+        except OSError as e:
+            raise DaemonNotRunningException(e.strerror) from None
+        for line in lines:
+            print(line)
+        sys.exit(0 if success else 1)
+
+    if args.daemon:
+        scheduler = None
+        if args.max_concurrent_processes or args.max_load:
+            scheduler = ProcessScheduler(max_processes=args.max_concurrent_processes, max_load=args.max_load)
+        Daemon(args.socket, scheduler=scheduler).run_forever(args.config)
+        return
+
+    if len(args.config) > 1:
+        parser.error('many config files require --daemon')
+
     cfg = get_config(args)
     logger.debug('Config: %r', cfg)
 
     if not os.path.exists(cfg['fs_radar']['basedir']):
         raise BaseDirNotExistsException(cfg['fs_radar']['basedir'])
 
-    start(cfg)
+    if args.record and args.replay:
+        parser.error('--record and --replay are mutually exclusive')
+
+    start(
+        cfg,
+        config_path=args.config[0] if args.config else None,
+        record_path=args.record,
+        replay_path=args.replay,
+        replay_speed=args.speed
+    )
 
 
 if __name__ == '__main__':
@@ -205,6 +592,9 @@ if __name__ == '__main__':
     except BaseDirNotExistsException as e:
         logger.error('Path configured as `basedir` was not found: %s', e.args[0])
         sys.exit(4)
+    except DaemonNotRunningException as e:
+        logger.error('Cannot reach the daemon: %s', e.args[0])
+        sys.exit(5)
     except Exception as e:
         logger.exception(e)
         sys.exit(1)
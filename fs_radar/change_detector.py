@@ -0,0 +1,122 @@
+from collections import OrderedDict, namedtuple
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# what we remember about the content of a file
+ContentStat = namedtuple('ContentStat', ['path', 'size', 'mtime_ns', 'digest'])
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ChangeDetector:
+    '''Tell whether the content of a file changed since the last time
+    it was checked.
+
+    The (size, mtime) of the file is compared first: if both are the same
+    the file didn't change, if the size differs it did. Only when the
+    size is the same but the mtime differs (e.g. an editor saving a file
+    without modifying it) the content is hashed and compared. A file
+    never hashed before (e.g. seen for the first time) has changed, the
+    hash is kept for the next check.
+
+    Files are identified by device and inode. The inode of a file replaced
+    by a rename (as many editors do when saving) changes, so the last inode
+    seen at every path is remembered too. At most `max_entries` files are
+    remembered, the least recently checked are forgotten first.
+    '''
+
+    def __init__(self, max_entries=4096, max_hash_size=64 * 1024 * 1024):
+        '''
+        @param int max_entries max number of files remembered
+        @param int max_hash_size files bigger than this are never hashed,
+                   they changed if their mtime changed
+        '''
+        self.max_entries = max_entries
+        self.max_hash_size = max_hash_size
+        self.entries = OrderedDict()
+        self.keys_by_path = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def has_changed(self, path):
+        '''Did the content of the file at `path` change since the last check?
+
+        A file never seen before (or that can't be read) has changed.
+        '''
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True
+
+        key = (st.st_dev, st.st_ino)
+        old = self.entries.get(key)
+        if old is None or old.path != path:
+            old_key = self.keys_by_path.get(path)
+            old = self.entries.get(old_key) if old_key is not None else None
+
+        if old is not None and (old.size, old.mtime_ns) == (st.st_size, st.st_mtime_ns):
+            changed = False
+            digest = old.digest
+        elif old is None or old.size != st.st_size:
+            # no need to read the file to know it changed
+            changed = True
+            digest = None
+        else:
+            digest = self._hash(path, st.st_size)
+            changed = digest is None or old.digest is None or old.digest != digest
+
+        self._remember(key, ContentStat(path, st.st_size, st.st_mtime_ns, digest))
+
+        if changed:
+            self.misses += 1
+        else:
+            self.hits += 1
+            logger.debug('Content of %s did not change', path)
+
+        return changed
+
+    def forget(self, path):
+        '''Forget the file at `path`: its next check is a change (e.g. the
+        content seen by the last check was never handled)'''
+        key = self.keys_by_path.pop(path, None)
+        if key is not None:
+            self.entries.pop(key, None)
+
+    def _remember(self, key, entry):
+        old_key = self.keys_by_path.get(entry.path)
+        if old_key is not None and old_key != key:
+            self.entries.pop(old_key, None)
+
+        old = self.entries.get(key)
+        if old is not None and old.path != entry.path:
+            # hard link, or renamed: one path per inode
+            self.keys_by_path.pop(old.path, None)
+
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.keys_by_path[entry.path] = key
+
+        while len(self.entries) > self.max_entries:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            if self.keys_by_path.get(evicted.path) == evicted_key:
+                del self.keys_by_path[evicted.path]
+
+    def _hash(self, path, size):
+        '''Return the digest of the content of the file at `path`, or None
+        if it's too big or it can't be read'''
+        if size > self.max_hash_size:
+            return None
+        h = hashlib.blake2b(digest_size=16)
+        try:
+            with open(path, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b''):
+                    h.update(chunk)
+        except OSError:
+            return None
+        return h.digest()
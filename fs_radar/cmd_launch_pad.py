@@ -1,17 +1,28 @@
+from collections import Counter
+from functools import partial
 import hashlib
 import logging
-from multiprocessing import Event, Process, Queue
-from queue import Empty as EmptyException
+import os
 import re
-import select
-import subprocess
-from threading import Thread
-import fs_radar.shell_process
+import shlex
+from time import monotonic
+from fs_radar.change_detector import ChangeDetector
+from fs_radar.command_output import CommandOutput
+from fs_radar.metrics import DURATION_BUCKETS, LATENCY_BUCKETS, Histogram
+from fs_radar.shell_pool import ShellPool
+from fs_radar.shell_process import ShellCommand
 
 from chromalog.mark.helpers.simple import success, error, important
 
 logger = logging.getLogger(__name__)
 
+# Linux refuses any single argument longer than MAX_ARG_STRLEN (32 pages).
+# The whole command line is handed to bash as one argument of `-c`.
+MAX_ARG_STRLEN = 32 * 4096
+
+# the tokens replaced by the paths in the commands
+CMD_TOKEN_RE = re.compile(r'\{\*?\}')
+
 
 class CommandNameLogAdapter(logging.LoggerAdapter):
     """This adapter expects the passed in dict-like object to have a 'cmd_name'
@@ -22,158 +33,433 @@ class CommandNameLogAdapter(logging.LoggerAdapter):
         return '[%s] %s' % (self.extra['cmd_name'], msg), kwargs
 
 
-class CmdLaunchPad(Thread):
+class Job:
+    '''A command line run by a launch pad'''
+
+    def __init__(self, key, cmd_line, p):
+        self.key = key
+        self.cmd_line = cmd_line
+        self.p = p
+        self.started_at = monotonic()
+        self.timeout_handle = None
+
 
-    def __init__(self, cmd_template, options=None, end_event=None):
-        super(CmdLaunchPad, self).__init__()
+class CmdLaunchPad:
+
+    def __init__(self, cmd_template, options=None, loop=None):
         self.options = {**{
             'stop_previous_process': False,
             'discard_if_already_running': True,
             'timeout': 30,
             'name': hashlib.sha1(cmd_template.encode('utf-8')).hexdigest()[:6],
             'bash_profile': None,
+            'debounce_ms': 0,
+            'skip_unchanged': False,
+            'cwd': None,
+            'shell_pool_size': 0,
+            'shell_pool_max_runs': 100,
+            'output_max_lines': 10000,
+            'output_file': None,
+            'output_file_max_bytes': 10 * 1024 * 1024,
+            'output_file_backups': 3,
+            'max_parallel': 1,
+            'priority': 0,
+            'weight': 1,
+            'max_pending': 10000,
         }, **(options or {})}
-        self.p = None
-
-        self.queue_process = Queue()
-        self.queue_in = Queue()
-        self.end_event = end_event
-        self.timed_out_event = Event()
+        self.loop = loop
+        # hands out the slots to run the processes, if any
+        self.scheduler = None
+
+        # the jobs running, by key (see `get_job_key`)
+        self.jobs = {}
+        self.max_parallel = max(1, self.options['max_parallel'] or 1)
+
+        # paths waiting for the debounce window to expire (dict as ordered set)
+        self.debounced = {}
+        self.debounce_handle = None
+        # command lines waiting for a free slot, e.g. the chunks of a batch
+        # that didn't fit in a single run (dict as ordered set)
+        self.pending_cmd_lines = {}
+        # paths waiting for the job of the same key to exit, by job key
+        # (dicts as ordered sets, the oldest path first), and the (key, path)
+        # pairs of all of them in order of arrival
+        self.held = {}
+        self.held_order = {}
+        self.max_pending = self.options['max_pending'] or 10000
+
+        # files whose content didn't change since the last request are ignored
+        self.change_detector = ChangeDetector() if self.options['skip_unchanged'] else None
+
+        # shells ready to run the command, if any
+        self.shell_pool = None
+        if self.options['shell_pool_size']:
+            self.shell_pool = ShellPool(
+                self.options['shell_pool_size'],
+                max_runs=self.options['shell_pool_max_runs'] or 100,
+                bash_profile=self.options['bash_profile'],
+                cwd=self.options['cwd']
+            )
+            if loop:
+                self.shell_pool.attach(loop)
+
+        # exposed by the metrics
+        self.counters = Counter()
+        self.duration_histogram = Histogram(DURATION_BUCKETS)
+        self.latency_histogram = Histogram(LATENCY_BUCKETS)
+
+        # output of the commands, logged in batches or saved to a file
+        output_file = self.options['output_file']
+        self.output = CommandOutput(
+            self.options['name'],
+            loop,
+            max_lines=self.options['output_max_lines'] or 10000,
+            # relative to the working directory of the commands
+            path=os.path.join(self.options['cwd'] or '', output_file) if output_file else None,
+            max_bytes=self.options['output_file_max_bytes'] or 0,
+            backup_count=self.options['output_file_backups'] or 0,
+            counters=self.counters
+        )
 
         self.cmd_template = self._normalize_cmd_substitution_token(cmd_template)
 
         self.adapter = CommandNameLogAdapter(logger, {'cmd_name': self.options['name']})
 
+        # when the oldest request not yet handled was received
+        self.waiting_since = None
+
+    def attach(self, loop, scheduler=None):
+        '''Run the launch pad inside the event loop `loop`, asking
+        `scheduler` (a ProcessScheduler), if any, when to start a process'''
+        self.adapter.debug('Attach cmd launch pad to the event loop')
+        self.loop = loop
+        self.scheduler = scheduler
+        self.output.loop = loop
+        if self.shell_pool is not None and self.shell_pool.loop is not loop:
+            self.shell_pool.attach(loop)
+
+    def close(self):
+        '''Stop the running process (if any) and every pending request'''
+        self.adapter.debug('Close cmd launch pad')
+        if self.debounce_handle:
+            self.debounce_handle.cancel()
+            self.debounce_handle = None
+        self.held = {}
+        self.held_order = {}
+        self.pending_cmd_lines = {}
+        self.terminate_processes()
+        if self.scheduler is not None:
+            self.scheduler.forget(self)
+        if self.shell_pool is not None:
+            self.shell_pool.close()
+        self.output.close()
+
     def add_item_to_process(self, item):
-        self.queue_in.put(item)
+        self.counters['requests'] += 1
+        if self.change_detector is not None and not self.change_detector.has_changed(self.get_abspath(item)):
+            self.adapter.debug('Content of %s did not change, discard request', item)
+            self.counters['skipped_unchanged'] += 1
+            return
+        if self.waiting_since is None:
+            self.waiting_since = monotonic()
+        self.on_parameter_received(item)
 
-    def set_end_event(self, event):
-        self.end_event = event
+    def get_abspath(self, path):
+        '''Return the path of `path` (relative to the working directory of
+        the commands) seen from our working directory'''
+        return os.path.join(self.options['cwd'] or '', path)
 
     def is_process_alive(self):
-        '''Is the process still running?
+        '''Is a process still running?
 
-        @return bool whether the process is running or not
+        @return bool whether a process is running or not
         '''
-        return bool(self.p and self.p.is_alive())
-
-    def terminate_process(self):
-        '''Kill the process sending to it a SIGTERM signal.
-
-        Also reset process related variables.'''
-
-        if not self.p:
-            return
-
-        self.p.terminate()
-        self.p.join()
-        self.p = None
-
-        # the queue may have become corrupt after the use of terminate()
-        # https://docs.python.org/3.5/library/multiprocessing.html#multiprocessing.Process.terminate
-        self.queue_process = Queue()
-
-    def run(self):
-        '''Run an infinite loop that wait for requests to run a process.'''
-
-        self.adapter.debug('Run cmd launch pad')
-        while True:
-
-            if self.end_event and self.end_event.is_set():
-                self.adapter.debug('Terminate thread as requested')
-                self.terminate_process()
-                break
-            elif self.timed_out_event.is_set():
-                self.adapter.info('### END PROCESS - %s ###', error('timed out'))
-                self.on_process_timed_out()
-
-            readers = [
-                self.queue_process._reader,
-                self.queue_in._reader
-            ]
-
-            r, w, x = select.select(readers, [], [], 1)
-            for ready in r:
-                if ready == self.queue_process._reader:
-                    self.on_process_queue_item_received(self.queue_process.get(block=True))
-                elif ready == self.queue_in._reader:
-                    self.on_parameter_received(self.queue_in.get(block=True))
-                else:
-                    raise Error('Unexpected input')
-
-    def on_process_timed_out(self):
-        self.timed_out_event.clear()
-        self.p = None
-        self.queue_process = Queue()
+        return bool(self.jobs)
+
+    def is_busy(self):
+        '''Is there a process running or a request waiting?'''
+        return bool(self.is_process_alive() or self.debounced or self.pending_cmd_lines or self.held)
+
+    def get_queue_depth(self):
+        '''Return the number of paths and command lines waiting to be run'''
+        return len(self.debounced) + len(self.pending_cmd_lines) + len(self.held_order)
+
+    def get_job_key(self, cmd_line):
+        '''Return the key of the job running `cmd_line`. Two jobs with the
+        same key never run together: with `max_parallel` the key is the
+        command line (i.e. the path), otherwise any two jobs collide.'''
+        return cmd_line if self.max_parallel > 1 else None
+
+    def terminate_process(self, job):
+        '''Kill the process of `job` sending to it a SIGTERM signal.
+
+        Also reset process related variables. Its slot is given back to the
+        scheduler only once the process actually exited.'''
+        job.p.terminate(on_exit=lambda exit_status: self.release_slot())
+        self.on_process_gone(job)
+
+    def terminate_processes(self):
+        '''Kill every process running'''
+        for job in list(self.jobs.values()):
+            self.terminate_process(job)
+
+    def on_process_gone(self, job):
+        '''Forget about the process of `job`'''
+        self.duration_histogram.observe(monotonic() - job.started_at)
+        if job.timeout_handle:
+            job.timeout_handle.cancel()
+            job.timeout_handle = None
+        del self.jobs[job.key]
+
+        # the paths held meanwhile run together (or one after the other,
+        # if the command takes a single path)
+        paths = self.held.pop(job.key, None)
+        if paths:
+            for path in paths:
+                del self.held_order[job.key, path]
+            self.adapter.debug('Run the %d paths held while the process was running', len(paths))
+            if '{*}' in self.cmd_template:
+                chunks = split_in_chunks(self.cmd_template, list(paths))
+            else:
+                chunks = [[path] for path in paths]
+            for chunk in chunks:
+                self.pending_cmd_lines[_fill_cmd_template(self.cmd_template, chunk)] = True
+
+    def release_slot(self):
+        '''A process started through the scheduler, if any, exited'''
+        if self.scheduler is not None:
+            self.scheduler.release()
+
+    def on_process_timed_out(self, job):
+        self.output.flush()
+        self.adapter.info('### END PROCESS - %s ###', error('timed out'))
+        self.counters['timed_out'] += 1
+        job.timeout_handle = None
+        self.terminate_process(job)
+        self.run_pending_cmd_lines()
 
     def on_parameter_received(self, parameter):
         self.adapter.debug('Got parameter %s', parameter)
 
-        if self.is_process_alive() and self.options['discard_if_already_running']:
+        if self.options['debounce_ms']:
+            if self.debounce_handle is None:
+                self.debounce_handle = self.loop.call_later(
+                    self.options['debounce_ms'] / 1000,
+                    self.on_debounce_window_expired
+                )
+            self.debounced[parameter] = True
+            return
+
+        self.on_batch_ready([parameter])
+
+    def on_debounce_window_expired(self):
+        '''Run the command once for every path collected during the window'''
+        paths = list(self.debounced)
+        self.debounced = {}
+        self.debounce_handle = None
+
+        self.adapter.debug('Debounce window expired, %d paths collected', len(paths))
+        self.on_batch_ready(paths)
+
+    def on_batch_ready(self, paths):
+        '''Run the command for `paths`, following the configured policy
+        in case a process is already running for them'''
+        if '{*}' not in self.cmd_template:
+            self.forget_content(paths[:-1])  # only the latest path is run
+        for chunk in split_in_chunks(self.cmd_template, paths):
+            self.on_chunk_ready(chunk)
+        self.run_pending_cmd_lines()
+
+    def on_chunk_ready(self, paths):
+        '''Queue the command line of `paths`, unless it collides with a
+        running job that must not be stopped (`paths` are then held until
+        the job exits, or discarded)'''
+        cmd_line = _fill_cmd_template(self.cmd_template, paths)
+        job = self.jobs.get(self.get_job_key(cmd_line))
+
+        if job and self.options['discard_if_already_running']:
             self.adapter.debug('Process already running, discard request')
+            self.on_request_discarded()
+            self.forget_content(paths)
             return
 
-        if self.is_process_alive() and self.options['stop_previous_process']:
+        if job and self.options['stop_previous_process']:
+            self.output.flush()
             self.adapter.info('### END PROCESS - %s ###', error('interrupted'))
-            self.terminate_process()
+            self.counters['interrupted'] += 1
+            self.terminate_process(job)
+            job = None
 
-        if not self.is_process_alive():
-            self.adapter.info('### START PROCESS ###')
-            self.run_process(self.cmd_template, parameter)
-
-    def on_process_queue_item_received(self, item):
-        exit_status, output = item
-
-        if exit_status is None:
-            # process produced output and is still running
-            self.adapter.info('%s', output.strip())
+        if job is None:
+            self.pending_cmd_lines[cmd_line] = True
         else:
-            if exit_status == 0:
-                self.adapter.info('### END PROCESS - exit status %s ###', success(exit_status))
-            else:
-                self.adapter.info('### END PROCESS - exit status %s ###', error(exit_status))
+            self.hold(job.key, paths)
+
+    def hold(self, key, paths):
+        '''Keep `paths` until the job `key` exits. A path already held
+        moves to the end; past `max_pending` paths the oldest are dropped'''
+        held = self.held.setdefault(key, {})
+        for path in paths:
+            held.pop(path, None)
+            held[path] = True
+            self.held_order.pop((key, path), None)
+            self.held_order[key, path] = True
+
+        while len(self.held_order) > self.max_pending:
+            oldest_key, oldest_path = next(iter(self.held_order))
+            del self.held_order[oldest_key, oldest_path]
+            oldest = self.held[oldest_key]
+            del oldest[oldest_path]
+            if not oldest:
+                del self.held[oldest_key]
+            self.counters['discarded'] += 1
+            self.forget_content([oldest_path])
+
+        self.counters['held'] += len(paths)
+
+    def forget_content(self, paths):
+        '''The command won't run for `paths`: the content they have now must
+        not be skipped as unchanged the next time'''
+        if self.change_detector is not None:
+            for path in paths:
+                self.change_detector.forget(self.get_abspath(path))
+
+    def on_request_discarded(self):
+        self.counters['discarded'] += 1
+        self.waiting_since = None
+
+    def wants_slot(self):
+        '''Is there a command line waiting that could run now?'''
+        return bool(self.pending_cmd_lines) and len(self.jobs) < self.max_parallel
+
+    def run_pending_cmd_lines(self):
+        '''Start the command lines waiting to be executed, as long as
+        there are free slots (as soon as the scheduler, if any, allows)'''
+        while self.wants_slot():
+            if self.scheduler is not None:
+                self.scheduler.submit(self)
+                return
+            self.run_next_cmd_line()
+
+    def run_next_cmd_line(self):
+        '''Start the oldest command line waiting to be executed'''
+        cmd_line = next(iter(self.pending_cmd_lines))
+        del self.pending_cmd_lines[cmd_line]
+        self.adapter.info('### START PROCESS ###')
+        self.run_process(cmd_line)
+
+    def on_process_output(self, lines):
+        self.output.write(lines)
+
+    def on_process_exited(self, job, exit_status):
+        self.output.flush()
+        if exit_status == 0:
+            self.adapter.info('### END PROCESS - exit status %s ###', success(exit_status))
+        else:
+            self.adapter.info('### END PROCESS - exit status %s ###', error(exit_status))
 
-            self.p = None
+        self.on_process_gone(job)
+        self.release_slot()
+        self.run_pending_cmd_lines()
 
     def _normalize_cmd_substitution_token(self, cmd_template):
-        '''Normalize the token to {}. cmd can hold '{}' or "{}" or {}'''
-        return re.sub('\'\{\}\'|"\{\}"', '{}', cmd_template)
+        '''Normalize the tokens to {} and {*}.
+        cmd can hold '{}' or "{}" or {} (the same goes for {*})'''
+        cmd_template = re.sub(r'\'\{\}\'|"\{\}"', '{}', cmd_template)
+        return re.sub(r'\'\{\*\}\'|"\{\*\}"', '{*}', cmd_template)
 
-    def run_process(self, cmd_template, parameter):
-        '''Run the command after replacing every occurrence
-        of {} with `parameter`'''
-        cmd_line = cmd_template.replace('{}', parameter)
+    def run_process(self, cmd_line):
+        '''Run the command line `cmd_line`'''
         self.adapter.debug('Command line is %s', cmd_line)
-        self.p = Process(target=run_command_with_queue, args=(
-            cmd_line,
-            self.options['timeout'],
-            self.queue_process,
-            self.timed_out_event,
-            self.options['bash_profile']
-        ))
-        self.p.start()
-        # run_command_with_queue(cmd_line, self.queue_process)
+        if self.shell_pool is not None:
+            p = self.shell_pool.make_command(cmd_line)
+        else:
+            p = ShellCommand(cmd_line, bash_profile=self.options['bash_profile'], cwd=self.options['cwd'])
+        job = Job(self.get_job_key(cmd_line), cmd_line, p)
+        try:
+            p.start(self.loop, self.on_process_output, partial(self.on_process_exited, job))
+        except OSError as e:
+            # e.g. cwd missing, or too many processes/files open
+            self.adapter.error('### CANNOT START PROCESS - %s ###', e)
+            self.counters['failed_to_start'] += 1
+            self.release_slot()
+            return
+        self.jobs[job.key] = job
+
+        self.counters['started'] += 1
+        if self.waiting_since is not None:
+            self.latency_histogram.observe(job.started_at - self.waiting_since)
+            self.waiting_since = None
+
+        if self.options['timeout']:
+            job.timeout_handle = self.loop.call_later(self.options['timeout'], self.on_process_timed_out, job)
 
 
-def _make_callback_on_process_line_read(queue):
-    return lambda exit_status, line: queue.put((exit_status, line))
+def get_max_cmd_line_length():
+    '''Return the maximum length, in bytes, of a command line we can
+    safely hand to bash'''
+    try:
+        arg_max = os.sysconf('SC_ARG_MAX')
+    except (ValueError, OSError):
+        arg_max = MAX_ARG_STRLEN
+
+    env_size = sum(len(k) + len(v) + 2 for k, v in os.environb.items())
 
+    # keep some room for the other arguments (bash, -i, -c, ...)
+    return min(MAX_ARG_STRLEN, arg_max - env_size) - 1024
 
-def run_command_with_queue(cmd, timeout, queue, timed_out_event, bash_profile=None):
-    '''Run `cmd` in a shell, put every line it outputs in the queue
-    one line at a time.
 
-    Each item put in the queue is a tuple (exit status (or None), cmd, line)
+def make_cmd_lines(cmd_template, paths, max_length=None):
+    '''Build the command lines to run for `paths`.
 
-    @param string cmd the command to run
-    @param int timeout max time to complete the process. If the timeout expires
-               the process is killed and timed_out_event is set
-    @param subprocess.Queue queue the queue where to put the data
-    @param multiprocessing.Event timed_out_event event set if the process times out
+    Any occurrence of {} is replaced by the latest path, any occurrence
+    of {*} by the whole list of (quoted) paths. If the list is too long
+    to fit in a single command line it is split across many command lines.
+
+    @param string cmd_template the command, holding the tokens to replace
+    @param list paths the paths to substitute in the command
+    @param int max_length max length of a command line (default: see
+               `get_max_cmd_line_length`)
+    @return list the command lines to run, in order
     '''
-    p = fs_radar.shell_process.popen_shell_command(cmd, bash_profile=bash_profile)
-    callback = _make_callback_on_process_line_read(queue)
-    try:
-        fs_radar.shell_process.consume_output_line_by_line(p, callback, timeout=timeout)
-    except subprocess.TimeoutExpired:
-        timed_out_event.set()
+    return [_fill_cmd_template(cmd_template, chunk) for chunk in split_in_chunks(cmd_template, paths, max_length)]
+
+
+def split_in_chunks(cmd_template, paths, max_length=None):
+    '''Split `paths` in the chunks substituted in every command line
+    (see `make_cmd_lines`)
+
+    @return list the lists of paths, in order
+    '''
+    if '{*}' not in cmd_template:
+        return [paths[-1:]]
+
+    max_length = max_length or get_max_cmd_line_length()
+
+    chunks = []
+    chunk = []
+    chunk_length = 0
+    template_length = len(cmd_template.encode())
+    occurrences = cmd_template.count('{*}')
+
+    for path in paths:
+        path_length = (len(shlex.quote(path).encode()) + 1) * occurrences
+        latest_path_length = len(path.encode()) * cmd_template.count('{}')
+        if chunk and template_length + chunk_length + path_length + latest_path_length > max_length:
+            chunks.append(chunk)
+            chunk = []
+            chunk_length = 0
+        chunk.append(path)
+        chunk_length += path_length
+
+    chunks.append(chunk)
+
+    return chunks
+
+
+def _fill_cmd_template(cmd_template, paths):
+    # in a single pass, a path holding a token is not substituted again
+    return CMD_TOKEN_RE.sub(
+        lambda match: ' '.join(shlex.quote(path) for path in paths) if match.group() == '{*}' else paths[-1],
+        cmd_template
+    )
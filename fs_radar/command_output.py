@@ -0,0 +1,89 @@
+'''Where the output of the commands of a group goes.
+
+The lines are received in batches (one per chunk read from the process)
+and either appended to an output file, rotated once it grows too big, or
+kept in a bounded buffer that is logged at most every FLUSH_INTERVAL
+seconds, with a single log record per flush. A command printing faster
+than the terminal can show loses its oldest lines instead of slowing
+down the event loop.
+'''
+
+from collections import Counter, deque
+import logging
+from logging.handlers import RotatingFileHandler
+
+logger = logging.getLogger(__name__)
+
+# seconds between two flushes of the buffered lines to the log
+FLUSH_INTERVAL = 0.1
+
+
+class CommandOutput:
+    '''The output of the commands of the group `name`'''
+
+    def __init__(self, name, loop=None, max_lines=10000, path=None, max_bytes=10 * 1024 * 1024, backup_count=3,
+                 counters=None):
+        '''
+        @param string name the name of the group, prepended to the logged lines
+        @param asyncio.AbstractEventLoop loop the loop scheduling the flushes
+        @param int max_lines max number of lines waiting to be logged (the
+                   oldest ones are dropped)
+        @param string path file receiving the output instead of the log
+        @param int max_bytes size after which the file is rotated (0 never)
+        @param int backup_count number of rotated files kept
+        @param Counter counters where the dropped lines are counted
+                       (key "output_lines_dropped")
+        '''
+        self.name = name
+        self.loop = loop
+        self.lines = deque(maxlen=max_lines)
+        self.dropped = 0
+        self.counters = counters if counters is not None else Counter()
+        self.flush_handle = None
+
+        self.file_handler = None
+        if path:
+            self.file_handler = RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True
+            )
+            self.file_handler.setFormatter(logging.Formatter('%(message)s'))
+
+    def write(self, lines):
+        '''Send `lines` (a batch of lines of output) to their destination'''
+        if not lines:
+            return
+
+        if self.file_handler is not None:
+            self.file_handler.emit(logging.makeLogRecord({'msg': '\n'.join(lines)}))
+            return
+
+        overflow = len(self.lines) + len(lines) - self.lines.maxlen
+        if overflow > 0:
+            self.dropped += overflow
+            self.counters['output_lines_dropped'] += overflow
+        self.lines.extend(lines)
+
+        if self.flush_handle is None:
+            if self.loop is None:
+                self.flush()
+            else:
+                self.flush_handle = self.loop.call_later(FLUSH_INTERVAL, self.flush)
+
+    def flush(self):
+        '''Log the lines waiting in the buffer'''
+        if self.flush_handle:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        if self.dropped:
+            logger.warning('[%s] %d lines of output dropped', self.name, self.dropped)
+            self.dropped = 0
+        if self.lines:
+            prefix = '[%s] ' % self.name
+            logger.info('%s', '\n'.join(prefix + line for line in self.lines))
+            self.lines.clear()
+
+    def close(self):
+        self.flush()
+        if self.file_handler is not None:
+            self.file_handler.close()
@@ -11,7 +11,16 @@ SHAREABLE_CONFIGURATIONS = [
     'bash_profile',
     'timeout',
     'stop_previous_process',
-    'discard_if_already_running'
+    'discard_if_already_running',
+    'debounce_ms',
+    'skip_unchanged',
+    'shell_pool_size',
+    'shell_pool_max_runs',
+    'output_max_lines',
+    'output_file_max_bytes',
+    'output_file_backups',
+    'max_parallel',
+    'max_pending'
 ]
 
 
@@ -0,0 +1,282 @@
+'''Host many projects (config files) in a single process.
+
+Every project keeps its own groups, but they all share one FsRadar: the
+same backend (one inotify instance), one watch table (a directory is
+watched once even if many projects need it) and one event loop.
+Projects are registered when the daemon starts or, later on, through a
+line based protocol spoken over a unix socket:
+
+    register /path/to/config.toml
+    unregister /path/to/config.toml
+    list
+
+Every answer ends with a line starting with "ok" or "error".
+'''
+
+import asyncio
+import logging
+import os
+
+from fs_radar import FsRadar, FsRadarEvent
+from fs_radar.config import load_from_toml, ConfigException
+from fs_radar.groups import (
+    get_dir_filter, get_dirs_to_watch, get_subtree_filter, make_launch_pad, make_launch_pads_notifier
+)
+from fs_radar.observer import Observer
+from fs_radar.path_dispatcher import PathDispatcher
+from fs_radar.watch_backend import get_fs_type, is_inotify_blind
+from fs_radar.watch_budget import get_watches_budget
+
+logger = logging.getLogger(__name__)
+
+
+def get_default_socket_path():
+    '''Return the path of the control socket used when none is given'''
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'fs_radar.sock')
+    return '/tmp/fs_radar-%d.sock' % os.getuid()
+
+
+class Project:
+    '''The groups of a config file hosted by the daemon'''
+
+    def __init__(self, config_path, cfg):
+        self.config_path = config_path
+        self.cfg = cfg
+        self.name = os.path.splitext(os.path.basename(config_path))[0]
+        self.basedir = os.path.normpath(os.path.abspath(cfg['fs_radar']['basedir']))
+        self.prefix = os.path.join(self.basedir, '')
+
+        groups = cfg['group']
+        self.dir_filter = get_dir_filter(groups)
+        self.subtree_filter = get_subtree_filter(groups)
+        self.poll = cfg['fs_radar'].get('backend') == 'poll' or is_inotify_blind(get_fs_type(self.basedir))
+
+        self.dispatcher = PathDispatcher(cache_size=cfg['fs_radar'].get('cache_size', 4096))
+        self.launch_pads = []
+        for name, group in groups.items():
+            # the commands receive paths relative to basedir
+            rules, lp = make_launch_pad('%s/%s' % (self.name, name), group, cwd=self.basedir)
+            self.dispatcher.add(lp, rules)
+            self.launch_pads.append(lp)
+        self.notify = make_launch_pads_notifier(self.dispatcher, self.basedir)
+
+    def contains(self, path):
+        return path == self.basedir or path.startswith(self.prefix)
+
+    def accepts_dir(self, path):
+        '''Must the directory at `path` (absolute) be watched?'''
+        return self.contains(path) and self.dir_filter(path[len(self.prefix):] or '.')
+
+    def may_hold_dirs(self, path):
+        '''May the subtree at `path` (absolute) hold directories to watch?'''
+        return self.contains(path) and self.subtree_filter(path[len(self.prefix):] or '.')
+
+    def get_dirs_to_watch(self):
+        return get_dirs_to_watch(
+            self.basedir,
+            self.dir_filter,
+            subtree_filter=self.subtree_filter,
+            workers=self.cfg['fs_radar'].get('scan_workers')
+        )
+
+    def close(self):
+        for lp in self.launch_pads:
+            lp.close()
+
+
+class Daemon:
+    '''Run the projects registered, sharing a single FsRadar'''
+
+    def __init__(self, socket_path=None, cache_size=4096, scheduler=None):
+        '''
+        @param string socket_path path of the control socket
+        @param int cache_size see FsRadar
+        @param ProcessScheduler scheduler shared by the groups of every
+                                project, if any
+        '''
+        self.socket_path = socket_path or get_default_socket_path()
+        self.scheduler = scheduler
+        self.projects = {}
+        self.loop = None
+        self.server = None
+
+        observer = Observer()
+        observer.subscribe(FsRadarEvent.FILE_MATCH, self.on_file_match)
+        self.fsr = FsRadar(
+            self.accepts_dir,
+            observer,
+            cache_size=cache_size,
+            max_watches=get_watches_budget(None),
+            subtree_filter=self.may_hold_dirs
+        )
+
+    def accepts_dir(self, path):
+        return any(project.accepts_dir(path) for project in self.projects.values())
+
+    def may_hold_dirs(self, path):
+        return any(project.may_hold_dirs(path) for project in self.projects.values())
+
+    def on_file_match(self, ev):
+        for project in self.projects.values():
+            if project.contains(ev.data):
+                project.notify(ev)
+
+    async def register(self, config_path):
+        '''Host the project configured by the config file at `config_path`.
+        Its tree is scanned in a thread, the other projects keep running
+
+        @return int the number of directories it added to the watched ones
+        @raise ConfigException if the config file is not valid
+        '''
+        config_path = os.path.abspath(config_path)
+        if config_path in self.projects:
+            raise ConfigException('%s is already registered' % config_path)
+
+        try:
+            project = Project(config_path, load_from_toml(config_path))
+        except OSError as e:
+            raise ConfigException('Cannot read %s: %s' % (config_path, e.strerror)) from None
+        if not os.path.isdir(project.basedir):
+            raise ConfigException('Path configured as `basedir` was not found: %s' % project.basedir)
+
+        for lp in project.launch_pads:
+            lp.attach(self.loop, self.scheduler)
+        self.projects[config_path] = project
+        self.fsr.set_dir_filter(self.accepts_dir, self.may_hold_dirs)  # forget the cached decisions
+
+        paths = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [os.path.abspath(path) for path in project.get_dirs_to_watch()]
+        )
+        if self.projects.get(config_path) is not project:
+            return 0  # unregistered meanwhile
+
+        added = shared = 0
+        for path in paths:
+            if self.fsr.wds.get_wd(path) is not None:
+                shared += 1
+            else:
+                self.fsr.add_watch(path, poll=project.poll)
+                added += 1
+
+        logger.info('Project %s registered (%d directories, %d already watched)', project.name, added, shared)
+        return added
+
+    def unregister(self, config_path):
+        '''Stop hosting the project configured by the config file at `config_path`
+
+        @return int the number of directories no longer watched
+        @raise ConfigException if the project is not registered
+        '''
+        config_path = os.path.abspath(config_path)
+        if config_path not in self.projects:
+            raise ConfigException('%s is not registered' % config_path)
+
+        project = self.projects.pop(config_path)
+        project.close()
+        self.fsr.set_dir_filter(self.accepts_dir, self.may_hold_dirs)
+        removed = self.fsr.rm_rejected_watches()
+
+        logger.info('Project %s unregistered (%d directories no longer watched)', project.name, len(removed))
+        return len(removed)
+
+    def get_launch_pads(self):
+        return [lp for project in self.projects.values() for lp in project.launch_pads]
+
+    async def handle_command(self, line):
+        '''Run the control command `line`
+
+        @return list the lines of the answer
+        '''
+        command, _, argument = line.strip().partition(' ')
+        argument = argument.strip()
+
+        try:
+            if command == 'register' and argument:
+                return ['ok %d directories added' % await self.register(argument)]
+            elif command == 'unregister' and argument:
+                return ['ok %d directories removed' % self.unregister(argument)]
+            elif command == 'list' and not argument:
+                return ['%s %s %s' % (path, project.basedir, ','.join(project.cfg['group']))
+                        for path, project in self.projects.items()] + ['ok']
+            else:
+                return ['error unknown command: %s' % line.strip()]
+        except ConfigException as e:
+            return ['error %s' % e]
+
+    async def on_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                answer = await self.handle_command(line.decode('utf-8', 'replace'))
+                writer.write(''.join(answer_line + '\n' for answer_line in answer).encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start_server(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # left behind by a previous run
+        # only our user may connect: the projects registered run commands
+        umask = os.umask(0o077)
+        try:
+            self.server = await asyncio.start_unix_server(self.on_client, self.socket_path)
+        finally:
+            os.umask(umask)
+        logger.info('Listening on %s', self.socket_path)
+
+    def close(self):
+        if self.server:
+            self.server.close()
+            self.server = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+        for project in self.projects.values():
+            project.close()
+        if self.scheduler:
+            self.scheduler.close()
+        self.fsr.close()
+
+    def run_forever(self, config_paths=()):
+        '''Register the projects configured by `config_paths` and handle
+        their events (and the control commands) until interrupted'''
+        self.loop = asyncio.new_event_loop()
+        if self.scheduler:
+            self.scheduler.attach(self.loop)
+        try:
+            for config_path in config_paths:
+                self.loop.run_until_complete(self.register(config_path))
+            self.loop.run_until_complete(self.start_server())
+            self.fsr.run_forever(self.loop)
+        finally:
+            self.close()
+            self.loop.close()
+
+
+def send_command(socket_path, command):
+    '''Send `command` to the daemon listening on `socket_path`
+
+    @return tuple (bool success, list lines of the answer)
+    '''
+    async def send():
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        writer.write(command.encode('utf-8') + b'\n')
+        await writer.drain()
+        lines = []
+        while True:
+            line = (await reader.readline()).decode('utf-8').rstrip('\n')
+            lines.append(line)
+            if not line or line == 'ok' or line.startswith(('ok ', 'error ')):
+                break
+        writer.close()
+        return lines
+
+    lines = asyncio.run(send())
+    return lines[-1].startswith('ok'), lines
@@ -0,0 +1,99 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+import os
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+
+class DirScanner:
+    '''Scan a directory tree looking for its subdirectories.
+
+    Subtrees are listed with `os.scandir` by a pool of threads and the
+    subtrees rejected by `subtree_filter` are never entered.
+    '''
+
+    def __init__(self, subtree_filter=None, workers=None, batch_size=512):
+        '''
+        @param func subtree_filter given the absolute path of a directory,
+                    return False if the directory and its descendants must
+                    be skipped
+        @param int workers number of threads listing directories
+                   (default: see ThreadPoolExecutor)
+        @param int batch_size max number of directories listed by a thread
+                   before handing the rest of its subtree back to the pool
+        '''
+        self.subtree_filter = subtree_filter or (lambda path: True)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.dirs_count = 0
+        self.elapsed = 0
+
+    def scan(self, basedir):
+        '''Generator to iterate over the subdirectories under `basedir`.
+        The root (`basedir`) is the first element yielded, the others come
+        in no particular order'''
+
+        return self.scan_many([basedir])
+
+    def scan_many(self, roots):
+        '''Generator to iterate over the subdirectories under every
+        directory in `roots`. The roots are yielded first'''
+
+        if not roots:
+            return
+
+        start_time = monotonic()
+        self.dirs_count = len(roots)
+
+        yield from roots
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {executor.submit(self._scan_subtree, [root]) for root in roots}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    found, frontier = future.result()
+                    self.dirs_count += len(found)
+                    yield from found
+
+                    # split what's left among the idle threads
+                    for path in frontier:
+                        pending.add(executor.submit(self._scan_subtree, [path]))
+
+        self.elapsed = monotonic() - start_time
+        logger.info(
+            'Scanned %d directories in %.2f seconds (%d dirs/sec)',
+            self.dirs_count, self.elapsed, self.dirs_count / max(self.elapsed, 1e-6)
+        )
+
+    def _scan_subtree(self, stack):
+        '''List, depth first, up to `batch_size` directories starting from
+        the ones in `stack`.
+
+        @return tuple (subdirectories found, directories not listed yet)
+        '''
+        found = []
+        listed = 0
+
+        while stack and listed < self.batch_size:
+            path = stack.pop()
+            listed += 1
+            for subdir in self._list_subdirs(path):
+                if self.subtree_filter(subdir):
+                    found.append(subdir)
+                    stack.append(subdir)
+
+        return found, stack
+
+    @staticmethod
+    def _list_subdirs(path):
+        try:
+            with os.scandir(path) as it:
+                return [
+                    entry.path for entry in it
+                    if entry.is_dir(follow_symlinks=False)
+                ]
+        except OSError:
+            # e.g. removed in the meanwhile or permission denied
+            return []
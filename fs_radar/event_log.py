@@ -0,0 +1,196 @@
+import logging
+import mmap
+import os
+import struct
+from time import monotonic_ns, time_ns
+
+from inotify_simple import Event
+
+from fs_radar.watch_backend import WatchBackend
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOG_MAGIC = b'FSRE'
+EVENT_LOG_VERSION = 1
+
+# magic, version, wall clock time of the start (ns since the epoch)
+HEADER = struct.Struct('<4sIq')
+# record type
+RECORD_TYPE = struct.Struct('<B')
+PATH_RECORD_TYPE = 1
+EVENT_RECORD_TYPE = 2
+# path id, length of the path (that follows)
+PATH_RECORD = struct.Struct('<IH')
+# ns since the start, path id of the watch (-1 if none), mask, cookie,
+# length of the name (that follows)
+EVENT_RECORD = struct.Struct('<qiIIH')
+
+
+class EventRecorder:
+    '''Write the events read by the backends to a compact binary log
+    (the paths of the watches are written once and then referred by id)'''
+
+    def __init__(self, path):
+        self.fp = open(path, 'wb', buffering=256 * 1024)
+        self.fp.write(HEADER.pack(EVENT_LOG_MAGIC, EVENT_LOG_VERSION, time_ns()))
+        self.start_ns = monotonic_ns()
+        self.path_ids = {}
+        self.events_count = 0
+
+    def record(self, events, wds):
+        '''Append `events` to the log, `wds` being the watch table they refer to'''
+        timestamp = monotonic_ns() - self.start_ns
+        write = self.fp.write
+
+        for event in events:
+            path = wds.get(event.wd)
+            path_id = -1 if path is None else self.path_ids.get(path)
+            if path_id is None:
+                path_id = self.path_ids[path] = len(self.path_ids)
+                encoded_path = os.fsencode(path)
+                write(RECORD_TYPE.pack(PATH_RECORD_TYPE) + PATH_RECORD.pack(path_id, len(encoded_path)) + encoded_path)
+
+            name = os.fsencode(event.name)
+            write(RECORD_TYPE.pack(EVENT_RECORD_TYPE) +
+                  EVENT_RECORD.pack(timestamp, path_id, event.mask, event.cookie, len(name)) + name)
+
+        self.events_count += len(events)
+
+    def close(self):
+        self.fp.close()
+        logger.info('Recorded %d events', self.events_count)
+
+
+def read_event_log(path):
+    '''Generator of the events recorded in the log at `path`, as tuples
+    (ns since the start of the recording, path of the watch or None,
+    mask, cookie, name)
+
+    @raise ValueError if the file is not an event log
+    '''
+    with open(path, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, version, _ = HEADER.unpack_from(data)
+        if magic != EVENT_LOG_MAGIC or version != EVENT_LOG_VERSION:
+            raise ValueError('%s is not an event log' % path)
+
+        paths = {-1: None}
+        offset = HEADER.size
+        size = len(data)
+
+        while offset < size:
+            record_type, = RECORD_TYPE.unpack_from(data, offset)
+            offset += RECORD_TYPE.size
+            if record_type == PATH_RECORD_TYPE:
+                path_id, length = PATH_RECORD.unpack_from(data, offset)
+                offset += PATH_RECORD.size
+                paths[path_id] = os.fsdecode(data[offset:offset + length])
+                offset += length
+            elif record_type == EVENT_RECORD_TYPE:
+                timestamp, path_id, mask, cookie, length = EVENT_RECORD.unpack_from(data, offset)
+                offset += EVENT_RECORD.size
+                name = os.fsdecode(data[offset:offset + length])
+                offset += length
+                yield timestamp, paths[path_id], mask, cookie, name
+            else:
+                raise ValueError('Corrupted event log %s (offset %d)' % (path, offset))
+
+
+class ReplayBackend(WatchBackend):
+    '''Feed the events recorded in an event log to FsRadar, with the same
+    timing (divided by `speed`, 0 meaning as fast as possible).
+
+    Nothing is read from the file system: the watches are just the paths
+    seen in the log.
+    '''
+
+    offline = True
+    tracks_paths = True
+
+    def __init__(self, log_path, speed=1):
+        self.batches = []
+        self.paths = []
+        seen = set()
+        for timestamp, path, mask, cookie, name in read_event_log(log_path):
+            if not self.batches or self.batches[-1][0] != timestamp:
+                self.batches.append((timestamp, []))
+            self.batches[-1][1].append((path, mask, cookie, name))
+            if path is not None and path not in seen:
+                seen.add(path)
+                self.paths.append(path)
+
+        self.speed = speed
+        self.next_batch = 0
+        self.wds_by_path = {}
+        self.paths_by_wd = {}
+        self.next_wd = 1
+        self.loop = None
+        self.handle = None
+        self.on_finished = None
+
+    def __len__(self):
+        return sum(len(events) for _, events in self.batches)
+
+    def add_watch(self, path, mask=None):
+        wd = self.wds_by_path.get(path)
+        if wd is None:
+            wd = self.wds_by_path[path] = self.next_wd
+            self.paths_by_wd[wd] = path
+            self.next_wd += 1
+        return wd
+
+    def rm_watch(self, wd):
+        del self.wds_by_path[self.paths_by_wd.pop(wd)]
+
+    def rename_watch(self, wd, path):
+        del self.wds_by_path[self.paths_by_wd[wd]]
+        self.wds_by_path[path] = wd
+        self.paths_by_wd[wd] = path
+
+    def is_finished(self):
+        return self.next_batch >= len(self.batches)
+
+    def read(self):
+        '''Return the next batch of events, regardless of its timing'''
+        if self.is_finished():
+            return []
+
+        _, batch = self.batches[self.next_batch]
+        self.next_batch += 1
+
+        events = []
+        for path, mask, cookie, name in batch:
+            if path is None:
+                events.append(Event(-1, mask, cookie, name))
+            elif path in self.wds_by_path:
+                events.append(Event(self.wds_by_path[path], mask, cookie, name))
+            # else: not watched (anymore), e.g. rejected by the filters
+        return events
+
+    def attach(self, loop, on_events):
+        self.loop = loop
+        start = loop.time()
+        first_timestamp = self.batches[0][0] if self.batches else 0
+
+        def on_batch_due():
+            on_events(self.read())
+            schedule_next()
+
+        def schedule_next():
+            if self.is_finished():
+                self.handle = None
+                logger.info('Replay finished')
+                if self.on_finished:
+                    self.on_finished()
+            elif not self.speed:
+                self.handle = loop.call_soon(on_batch_due)
+            else:
+                due = start + (self.batches[self.next_batch][0] - first_timestamp) / 1e9 / self.speed
+                self.handle = loop.call_at(due, on_batch_due)
+
+        schedule_next()
+
+    def detach(self):
+        if self.handle:
+            self.handle.cancel()
+            self.handle = None
+        self.loop = None
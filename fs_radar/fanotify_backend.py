@@ -0,0 +1,218 @@
+import ctypes
+import errno
+import logging
+import os
+import struct
+
+from inotify_simple import Event, flags
+
+from fs_radar.watch_backend import WatchBackend
+
+logger = logging.getLogger(__name__)
+
+FAN_CLOEXEC = 0x01
+FAN_NONBLOCK = 0x02
+FAN_CLASS_NOTIF = 0x00
+FAN_REPORT_DIR_FID = 0x400
+FAN_REPORT_NAME = 0x800
+FAN_REPORT_DFID_NAME = FAN_REPORT_DIR_FID | FAN_REPORT_NAME
+
+FAN_MARK_ADD = 0x01
+FAN_MARK_FILESYSTEM = 0x100
+
+FAN_EVENT_INFO_TYPE_FID = 1
+FAN_EVENT_INFO_TYPE_DFID_NAME = 2
+FAN_EVENT_INFO_TYPE_DFID = 3
+
+AT_FDCWD = -100
+MAX_HANDLE_SZ = 128
+
+# the fanotify event bits we use have the same value as the inotify ones
+# (FAN_ONDIR is IN_ISDIR, FAN_Q_OVERFLOW is IN_Q_OVERFLOW)
+FANOTIFY_MASK = \
+    flags.CLOSE_WRITE | \
+    flags.CREATE | \
+    flags.DELETE | \
+    flags.DELETE_SELF | \
+    flags.MOVE_SELF | \
+    flags.MOVED_FROM | \
+    flags.MOVED_TO
+FAN_ONDIR = flags.ISDIR
+
+READ_SIZE = 65536
+
+# event_len, vers, reserved, metadata_len, mask, fd, pid
+EVENT_METADATA = struct.Struct('=IBBHQii')
+# info_type, pad, len
+INFO_HEADER = struct.Struct('=BBH')
+# fsid (two ints), handle_bytes, handle_type
+FID_HEADER = struct.Struct('=IIIi')
+
+
+class FileHandle(ctypes.Structure):
+    _fields_ = [
+        ('handle_bytes', ctypes.c_uint),
+        ('handle_type', ctypes.c_int),
+        ('f_handle', ctypes.c_ubyte * MAX_HANDLE_SZ),
+    ]
+
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.fanotify_init.argtypes = [ctypes.c_uint, ctypes.c_uint]
+        libc.fanotify_mark.argtypes = [ctypes.c_int, ctypes.c_uint, ctypes.c_uint64, ctypes.c_int, ctypes.c_char_p]
+        libc.name_to_handle_at.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.POINTER(FileHandle), ctypes.POINTER(ctypes.c_int), ctypes.c_int
+        ]
+        _libc = libc
+    return _libc
+
+
+def _raise_errno(what, path=None):
+    err = ctypes.get_errno()
+    raise OSError(err, '%s: %s' % (what, os.strerror(err)), path)
+
+
+def get_file_id(path):
+    '''Return the identifier of the directory at `path` as reported by
+    fanotify: (file system id, handle type, handle)'''
+    handle = FileHandle(handle_bytes=MAX_HANDLE_SZ)
+    mount_id = ctypes.c_int()
+    if _get_libc().name_to_handle_at(AT_FDCWD, os.fsencode(path), ctypes.byref(handle), ctypes.byref(mount_id), 0):
+        _raise_errno('name_to_handle_at', path)
+    return (os.statvfs(path).f_fsid, handle.handle_type, bytes(handle.f_handle[:handle.handle_bytes]))
+
+
+class FanotifyBackend(WatchBackend):
+    '''Receive the events from the kernel through fanotify.
+
+    Instead of one inotify watch per directory, the whole file system
+    holding a directory is marked once (FAN_MARK_FILESYSTEM): the kernel
+    memory used doesn't depend on the number of directories. Events come
+    with the file handle of the directory they happened in and its name
+    (FAN_REPORT_DFID_NAME); the ones from directories that aren't watched
+    are dropped here.
+
+    It requires Linux 5.9 and the CAP_SYS_ADMIN capability (root).
+    '''
+
+    def __init__(self):
+        self.fd = _get_libc().fanotify_init(
+            FAN_CLASS_NOTIF | FAN_CLOEXEC | FAN_NONBLOCK | FAN_REPORT_DFID_NAME,
+            os.O_RDONLY
+        )
+        if self.fd < 0:
+            _raise_errno('fanotify_init')
+
+        self.marked_fsids = set()
+        self.wds_by_fid = {}
+        self.fids = {}
+        self.next_wd = 1
+        self.loop = None
+
+    def add_watch(self, path, mask):
+        fid = get_file_id(path)
+        fsid = fid[0]
+
+        if fsid not in self.marked_fsids:
+            fan_mask = (mask & FANOTIFY_MASK) | FAN_ONDIR
+            mark_flags = FAN_MARK_ADD | FAN_MARK_FILESYSTEM
+            if _get_libc().fanotify_mark(self.fd, mark_flags, fan_mask, AT_FDCWD, os.fsencode(path)):
+                _raise_errno('fanotify_mark', path)
+            self.marked_fsids.add(fsid)
+            logger.debug('Marked the file system of %s', path)
+
+        # like inotify, the same directory gets the same watch descriptor
+        wd = self.wds_by_fid.get(fid)
+        if wd is None:
+            wd = self.next_wd
+            self.next_wd += 1
+            self.wds_by_fid[fid] = wd
+            self.fids[wd] = fid
+
+        return wd
+
+    def rm_watch(self, wd):
+        try:
+            fid = self.fids.pop(wd)
+        except KeyError:
+            raise OSError(errno.EINVAL, 'Unknown watch descriptor %d' % wd) from None
+        del self.wds_by_fid[fid]
+
+    def read(self):
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            events.extend(self._decode(data))
+        return events
+
+    def _decode(self, data):
+        events = []
+        offset = 0
+
+        while offset + EVENT_METADATA.size <= len(data):
+            event_len, _, _, metadata_len, mask, fd, _ = EVENT_METADATA.unpack_from(data, offset)
+            if fd >= 0:
+                os.close(fd)
+
+            if mask & flags.Q_OVERFLOW:
+                events.append(Event(-1, flags.Q_OVERFLOW, 0, ''))
+            else:
+                event = self._decode_event(data, offset + metadata_len, offset + event_len, mask)
+                if event is not None:
+                    events.append(event)
+                    if event.mask & flags.DELETE_SELF:
+                        # the kernel won't report anything from it anymore
+                        self.rm_watch(event.wd)
+                        events.append(Event(event.wd, flags.IGNORED, 0, ''))
+
+            offset += event_len
+
+        return events
+
+    def _decode_event(self, data, offset, end, mask):
+        '''Turn the info records between `offset` and `end` into an
+        inotify event, or None if the directory isn't watched'''
+        while offset + INFO_HEADER.size <= end:
+            info_type, _, info_len = INFO_HEADER.unpack_from(data, offset)
+            if info_len == 0:
+                break
+            if info_type in (FAN_EVENT_INFO_TYPE_DFID_NAME, FAN_EVENT_INFO_TYPE_DFID):
+                fsid_low, fsid_high, handle_bytes, handle_type = FID_HEADER.unpack_from(data, offset + INFO_HEADER.size)
+                handle_offset = offset + INFO_HEADER.size + FID_HEADER.size
+                fsid = fsid_low | (fsid_high << 32)
+                wd = self.wds_by_fid.get((fsid, handle_type, data[handle_offset:handle_offset + handle_bytes]))
+                if wd is None:
+                    return None
+
+                name = ''
+                if info_type == FAN_EVENT_INFO_TYPE_DFID_NAME:
+                    raw_name = data[handle_offset + handle_bytes:offset + info_len].split(b'\0', 1)[0]
+                    name = '' if raw_name == b'.' else os.fsdecode(raw_name)
+
+                return Event(wd, mask & (FANOTIFY_MASK | FAN_ONDIR), 0, name)
+            offset += info_len
+
+        return None
+
+    def attach(self, loop, on_events):
+        self.loop = loop
+        loop.add_reader(self.fd, lambda: on_events(self.read()))
+
+    def detach(self):
+        self.loop.remove_reader(self.fd)
+        self.loop = None
+
+    def close(self):
+        logger.debug('Close fanotify descriptor')
+        os.close(self.fd)
@@ -0,0 +1,71 @@
+'''Build what the groups of a config need: the filters of the directories
+to watch (from the rules of every group), their launch pads and the
+notifier handing them the paths matched. Shared by the command line and
+the daemon.
+'''
+
+from functools import lru_cache
+from itertools import chain
+import os
+from os.path import relpath
+
+from fs_radar.cmd_launch_pad import CmdLaunchPad
+from fs_radar.dir_scanner import DirScanner
+from fs_radar.path_filter import makeDirFilter, makeSubtreeFilter
+
+
+def get_dirs_to_watch(basedir, path_filter, subtree_filter=None, workers=None):
+    '''
+    Generator to iterate over all the directories that are matched
+    by `path_filter`.
+    Both `path_filter` and `subtree_filter` (used to skip the subtrees
+    that cannot hold any matching directory) act on paths relative
+    to `basedir`.
+    '''
+
+    # every scanned path starts with basedir, slicing is cheaper than relpath()
+    prefix_length = len(os.path.join(basedir, ''))
+
+    scanner = DirScanner(
+        subtree_filter=subtree_filter and (lambda path: subtree_filter(path[prefix_length:])),
+        workers=workers
+    )
+
+    for path in scanner.scan(basedir):
+        if path_filter(path[prefix_length:] or '.'):
+            yield path
+
+
+def get_rules(groups):
+    return sorted(set(chain(
+        *(d['rules'] for d in groups.values())
+    )))
+
+
+def get_dir_filter(groups):
+    return makeDirFilter(get_rules(groups))
+
+
+def get_subtree_filter(groups):
+    return makeSubtreeFilter(get_rules(groups))
+
+
+def make_launch_pads_notifier(dispatcher, basedir):
+    '''Request a command execution from each launch_pad whose
+    filters match `path`'''
+    get_relpath = lru_cache(maxsize=dispatcher.cache_info().maxsize)(
+        lambda path: relpath(path, basedir)
+    )
+
+    def notify(ev):
+        path = get_relpath(ev.data)
+        for lp in dispatcher.match(path):
+            lp.add_item_to_process(path)
+
+    return notify
+
+
+def make_launch_pad(name, group, cwd=None):
+    '''Return the pair (rules, launch pad) of the group `name`, whose
+    commands run in `cwd` (default: the current directory)'''
+    return group['rules'], CmdLaunchPad(group['cmd'], options={**group, 'name': name, 'cwd': cwd})
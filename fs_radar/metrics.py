@@ -0,0 +1,246 @@
+'''Metrics of fs_radar, exposed in the Prometheus text format.
+
+The components keep their own counters (plain integers, we run inside a
+single event loop so no locking is needed); they are read and formatted
+only when the metrics are scraped.
+'''
+
+import asyncio
+from bisect import bisect_left
+from collections import namedtuple
+import logging
+import os
+
+from inotify_simple import flags
+
+logger = logging.getLogger(__name__)
+
+# seconds, from a quick formatter to a whole test suite
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# seconds from the request to the spawn of the command
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+# samples are tuples (name suffix, labels dict, value)
+Metric = namedtuple('Metric', ['name', 'type', 'help', 'samples'])
+
+
+class Histogram:
+    '''Count observed values into fixed buckets (upper bounds, inclusive)'''
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_samples(self, labels):
+        '''Return the (cumulative) samples of the histogram'''
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            samples.append(('_bucket', {**labels, 'le': format_value(bound)}, cumulative))
+        samples.append(('_sum', labels, self.sum))
+        samples.append(('_count', labels, self.count))
+        return samples
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render_metrics(metrics):
+    '''Return the text exposition format of `metrics` (iterable of Metric)'''
+    lines = []
+    for metric in metrics:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        for suffix, labels, value in metric.samples:
+            if labels:
+                labels = ','.join('%s="%s"' % (key, escape_label_value(label)) for key, label in labels.items())
+                lines.append('%s%s{%s} %s' % (metric.name, suffix, labels, format_value(value)))
+            else:
+                lines.append('%s%s %s' % (metric.name, suffix, format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def collect_radar_metrics(fsr):
+    '''Return the metrics of the FsRadar `fsr`'''
+    events_by_flag = {}
+    for mask, count in fsr.events_by_mask.items():
+        for flag in flags.from_mask(mask):
+            events_by_flag[flag.name] = events_by_flag.get(flag.name, 0) + count
+
+    polled = sum(1 for wd in fsr.wds if fsr.is_polled(wd))
+
+    return [
+        Metric('fs_radar_events_total', 'counter', 'File system events read, by flag',
+               [('', {'flag': name}, count) for name, count in sorted(events_by_flag.items())]),
+        Metric('fs_radar_queue_overflows_total', 'counter', 'Times the kernel event queue overflowed',
+               [('', {}, fsr.queue_overflows)]),
+        Metric('fs_radar_watches', 'gauge', 'Directories watched',
+               [('', {'kind': 'kernel'}, len(fsr.wds) - polled), ('', {'kind': 'polled'}, polled)]),
+        Metric('fs_radar_pending_moves', 'gauge', 'Moves waiting for their pair',
+               [('', {}, len(fsr.pending_moves))]),
+    ]
+
+
+LAUNCH_PAD_COUNTERS = (
+    ('requests', 'fs_radar_matches_total', 'Paths matched by the group'),
+    ('skipped_unchanged', 'fs_radar_skipped_unchanged_total', 'Matches skipped because the file did not change'),
+    ('discarded', 'fs_radar_discarded_total', 'Requests discarded because the command was running'),
+    ('held', 'fs_radar_held_total', 'Paths held until the running command exits'),
+    ('started', 'fs_radar_processes_started_total', 'Commands started'),
+    ('failed_to_start', 'fs_radar_processes_failed_to_start_total', 'Commands that could not be started'),
+    ('interrupted', 'fs_radar_processes_interrupted_total', 'Commands interrupted by a newer request'),
+    ('timed_out', 'fs_radar_processes_timed_out_total', 'Commands killed because they timed out'),
+    ('output_lines_dropped', 'fs_radar_output_lines_dropped_total', 'Lines of output dropped, not logged in time'),
+)
+
+
+def collect_launch_pads_metrics(launch_pads):
+    '''Return the metrics of the groups run by `launch_pads`'''
+    metrics = []
+
+    for key, name, help in LAUNCH_PAD_COUNTERS:
+        metrics.append(Metric(name, 'counter', help, [
+            ('', {'group': lp.options['name']}, lp.counters[key]) for lp in launch_pads
+        ]))
+
+    metrics.append(Metric('fs_radar_queue_depth', 'gauge', 'Paths and command lines waiting to be run', [
+        ('', {'group': lp.options['name']}, lp.get_queue_depth()) for lp in launch_pads
+    ]))
+    metrics.append(Metric('fs_radar_process_running', 'gauge', 'Commands running', [
+        ('', {'group': lp.options['name']}, len(lp.jobs)) for lp in launch_pads
+    ]))
+
+    for attr, name, help in (
+        ('duration_histogram', 'fs_radar_command_duration_seconds', 'Time the commands took to run'),
+        ('latency_histogram', 'fs_radar_spawn_latency_seconds',
+         'Time from the match of a path to the spawn of the command'),
+    ):
+        samples = []
+        for lp in launch_pads:
+            samples.extend(getattr(lp, attr).get_samples({'group': lp.options['name']}))
+        metrics.append(Metric(name, 'histogram', help, samples))
+
+    return metrics
+
+
+def collect_scheduler_metrics(scheduler):
+    '''Return the metrics of the ProcessScheduler `scheduler`'''
+    return [
+        Metric('fs_radar_scheduler_processes', 'gauge', 'Processes started through the scheduler and running',
+               [('', {}, scheduler.running)]),
+        Metric('fs_radar_scheduler_waiting_groups', 'gauge', 'Groups waiting for a process slot',
+               [('', {}, len(scheduler.waiting))]),
+        Metric('fs_radar_scheduler_throttled_total', 'counter', 'Times the processes were held back by the load',
+               [('', {}, scheduler.throttled)]),
+    ]
+
+
+def parse_metrics_address(address):
+    '''Parse `address`, either "unix:/path/to/socket" or "[host:]port".
+
+    @return tuple ('unix', path) or ('tcp', host, port)
+    @raise ValueError if the address is not valid
+    '''
+    address = str(address)
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if not path:
+            raise ValueError('Missing path of the unix socket in \'%s\'' % address)
+        return 'unix', path
+
+    host, _, port = address.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError('Invalid metrics address \'%s\'' % address) from None
+    if not 0 < port < 65536:
+        raise ValueError('Invalid port in metrics address \'%s\'' % address)
+    return 'tcp', host.strip('[]') or '127.0.0.1', port
+
+
+class MetricsServer:
+    '''Minimal HTTP server answering GET /metrics with the metrics
+    returned by `collect`, listening on a TCP port or a unix socket'''
+
+    def __init__(self, address, collect):
+        '''
+        @param string address where to listen (see parse_metrics_address)
+        @param callable collect return the metrics to expose
+        '''
+        self.address = parse_metrics_address(address)
+        self.collect = collect
+        self.server = None
+
+    async def start(self):
+        if self.address[0] == 'unix':
+            path = self.address[1]
+            if os.path.exists(path):
+                os.unlink(path)  # left behind by a previous run
+            self.server = await asyncio.start_unix_server(self.on_client, path)
+        else:
+            self.server = await asyncio.start_server(self.on_client, self.address[1], self.address[2])
+        logger.debug('Metrics available at %s', self.get_url())
+
+    def close(self):
+        if self.server:
+            self.server.close()
+            self.server = None
+            if self.address[0] == 'unix':
+                try:
+                    os.unlink(self.address[1])
+                except OSError:
+                    pass
+
+    def get_url(self):
+        if self.address[0] == 'unix':
+            return 'unix:%s' % self.address[1]
+        host, port = self.server.sockets[0].getsockname()[:2] if self.server else self.address[1:]
+        return 'http://%s:%d/metrics' % (host, port)
+
+    async def on_client(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass  # headers
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] not in ('GET', 'HEAD'):
+                status, body = '405 Method Not Allowed', 'Method not allowed\n'
+            elif parts[1].split('?')[0] not in ('/', '/metrics'):
+                status, body = '404 Not Found', 'Not found\n'
+            else:
+                status, body = '200 OK', render_metrics(self.collect())
+
+            data = body.encode('utf-8')
+            writer.write((
+                'HTTP/1.0 %s\r\n'
+                'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                'Content-Length: %d\r\n'
+                'Connection: close\r\n\r\n' % (status, len(data))
+            ).encode('latin-1'))
+            if parts[:1] != ['HEAD']:
+                writer.write(data)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug('Metrics client gone: %r', e)
+        finally:
+            writer.close()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# *-* encoding: utf-8 *-*
+
+from functools import lru_cache
+import re
+
+from fs_radar.path_filter import makePathFilter, ruleToRegexp
+
+
+class PathDispatcher:
+    '''Find, in a single pass, every target whose rules match a path.
+
+    Each target (e.g. a launch pad) is registered with its own rules.
+    Instead of running the filter of every target, the literal parts of
+    the include rules are indexed (file name, file suffix, first directory,
+    any directory) so that only the targets that may match a path are
+    verified. Rules without any literal part are merged in a single
+    regular expression that is used to quickly reject a path.
+
+    The last `cache_size` decisions are kept in a LRU cache, emptied
+    whenever a target is added or removed.
+    '''
+
+    def __init__(self, cache_size=4096):
+        self.rules = {}
+        self.filters = {}
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+        self._build()
+
+    def add(self, target, rules):
+        '''Register `target`, that will be matched by `rules`'''
+        self.rules[target] = list(rules)
+        self.filters[target] = makePathFilter(rules)
+        self._index(target)
+        self.match.cache_clear()
+
+    def remove(self, target):
+        '''Unregister `target`'''
+        self.rules.pop(target)
+        self.filters.pop(target)
+        self._build()
+        self.match.cache_clear()
+
+    def cache_info(self):
+        '''Return the statistics (hits, misses, ...) of the cache'''
+        return self.match.cache_info()
+
+    def _match(self, path):
+        '''Return the targets whose rules match `path`, in order of registration'''
+        if not path:
+            return ()
+
+        components = (path[2:] if path.startswith('./') else path).split('/')
+        basename = components[-1]
+
+        candidates = set()
+        candidates.update(self.by_name.get(basename, ()))
+        for length in self.suffix_lengths:
+            candidates.update(self.by_suffix.get(basename[-length:], ()))
+        candidates.update(self.by_first_dir.get(components[0], ()))
+        for component in components:
+            candidates.update(self.by_dir.get(component, ()))
+        if self.generic and self._get_generic_regexp().match(path):
+            candidates.update(self.generic)
+
+        return tuple(sorted(
+            (target for target in candidates if self.filters[target](path)),
+            key=self.order.__getitem__
+        ))
+
+    def _build(self):
+        self.order = {}
+        self.by_name = {}
+        self.by_suffix = {}
+        self.by_first_dir = {}
+        self.by_dir = {}
+        self.suffix_lengths = []
+        self.generic = set()
+        self.generic_regexps = set()
+        self.generic_regexp = None
+
+        for target in self.rules:
+            self._index(target)
+
+    def _index(self, target):
+        self.order[target] = len(self.order)
+
+        for rule in self.rules[target]:
+            if rule.startswith('!') or rule.startswith('+'):
+                # they can only reduce (or restore) what was included
+                continue
+
+            key = _get_rule_index_key(rule)
+            if key is None:
+                self.generic.add(target)
+                self.generic_regexps.add(ruleToRegexp(rule))
+                self.generic_regexp = None
+            else:
+                index_name, literal = key
+                getattr(self, index_name).setdefault(literal, set()).add(target)
+
+        self.suffix_lengths = sorted(set(len(suffix) for suffix in self.by_suffix))
+
+    def _get_generic_regexp(self):
+        if self.generic_regexp is None:
+            self.generic_regexp = re.compile('|'.join(sorted(self.generic_regexps)))
+        return self.generic_regexp
+
+
+def _get_rule_index_key(rule):
+    '''Return the most selective literal part of an include rule, as a
+    pair (index name, literal), or None if the rule has no literal part.
+
+    The rule is parsed as in `ruleToRegexp`: a component without asterisks
+    can only match a whole component of a path.'''
+
+    is_dir = rule.endswith('/')
+    if is_dir:
+        rule = rule[:-1]
+
+    any_depth = not rule.startswith('./')
+    rule = re.sub('([^.]|^)(\\./)+', '\\1', rule)
+
+    if rule == '.' or not rule:
+        return None
+
+    components = rule.split('/')
+    literals = [c for c in components if c and '*' not in c]
+    last = components[-1]
+
+    if not is_dir and '*' not in last:
+        return ('by_name', last)
+
+    # a directory is usually more selective than a suffix (e.g. '.py')
+    if not any_depth and '*' not in components[0]:
+        return ('by_first_dir', components[0])
+
+    if literals:
+        return ('by_dir', max(literals, key=len))
+
+    suffix = last.rsplit('*', 1)[1]
+    if not is_dir and suffix:
+        return ('by_suffix', suffix)
+
+    return None
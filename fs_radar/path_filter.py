@@ -105,6 +105,12 @@ def makeDirFilter(rules):
     his parent directory instead.
     '''
 
+    return makePathFilter(toDirRules(rules))
+
+
+def toDirRules(rules):
+    '''Return the dir rules used by `makeDirFilter`'''
+
     dir_rules = []
 
     for rule in rules:
@@ -119,4 +125,78 @@ def makeDirFilter(rules):
             else:
                 dir_rules.append(rule.rsplit('/', 1)[0] + '/')
 
-    return makePathFilter(sorted(set(dir_rules)))
+    return sorted(set(dir_rules))
+
+
+def makeSubtreeFilter(rules):
+    """Accept a list of `rules` and return a function that, given the path
+    of a directory, return False if neither the directory nor any of its
+    descendants can be accepted by `makeDirFilter(rules)`.
+
+    It never returns False for a subtree that holds a matching directory,
+    so it can be used to avoid descending into a subtree while scanning it.
+    """
+
+    includeRules = []
+    excludeRegExps = []
+    doNotExcludeRules = []
+
+    for rule in toDirRules(rules):
+        if rule.startswith('+'):
+            doNotExcludeRules.append(rule[1:])
+        elif rule.startswith('!'):
+            rule = rule[1:]
+            # only these rules exclude every descendant of a matching path
+            if rule.endswith('/') or rule.endswith('**') or rule == '.':
+                excludeRegExps.append(ruleToRegexp(rule))
+        else:
+            includeRules.append(rule)
+
+    EXCLUDE_REGEXP = re.compile('|'.join(sorted(set(excludeRegExps)))) if excludeRegExps else None
+    may_include = _makeDescendantsFilter(includeRules)
+    may_not_exclude = _makeDescendantsFilter(doNotExcludeRules)
+
+    def subtree_filter(path):
+        return bool(may_include(path) and  # noqa
+            (not (EXCLUDE_REGEXP and EXCLUDE_REGEXP.match(path)) or may_not_exclude(path))
+        )
+
+    return subtree_filter
+
+
+def _makeDescendantsFilter(rules):
+    '''Return a function that, given the path of a directory, return False
+    if neither the directory nor its descendants can match any of `rules`'''
+
+    anchored = []
+
+    for rule in rules:
+        rule = rule.rstrip('/')
+        if not rule.startswith('./'):
+            # it can match at any depth, so under any directory
+            return lambda path: True
+
+        rule = re.sub('([^.]|^)(\\./)+', '\\1', rule)
+        if rule in ('', '.'):
+            return lambda path: True
+
+        anchored.append([
+            None if '**' in component else
+            re.compile(re.escape(component).replace('\\*', '[^/]*') + '$')
+            for component in rule.split('/')
+        ])
+
+    def descendants_filter(path):
+        components = [c for c in path.split('/') if c and c != '.']
+        for rule_components in anchored:
+            for component, regexp in zip(components, rule_components):
+                if regexp is None:
+                    # ** can match any number of components
+                    return True
+                if not regexp.match(component):
+                    break
+            else:
+                return True
+        return False
+
+    return descendants_filter
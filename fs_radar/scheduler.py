@@ -0,0 +1,129 @@
+'''Share the processes that may run at once among the launch pads.
+
+A launch pad with a command line ready asks the scheduler for a slot and
+waits until it gets one. The slots are handed out to the groups with the
+highest `priority` first and, between groups with the same priority, to
+the one running the fewest commands for its `weight`. New processes are
+held back while the system is overloaded (load average or available
+memory), but one process at least is always allowed to run.
+'''
+
+from itertools import count
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def get_available_memory():
+    '''Return the memory available to start new processes, in bytes
+    (None if unknown)'''
+    try:
+        with open('/proc/meminfo', 'rb') as fp:
+            for line in fp:
+                if line.startswith(b'MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class ProcessScheduler:
+
+    def __init__(self, max_processes=0, max_load=None, min_available_memory=None, check_interval=1):
+        '''
+        @param int max_processes max number of processes running at once
+                   (0 for no limit)
+        @param float max_load no process is started while the load average
+                     of the last minute is higher
+        @param int min_available_memory no process is started while the
+                   available memory, in bytes, is lower
+        @param float check_interval seconds between two checks of the load
+                     while the processes are held back
+        '''
+        self.max_processes = max_processes
+        self.max_load = max_load
+        self.min_available_memory = min_available_memory
+        self.check_interval = check_interval
+        self.loop = None
+
+        # launch pads waiting for a slot, by order of arrival
+        self.waiting = {}
+        self.arrivals = count()
+        self.running = 0
+        self.dispatch_handle = None
+        # exposed by the metrics
+        self.throttled = 0
+
+    def attach(self, loop):
+        self.loop = loop
+
+    def close(self):
+        if self.dispatch_handle:
+            self.dispatch_handle.cancel()
+            self.dispatch_handle = None
+        self.waiting.clear()
+        self.loop = None
+
+    def submit(self, lp):
+        '''The launch pad `lp` has a command line ready to run: call its
+        `run_next_cmd_line` once it gets a slot'''
+        if lp not in self.waiting:
+            self.waiting[lp] = next(self.arrivals)
+        self.schedule_dispatch()
+
+    def release(self):
+        '''A process started through the scheduler terminated'''
+        self.running -= 1
+        if self.waiting:
+            self.schedule_dispatch()
+
+    def forget(self, lp):
+        '''The launch pad `lp` doesn't need a slot anymore'''
+        self.waiting.pop(lp, None)
+
+    def schedule_dispatch(self, delay=0):
+        # dispatch outside of the launch pads' callbacks
+        if self.dispatch_handle is None and self.loop is not None:
+            self.dispatch_handle = self.loop.call_later(delay, self.dispatch)
+
+    def dispatch(self):
+        '''Hand the free slots to the launch pads waiting'''
+        self.dispatch_handle = None
+
+        while self.waiting:
+            if self.max_processes and self.running >= self.max_processes:
+                return
+            if self.running and self.is_overloaded():
+                self.throttled += 1
+                self.schedule_dispatch(self.check_interval)
+                return
+
+            lp = min(self.waiting, key=self.get_rank)
+            if lp.wants_slot():
+                self.running += 1
+                lp.run_next_cmd_line()
+            if not lp.wants_slot():
+                del self.waiting[lp]
+
+    def get_rank(self, lp):
+        '''Sort key of the launch pads waiting, the first gets the slot'''
+        return (
+            -(lp.options['priority'] or 0),
+            len(lp.jobs) / (lp.options['weight'] or 1),
+            self.waiting[lp]
+        )
+
+    def is_overloaded(self):
+        '''Should new processes be held back?'''
+        if self.max_load and os.getloadavg()[0] > self.max_load:
+            logger.debug('Load average above %s, processes held back', self.max_load)
+            return True
+
+        if self.min_available_memory:
+            available = get_available_memory()
+            if available is not None and available < self.min_available_memory:
+                logger.debug('Available memory below %d bytes, processes held back', self.min_available_memory)
+                return True
+
+        return False
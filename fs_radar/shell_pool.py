@@ -0,0 +1,337 @@
+'''Shells started (and initialized, e.g. their bash profile sourced) in
+advance, so that a command runs as soon as it's requested.
+
+A warm shell reads the commands from a pipe and runs each of them as a
+job of its own (job control puts it in a new process group, so that a
+timeout kills the whole group and not the shell), reporting the pid and
+then the exit status of the job on another pipe. The output of the jobs
+goes to the output of the shell, read without blocking like the one of
+a ShellCommand.
+'''
+
+from collections import deque
+import fcntl
+import logging
+import os
+import pty
+import signal
+import subprocess
+
+from fs_radar.shell_process import READ_CHUNK_SIZE, get_shell_args, split_lines, watch_process_exit
+
+logger = logging.getLogger(__name__)
+
+# The shell's own messages (e.g. the notifications of the jobs) are
+# discarded, the jobs get back the original stderr. A background job is
+# not interactive anymore, aliases must be enabled again.
+WARM_SHELL_SCRIPT = '''
+exec {stderr_fd}>&2 2>/dev/null
+set -m
+while IFS= read -r -d '' __fs_radar_cmd <&{cmd_fd}; do
+    (
+        exec 2>&{stderr_fd} {stderr_fd}>&- {cmd_fd}<&- {status_fd}>&-
+        shopt -s expand_aliases
+        eval "$__fs_radar_cmd"
+    ) </dev/null &
+    echo "pid $!" >&{status_fd}
+    wait $!
+    echo "exit $?" >&{status_fd}
+done
+'''
+
+# room for the longest command line, written before the shell is ready
+# (what doesn't fit is written as the shell reads it)
+COMMANDS_PIPE_SIZE = 1024 * 1024
+
+
+class WarmShell:
+    '''A shell waiting for commands to run, one at a time'''
+
+    def __init__(self, pool, encoding='utf-8'):
+        self.pool = pool
+        self.loop = pool.loop
+        self.encoding = encoding
+        self.runs = 0
+        self.command = None
+        self.partial_line = b''
+        self.status_buffer = b''
+        # commands not yet written to the pipe
+        self.cmd_buffer = b''
+
+        cmd_r, self.cmd_w = os.pipe()
+        self.status_r, status_w = os.pipe()
+        try:
+            fcntl.fcntl(self.cmd_w, fcntl.F_SETPIPE_SZ, COMMANDS_PIPE_SIZE)
+        except (AttributeError, OSError):
+            pass  # the writes may wait for the shell to start
+
+        script = WARM_SHELL_SCRIPT.format(
+            cmd_fd=cmd_r,
+            status_fd=status_w,
+            stderr_fd=max(cmd_r, status_w) + 1
+        )
+        self.pty_master, slave = pty.openpty()
+        self.p = subprocess.Popen(
+            get_shell_args(script, pool.bash_profile),
+            stdin=slave,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=pool.cwd,
+            pass_fds=(cmd_r, status_w),
+            start_new_session=True
+        )
+        for fd in (slave, cmd_r, status_w):
+            os.close(fd)
+
+        os.set_blocking(self.p.stdout.fileno(), False)
+        os.set_blocking(self.status_r, False)
+        os.set_blocking(self.cmd_w, False)
+        self.loop.add_reader(self.p.stdout.fileno(), self._on_output_readable)
+        self.loop.add_reader(self.status_r, self._on_status_readable)
+        watch_process_exit(self.loop, self.p, lambda returncode: None)
+
+    def is_alive(self):
+        return self.cmd_w is not None
+
+    def run(self, command):
+        '''Run the PooledShellCommand `command`'''
+        self.command = command
+        was_empty = not self.cmd_buffer
+        self.cmd_buffer += command.cmd.encode(self.encoding) + b'\0'
+        if was_empty:
+            self._on_cmd_writable()
+
+    def _on_cmd_writable(self):
+        '''Write to the shell what it can take of the commands buffered'''
+        try:
+            written = os.write(self.cmd_w, self.cmd_buffer)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            written = len(self.cmd_buffer)  # the shell is gone, its exit is notified
+        self.cmd_buffer = self.cmd_buffer[written:]
+
+        if self.cmd_buffer:
+            self.loop.add_writer(self.cmd_w, self._on_cmd_writable)
+        else:
+            self.loop.remove_writer(self.cmd_w)
+
+    def close(self):
+        '''Let the shell go (killing the job still running, if any)'''
+        if not self.is_alive():
+            return
+
+        command = self.command
+        if command:
+            command.signal_job(signal.SIGKILL)
+            self.command = None
+            try:
+                os.killpg(self.p.pid, signal.SIGKILL)  # it's waiting for the job
+            except ProcessLookupError:
+                pass
+
+        self.loop.remove_reader(self.p.stdout.fileno())
+        self.loop.remove_reader(self.status_r)
+        self.loop.remove_writer(self.cmd_w)
+        self.cmd_buffer = b''
+        os.close(self.cmd_w)  # the shell reads EOF and exits
+        os.close(self.status_r)
+        os.close(self.pty_master)
+        self.p.stdout.close()
+        self.cmd_w = None
+
+        if command:
+            command.on_job_exit(-signal.SIGKILL)
+
+    def _on_output_readable(self):
+        try:
+            data = os.read(self.p.stdout.fileno(), READ_CHUNK_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if data:
+            self._on_data(data)
+        else:
+            self.loop.remove_reader(self.p.stdout.fileno())
+
+    def _on_data(self, data):
+        lines, self.partial_line = split_lines(self.partial_line, data, self.encoding)
+
+        # output printed while no command runs (e.g. by the bash profile) is discarded
+        on_output = self.command and self.command.on_output
+        if on_output and lines:
+            on_output(lines)
+
+    def _on_status_readable(self):
+        try:
+            data = os.read(self.status_r, 4096)
+        except BlockingIOError:
+            return
+
+        if not data:
+            logger.debug('Warm shell %d exited', self.p.pid)
+            command = self.command
+            self.command = None
+            self.close()
+            self.pool.on_shell_gone(self)
+            if command:
+                command.on_job_exit(-1)
+            return
+
+        lines = (self.status_buffer + data).split(b'\n')
+        self.status_buffer = lines.pop()
+        for line in lines:
+            kind, _, value = line.decode('ascii').partition(' ')
+            if kind == 'pid' and self.command:
+                self.command.on_job_started(int(value))
+            elif kind == 'exit':
+                self._on_job_exit(int(value))
+
+    def _on_job_exit(self, returncode):
+        # read what the job left in the pipe (it's all there, it exited)
+        while True:
+            try:
+                data = os.read(self.p.stdout.fileno(), READ_CHUNK_SIZE)
+            except OSError:
+                break
+            if not data:
+                break
+            self._on_data(data)
+        if self.partial_line:
+            self._on_data(b'\n')
+
+        command = self.command
+        self.command = None
+        self.runs += 1
+        self.pool.release(self)
+        if command:
+            command.on_job_exit(returncode)
+
+
+class PooledShellCommand:
+    '''A command run by a warm shell of a ShellPool, with the interface
+    of a ShellCommand'''
+
+    def __init__(self, pool, cmd):
+        self.pool = pool
+        self.cmd = cmd
+        self.loop = None
+        self.shell = None
+        self.job_pid = None
+        self.pending_signal = None
+        self.returncode = None
+        self.on_output = None
+        self.on_exit = None
+        self.kill_handle = None
+
+    def start(self, loop, on_output, on_exit):
+        '''Run the command in a warm shell (see ShellCommand.start)'''
+        self.loop = loop
+        self.on_output = on_output
+        self.on_exit = on_exit
+        self.shell = self.pool.acquire()
+        self.shell.run(self)
+
+    def is_running(self):
+        return self.shell is not None and self.returncode is None
+
+    def terminate(self, grace_period=2, on_exit=None):
+        '''Stop the process group of the command sending SIGTERM and, if
+        it wasn't enough, SIGKILL after `grace_period` seconds (see
+        ShellCommand.terminate)'''
+        self.on_output = None
+        self.on_exit = on_exit
+
+        if self.is_running():
+            self.signal_job(signal.SIGTERM)
+            self.kill_handle = self.loop.call_later(grace_period, self.signal_job, signal.SIGKILL)
+        elif on_exit:
+            on_exit(self.returncode)
+
+    def signal_job(self, signum):
+        if self.job_pid is None:
+            self.pending_signal = signum  # the shell didn't start it yet
+            return
+        try:
+            os.killpg(self.job_pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def on_job_started(self, pid):
+        self.job_pid = pid
+        if self.pending_signal:
+            self.signal_job(self.pending_signal)
+
+    def on_job_exit(self, returncode):
+        self.returncode = returncode
+
+        if self.kill_handle:
+            self.kill_handle.cancel()
+            self.kill_handle = None
+
+        if self.on_exit:
+            self.on_exit(returncode)
+
+
+class ShellPool:
+    '''Keep `size` warm shells ready to run the commands of a group. A
+    shell is replaced after having run `max_runs` commands (so that what
+    a command leaves behind in the shell doesn't last forever)'''
+
+    def __init__(self, size=1, max_runs=100, bash_profile=None, cwd=None):
+        self.size = size
+        self.max_runs = max_runs
+        self.bash_profile = bash_profile
+        self.cwd = cwd
+        self.loop = None
+        self.idle = deque()
+        self.busy = set()
+        self.fill_handle = None
+
+    def attach(self, loop):
+        self.loop = loop
+        self.fill()
+
+    def make_command(self, cmd):
+        return PooledShellCommand(self, cmd)
+
+    def fill(self):
+        '''Start the shells missing to have `size` of them'''
+        self.fill_handle = None
+        while len(self.idle) + len(self.busy) < self.size:
+            self.idle.append(WarmShell(self))
+
+    def acquire(self):
+        '''Return an idle shell (a new one, in excess, if none is)'''
+        shell = self.idle.popleft() if self.idle else WarmShell(self)
+        self.busy.add(shell)
+        return shell
+
+    def release(self, shell):
+        '''The command run by `shell` exited'''
+        self.busy.discard(shell)
+        if shell.runs >= self.max_runs or len(self.idle) + len(self.busy) >= self.size or self.loop is None:
+            shell.close()
+            # replace it after the command exit is notified
+            if self.loop and self.fill_handle is None:
+                self.fill_handle = self.loop.call_soon(self.fill)
+        else:
+            self.idle.append(shell)
+
+    def on_shell_gone(self, shell):
+        '''`shell` exited on its own (e.g. `exit` in the bash profile)'''
+        self.busy.discard(shell)
+        if shell in self.idle:
+            self.idle.remove(shell)
+
+    def close(self):
+        if self.fill_handle:
+            self.fill_handle.cancel()
+            self.fill_handle = None
+        for shell in list(self.idle) + list(self.busy):
+            shell.close()
+        self.idle.clear()
+        self.busy.clear()
+        self.loop = None
@@ -1,24 +1,24 @@
 from time import time
 import os
 import pty
-import select
+import signal
 import subprocess
 
+# amount of bytes read at once from the output of a process
+READ_CHUNK_SIZE = 65536
+# a longer line is split (the output may never hold a newline)
+MAX_LINE_LENGTH = 65536
 
-def popen_shell_command(cmd, merge_stderr=True, bash_profile=None):
+
+def popen_shell_command(cmd, merge_stderr=True, bash_profile=None, cwd=None):
     '''Spawn a process to run `cmd`
 
     @param string cmd the command to run
     @param bool merge_stderr whether to read from stderr too (default True)
+    @param string cwd working directory of the process (default: ours)
     @return object a Popen instance
     '''
 
-    bash_profile_opts = []
-    if bash_profile is True:
-        bash_profile_opts = ['-l']
-    elif isinstance(bash_profile, str):
-        bash_profile_opts = ['--init-file', bash_profile]
-
     # 1. /usr/bin/env bash because not everyone has bash in /bin/
     # 2. -l because we want to read .bash_profile or brothers
     # 3. -i because -l isn't enough
@@ -29,68 +29,200 @@ def popen_shell_command(cmd, merge_stderr=True, bash_profile=None):
     # (it also sets a process group so if we kill the shell we kill
     # the subprocess too)
     master, slave = pty.openpty()
-    args = ['/usr/bin/env', 'bash', *bash_profile_opts, '-i', '-c', cmd]
-    p = subprocess.Popen(
-        args,
-        stdin=slave,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT if merge_stderr else None,
-        start_new_session=True
-    )
+    args = get_shell_args(cmd, bash_profile)
+    try:
+        p = subprocess.Popen(
+            args,
+            stdin=slave,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if merge_stderr else None,
+            cwd=cwd,
+            start_new_session=True
+        )
+    except BaseException:
+        os.close(master)
+        raise
+    finally:
+        os.close(slave)  # no need to have slave open on master's process
 
     p.start_time = time()
-
-    os.close(slave)  # no need to have slave open on master's process
+    p.pty_master = master
 
     return p
 
 
-def consume_output_line_by_line(p, callback, timeout=None, encoding='utf-8'):
-    '''
-    Read a process' output.
-    Every time a line is read call `callback` with two arguments,
-    the current exit status code and the read line.
-    As long as the process is running the exit status code is None and
-    the line is non-empty. When the process terminates `callback` will be
-    called one last time with the exit status code and an empty-string.
+def get_shell_args(cmd, bash_profile=None):
+    '''Return the arguments to run `cmd` in an interactive bash that
+    sources `bash_profile` (see CmdLaunchPad)'''
+    bash_profile_opts = []
+    if bash_profile is True:
+        bash_profile_opts = ['-l']
+    elif isinstance(bash_profile, str):
+        bash_profile_opts = ['--init-file', bash_profile]
 
-    @param string cmd the command to run
-    @param func callback the function to run on each line read. It will receive
-                two arguments, the exit status code (or None) and the line read
-    @param int timeout max time to complete the process. If the timeout expires
-               the process is killed and subprocess.TimeoutExpired is raised
-    @param encoding the encoding of the running shell
-    @return None
+    return ['/usr/bin/env', 'bash', *bash_profile_opts, '-i', '-c', cmd]
+
+
+class ShellCommand:
+    '''A command running in a shell, driven by an event loop.
+
+    The output is read without blocking as soon as it is available and
+    the exit of the process is notified through a pidfd (or SIGCHLD on
+    systems lacking pidfd support).'''
+
+    def __init__(self, cmd, bash_profile=None, encoding='utf-8', cwd=None):
+        self.cmd = cmd
+        self.bash_profile = bash_profile
+        self.cwd = cwd
+        self.encoding = encoding
+        self.p = None
+        self.loop = None
+        self.returncode = None
+        self.on_output = None
+        self.on_exit = None
+        self.kill_handle = None
+        self.partial_line = b''
+
+    def start(self, loop, on_output, on_exit):
+        '''Spawn the process.
+
+        @param asyncio.AbstractEventLoop loop the loop handling the process
+        @param func on_output called with the list of the lines of output
+                    read at once
+        @param func on_exit called with the exit status code when the
+                    process terminates (after every line has been read)
+        '''
+        self.loop = loop
+        self.on_output = on_output
+        self.on_exit = on_exit
+
+        self.p = popen_shell_command(self.cmd, bash_profile=self.bash_profile, cwd=self.cwd)
+        os.set_blocking(self.p.stdout.fileno(), False)
+        loop.add_reader(self.p.stdout.fileno(), self._on_output_readable)
+        watch_process_exit(loop, self.p, self._on_process_exit)
+
+    def is_running(self):
+        return self.p is not None and self.returncode is None
+
+    def terminate(self, grace_period=2, on_exit=None):
+        '''Stop the process group sending SIGTERM and, if it wasn't enough,
+        SIGKILL after `grace_period` seconds.
+
+        The output of the process is not notified anymore, its exit only
+        to `on_exit`, if given, in place of the callback given to `start`.'''
+        self.on_output = None
+        self.on_exit = on_exit
+
+        if self.is_running():
+            self._signal_process_group(signal.SIGTERM)
+            self.kill_handle = self.loop.call_later(
+                grace_period, self._signal_process_group, signal.SIGKILL
+            )
+        elif on_exit:
+            on_exit(self.returncode)
+
+    def _signal_process_group(self, signum):
+        try:
+            os.killpg(self.p.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _on_output_readable(self):
+        try:
+            data = os.read(self.p.stdout.fileno(), READ_CHUNK_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if data:
+            self._on_data(data)
+        else:
+            self.loop.remove_reader(self.p.stdout.fileno())
+
+    def _on_data(self, data):
+        lines, self.partial_line = split_lines(self.partial_line, data, self.encoding)
+
+        if self.on_output and lines:
+            self.on_output(lines)
+
+    def _on_process_exit(self, returncode):
+        self.returncode = returncode
+
+        if self.kill_handle:
+            self.kill_handle.cancel()
+            self.kill_handle = None
+
+        # read what's left in the pipe (without waiting for processes
+        # that may have inherited it)
+        fd = self.p.stdout.fileno()
+        while True:
+            try:
+                data = os.read(fd, READ_CHUNK_SIZE)
+            except OSError:
+                break
+            if not data:
+                break
+            self._on_data(data)
+
+        if self.partial_line:
+            self._on_data(b'\n')
+
+        self.loop.remove_reader(fd)
+        self.p.stdout.close()
+        os.close(self.p.pty_master)
+
+        if self.on_exit:
+            self.on_exit(returncode)
+
+
+def split_lines(partial_line, data, encoding='utf-8'):
+    '''Split the output `data`, following the incomplete line `partial_line`,
+    in lines
+
+    @return tuple (list the complete lines, decoded, bytes the new
+                  incomplete line)
     '''
+    lines = (partial_line + data).split(b'\n')
+    partial_line = lines.pop()
+    if len(partial_line) > MAX_LINE_LENGTH:
+        lines.append(partial_line)
+        partial_line = b''
 
-    start_time = p.start_time or time()
+    return [line.decode(encoding, 'replace').rstrip() for line in lines], partial_line
 
-    while True:
-        data = ''
-        r, w, x = select.select([p.stdout], [], [], 1)
-        if r:
-            data = r[0].readline()
-            if data:
-                callback(None, data.decode(encoding).rstrip())
 
-        time_left = timeout is not None and max(0, start_time + timeout - time())
+def watch_process_exit(loop, p, callback):
+    '''Call `callback` with the exit status code of the Popen instance `p`
+    once it terminates. The process is reaped before calling `callback`.'''
+    try:
+        pidfd = os.pidfd_open(p.pid)
+    except (AttributeError, OSError):
+        _watch_process_exit_with_sigchld(loop, p, callback)
+        return
 
-        if not data and p.returncode is not None:
-            # Terminate when we've read all the output and the returncode is set
-            break
-        elif timeout is not None and time_left == 0:
-            _stop_process(p)
-            raise subprocess.TimeoutExpired(p.args, timeout)
+    def on_pidfd_readable():
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+        callback(p.wait())
 
-        p.poll()  # updates returncode so we can exit the loop
+    loop.add_reader(pidfd, on_pidfd_readable)
 
-    callback(p.returncode, '')
 
+_sigchld_callbacks = {}
 
-def _stop_process(p):
-    try:
-        # give the process a chance to exit cleanly
-        p.terminate()
-        p.wait(timeout=2)
-    except subprocess.TimeoutExpired:
-        p.kill()
+
+def _watch_process_exit_with_sigchld(loop, p, callback):
+    if not _sigchld_callbacks:
+        loop.add_signal_handler(signal.SIGCHLD, _on_sigchld)
+    _sigchld_callbacks[p] = callback
+
+    # the process may have terminated before the handler was installed
+    _on_sigchld()
+
+
+def _on_sigchld():
+    for p, callback in list(_sigchld_callbacks.items()):
+        if p.poll() is not None:
+            del _sigchld_callbacks[p]
+            callback(p.returncode)
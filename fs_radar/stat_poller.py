@@ -0,0 +1,224 @@
+from collections import namedtuple
+import heapq
+import os
+from os.path import join
+import random
+from time import monotonic
+
+from inotify_simple import Event, flags
+
+from fs_radar.watch_backend import WatchBackend
+
+# what we remember about a directory entry (mtime and size are None for directories)
+EntryStat = namedtuple('EntryStat', ['ino', 'mtime_ns', 'size'])
+
+
+class DirWatch:
+    __slots__ = ('path', 'ino', 'mtime_ns', 'entries', 'interval', 'due')
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.ino = None
+        self.mtime_ns = None
+        self.entries = {}
+        self.interval = interval
+        self.due = None
+
+
+class StatPoller(WatchBackend):
+    '''Watch directories by comparing their content with the one they had
+    the previous time they were checked. It works where inotify doesn't
+    (e.g. NFS and FUSE mounts) at the cost of some latency.
+
+    It mimics inotify: watches are identified by a (negative) watch
+    descriptor and the changes are reported as inotify events
+    (CLOSE_WRITE for new or modified files, CREATE|ISDIR for new
+    directories, DELETE for removed entries and IGNORED when the
+    watched directory itself is gone).
+
+    A directory is listed again only if its mtime changed, otherwise
+    only the files it already held are stat()ed. Every directory has its
+    own interval: it starts at `interval`, doubles (up to `max_interval`)
+    every time nothing changed and goes back to `interval` as soon as
+    something does, so quiet directories cost less and less.
+    '''
+
+    polled = True
+    tracks_paths = True
+
+    def __init__(self, interval=2, max_interval=None):
+        '''
+        @param float interval seconds between two checks of a busy directory
+        @param float max_interval seconds between two checks of a quiet
+                     directory (default: 16 times `interval`)
+        '''
+        self.interval = interval
+        self.max_interval = max_interval or interval * 16
+        self.watches = {}
+        self.next_wd = -2  # -1 is used by inotify for the overflow event
+        # heap of (due time, wd), stale items are skipped
+        self.schedule = []
+        self.loop = None
+        self.tick_handle = None
+
+    def __len__(self):
+        return len(self.watches)
+
+    def add_watch(self, path, mask=None):
+        '''Start to watch the directory at `path`.
+
+        @return int the watch descriptor
+        '''
+        wd = self.next_wd
+        self.next_wd -= 1
+
+        watch = DirWatch(path, self.interval)
+        try:
+            self._refresh(watch, os.stat(path))
+        except OSError:
+            pass  # we'll notice it's gone on the next check
+        self.watches[wd] = watch
+
+        # spread the checks of the directories added together
+        self._schedule(wd, watch, monotonic() + random.uniform(0, self.interval))
+
+        return wd
+
+    def rm_watch(self, wd):
+        del self.watches[wd]
+
+    def rename_watch(self, wd, path):
+        self.watches[wd].path = path
+
+    def read(self):
+        '''Check every directory and return the events happened since
+        the previous check'''
+        events = []
+        for wd, watch in list(self.watches.items()):
+            events.extend(self._check(wd, watch))
+        return events
+
+    def read_due(self, now=None):
+        '''Check the directories whose interval expired and return the
+        events happened since their previous check'''
+        now = monotonic() if now is None else now
+        events = []
+
+        while self.schedule and self.schedule[0][0] <= now:
+            due, wd = heapq.heappop(self.schedule)
+            watch = self.watches.get(wd)
+            if watch is None or watch.due != due:
+                continue
+
+            watch_events = self._check(wd, watch)
+            if wd not in self.watches:
+                events.extend(watch_events)
+                continue
+
+            if watch_events:
+                watch.interval = self.interval
+            else:
+                watch.interval = min(watch.interval * 2, self.max_interval)
+            self._schedule(wd, watch, now + watch.interval)
+            events.extend(watch_events)
+
+        return events
+
+    def attach(self, loop, on_events):
+        self.loop = loop
+
+        def on_tick():
+            events = self.read_due()
+            if events:
+                on_events(events)
+            self.tick_handle = loop.call_later(self.interval, on_tick)
+
+        self.tick_handle = loop.call_later(self.interval, on_tick)
+
+    def detach(self):
+        self.tick_handle.cancel()
+        self.tick_handle = None
+        self.loop = None
+
+    def _schedule(self, wd, watch, due):
+        watch.due = due
+        heapq.heappush(self.schedule, (due, wd))
+
+    def _check(self, wd, watch):
+        try:
+            st = os.stat(watch.path)
+        except OSError:
+            st = None
+
+        if st is None or (watch.ino is not None and st.st_ino != watch.ino):
+            del self.watches[wd]
+            return [Event(wd, flags.IGNORED, 0, '')]
+        elif st.st_mtime_ns != watch.mtime_ns:
+            return self._refresh(watch, st, wd)
+        else:
+            return self._check_files(watch, wd)
+
+    def _refresh(self, watch, st, wd=None):
+        '''List the directory again and compare it with the snapshot'''
+        entries = _list_entries(watch.path)
+        events = []
+
+        if wd is not None:
+            for name, entry in entries.items():
+                old_entry = watch.entries.get(name)
+                if entry.size is None:
+                    if old_entry is None or old_entry.size is not None or old_entry.ino != entry.ino:
+                        events.append(Event(wd, flags.CREATE | flags.ISDIR, 0, name))
+                elif entry != old_entry:
+                    events.append(Event(wd, flags.CLOSE_WRITE, 0, name))
+
+            for name, old_entry in watch.entries.items():
+                if name not in entries:
+                    mask = flags.DELETE | (flags.ISDIR if old_entry.size is None else 0)
+                    events.append(Event(wd, mask, 0, name))
+
+        watch.ino = st.st_ino
+        watch.mtime_ns = st.st_mtime_ns
+        watch.entries = entries
+
+        return events
+
+    def _check_files(self, watch, wd):
+        '''Look for modified files in a directory whose list of entries
+        did not change'''
+        events = []
+
+        for name, entry in watch.entries.items():
+            if entry.size is None:
+                continue
+            try:
+                st = os.stat(join(watch.path, name), follow_symlinks=False)
+            except OSError:
+                continue  # removed, the directory mtime changes too
+            new_entry = EntryStat(st.st_ino, st.st_mtime_ns, st.st_size)
+            if new_entry != entry:
+                watch.entries[name] = new_entry
+                events.append(Event(wd, flags.CLOSE_WRITE, 0, name))
+
+        return events
+
+
+def _list_entries(path):
+    '''Return {name: EntryStat} of the entries of the directory at `path`.
+    Subdirectories are recognized by the type returned along with the
+    names, so only files are stat()ed'''
+    entries = {}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        entries[entry.name] = EntryStat(entry.inode(), None, None)
+                    else:
+                        st = entry.stat(follow_symlinks=False)
+                        entries[entry.name] = EntryStat(st.st_ino, st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return entries
@@ -0,0 +1,274 @@
+from collections import defaultdict
+import hashlib
+import logging
+import mmap
+import os
+from os.path import dirname, join
+import stat
+import struct
+
+from fs_radar.dir_scanner import DirScanner
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b'FSRI'
+INDEX_VERSION = 1
+
+# magic, version, key (sha1 of basedir and rules), dirs count, files count, names size
+HEADER = struct.Struct('<4sI20sIIQ')
+# parent id (-1 for basedir), inode, mtime_ns, name offset, name length
+DIR_RECORD = struct.Struct('<iQqQI')
+# dir id, inode, size, mtime_ns, name offset, name length
+FILE_RECORD = struct.Struct('<IQQqQI')
+
+
+def make_index_key(basedir, rules):
+    '''Return the key identifying an index built for `basedir` and `rules`'''
+    data = '\n'.join([os.path.abspath(basedir)] + sorted(rules))
+    return hashlib.sha1(os.fsencode(data)).digest()
+
+
+class TreeIndex:
+    '''Snapshot of a directory tree: the (inode, mtime) of its directories
+    and the (inode, size, mtime) of the files matched by the rules.
+
+    It's saved when fs_radar shuts down and compared with the tree on the
+    next start to find what changed in the meanwhile. Directories whose
+    mtime didn't change are not listed again, only the files they held
+    are stat()ed.
+    '''
+
+    def __init__(self, basedir, key):
+        self.basedir = os.path.normpath(basedir)
+        self.key = key
+        self.dirs = {}
+        self.files = {}
+        self.loaded = False
+        self.dirty = set()
+
+    @classmethod
+    def load(cls, index_path, basedir, key):
+        '''Load the index saved at `index_path`. If it's missing or it was
+        built for another basedir or other rules an empty index is returned'''
+        index = cls(basedir, key)
+        try:
+            with open(index_path, 'rb') as fp, \
+                    mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as buf:
+                    index._decode(buf)
+        except (OSError, ValueError, IndexError, struct.error) as e:
+            logger.info('Tree index not loaded (%s), it will be rebuilt', e)
+            index.dirs = {}
+            index.files = {}
+        return index
+
+    def _decode(self, buf):
+        magic, version, key, dirs_count, files_count, names_size = HEADER.unpack_from(buf)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError('unknown format')
+        if key != self.key:
+            raise ValueError('built for another basedir or other rules')
+
+        dirs_offset = HEADER.size
+        files_offset = dirs_offset + dirs_count * DIR_RECORD.size
+        names_offset = files_offset + files_count * FILE_RECORD.size
+
+        # every view must be released before the mmap is closed
+        with buf[dirs_offset:files_offset] as dirs_buf, \
+                buf[files_offset:names_offset] as files_buf, \
+                buf[names_offset:names_offset + names_size] as names:
+            dir_paths = []
+            for parent, ino, mtime_ns, offset, length in DIR_RECORD.iter_unpack(dirs_buf):
+                name = os.fsdecode(names[offset:offset + length].tobytes())
+                path = self.basedir if parent < 0 else join(dir_paths[parent], name)
+                dir_paths.append(path)
+                self.dirs[path] = (ino, mtime_ns)
+
+            for dir_id, ino, size, mtime_ns, offset, length in FILE_RECORD.iter_unpack(files_buf):
+                name = os.fsdecode(names[offset:offset + length].tobytes())
+                self.files[join(dir_paths[dir_id], name)] = (ino, size, mtime_ns)
+
+        self.loaded = True
+
+    def save(self, index_path):
+        '''Write the index at `index_path` (atomically)'''
+        names = bytearray()
+        dir_ids = {}
+        dir_records = []
+        file_records = []
+
+        def add_name(name):
+            offset = len(names)
+            names.extend(os.fsencode(name))
+            return offset, len(names) - offset
+
+        # parents sort before their children
+        for path in sorted(self.dirs):
+            parent = dirname(path)
+            if path == self.basedir:
+                parent_id, name = -1, ''
+            elif parent in dir_ids:
+                parent_id, name = dir_ids[parent], path[len(parent):].lstrip('/')
+            else:
+                continue  # orphan
+            dir_ids[path] = len(dir_records)
+            ino, mtime_ns = self.dirs[path]
+            dir_records.append(DIR_RECORD.pack(parent_id, ino, mtime_ns, *add_name(name)))
+
+        for path, (ino, size, mtime_ns) in self.files.items():
+            dir_id = dir_ids.get(dirname(path))
+            if dir_id is not None:
+                file_records.append(FILE_RECORD.pack(dir_id, ino, size, mtime_ns, *add_name(os.path.basename(path))))
+
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.key, len(dir_records), len(file_records), len(names)))
+            fp.write(b''.join(dir_records))
+            fp.write(b''.join(file_records))
+            fp.write(names)
+        os.replace(tmp_path, index_path)
+
+        logger.debug('Tree index saved: %d directories, %d files', len(dir_records), len(file_records))
+
+    def refresh(self, dir_filter, subtree_filter, file_filter, workers=None):
+        '''Compare the index with the tree and update it.
+
+        @param func dir_filter given the absolute path of a directory, is it watched?
+        @param func subtree_filter given the absolute path of a directory,
+                    may it (or its descendants) be watched?
+        @param func file_filter given the absolute path of a file in a watched
+                    directory, must it be indexed?
+        @return tuple (directories to watch, files changed, files gone). If the
+                index was empty no file is reported
+        '''
+        old_dirs, old_files = self.dirs, self.files
+        self.dirs, self.files = {}, {}
+        changed = []
+        new_subtrees = []
+
+        files_by_dir = defaultdict(list)
+        for path in old_files:
+            files_by_dir[dirname(path)].append(path)
+
+        def check_file(path, st=None):
+            try:
+                st = st or os.stat(path, follow_symlinks=False)
+            except OSError:
+                return
+            self.files[path] = (st.st_ino, st.st_size, st.st_mtime_ns)
+            if old_files.get(path) != self.files[path]:
+                changed.append(path)
+
+        def list_dir(path, watched, look_for_new_subdirs=True):
+            for entry in _scandir(path):
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if look_for_new_subdirs and entry.path not in old_dirs and subtree_filter(entry.path):
+                            new_subtrees.append(entry.path)
+                    elif watched and file_filter(entry.path):
+                        check_file(entry.path, entry.stat(follow_symlinks=False))
+                except OSError:
+                    continue
+
+        if self.basedir not in old_dirs:
+            new_subtrees.append(self.basedir)
+
+        for path in sorted(old_dirs):
+            if path != self.basedir and (dirname(path) not in self.dirs or not subtree_filter(path)):
+                continue  # the parent is gone (or isn't interesting anymore)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            ino, mtime_ns = old_dirs[path]
+            if st.st_ino != ino:
+                new_subtrees.append(path)
+                continue
+
+            self.dirs[path] = (st.st_ino, st.st_mtime_ns)
+            if st.st_mtime_ns != mtime_ns:
+                list_dir(path, dir_filter(path))
+            elif dir_filter(path):
+                # no entry was added or removed, look for files modified in place
+                for file_path in files_by_dir.get(path, ()):
+                    check_file(file_path)
+
+        scanner = DirScanner(subtree_filter=subtree_filter, workers=workers)
+        for path in scanner.scan_many(new_subtrees):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            self.dirs[path] = (st.st_ino, st.st_mtime_ns)
+            if dir_filter(path):
+                list_dir(path, True, look_for_new_subdirs=False)
+
+        gone = [path for path in old_files if path not in self.files]
+        dirs_to_watch = [path for path in self.dirs if dir_filter(path)]
+
+        if not self.loaded:
+            changed, gone = [], []
+        self.loaded = True
+
+        logger.info(
+            'Tree index: %d directories, %d files, %d changed and %d gone since the last run',
+            len(self.dirs), len(self.files), len(changed), len(gone)
+        )
+
+        return dirs_to_watch, changed, gone
+
+    def on_path_touched(self, ev):
+        '''Observer callback: the file at `ev.data` has to be checked again
+        before saving the index'''
+        self.dirty.add(ev.data)
+
+    def update(self, watched_dirs, file_filter):
+        '''Bring the index up to date before saving it.
+
+        The files touched while running are stat()ed again, the files
+        deleted (that notify nothing) are dropped from the directories
+        whose mtime changed and the directories watched after the start are
+        added. The mtime of the directories already indexed is not updated:
+        if their entries changed they will be listed again on the next start.
+        '''
+        for path in self.dirty:
+            try:
+                st = os.stat(path, follow_symlinks=False)
+            except OSError:
+                self.files.pop(path, None)
+                continue
+            if dirname(path) in self.dirs or dirname(path) in watched_dirs:
+                if file_filter(path) and not stat.S_ISDIR(st.st_mode):
+                    self.files[path] = (st.st_ino, st.st_size, st.st_mtime_ns)
+        self.dirty = set()
+
+        changed_dirs = set()
+        for path, (ino, mtime_ns) in self.dirs.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                changed_dirs.add(path)
+                continue
+            if (st.st_ino, st.st_mtime_ns) != (ino, mtime_ns):
+                changed_dirs.add(path)
+        if changed_dirs:
+            for path in [path for path in self.files if dirname(path) in changed_dirs]:
+                if not os.path.lexists(path):
+                    del self.files[path]
+
+        for path in watched_dirs:
+            if path not in self.dirs:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                self.dirs[path] = (st.st_ino, st.st_mtime_ns)
+
+
+def _scandir(path):
+    try:
+        with os.scandir(path) as it:
+            return list(it)
+    except OSError:
+        return []
@@ -0,0 +1,228 @@
+import logging
+import os
+import re
+import struct
+import sys
+from time import monotonic
+
+from inotify_simple import Event, INotify
+
+logger = logging.getLogger(__name__)
+
+MOUNTS_PATH = '/proc/self/mounts'
+
+# file systems where inotify doesn't see the changes made by other hosts
+# (or by the FUSE daemon)
+INOTIFY_BLIND_FS_TYPES = {
+    '9p', 'afs', 'ceph', 'cifs', 'fuse', 'fuseblk', 'glusterfs', 'gpfs',
+    'lustre', 'ncpfs', 'nfs', 'nfs4', 'smb3', 'smbfs', 'vboxsf',
+}
+
+
+# wd, mask, cookie, length of the name (that follows, padded with NULs)
+INOTIFY_EVENT_HEADER = struct.Struct('=iIII')
+INOTIFY_READ_SIZE = 256 * 1024
+
+# the events read are part of a burst if they were waiting when we started
+# to wait for them, or arrived within this amount of seconds, or are many
+BURST_GAP = 0.001
+BURST_EVENTS = 64
+# seconds to wait before the next read while a burst lasts
+MIN_BATCH_DELAY = 0.001
+MAX_BATCH_DELAY = 0.032
+
+FS_ENCODING = sys.getfilesystemencoding()
+
+
+class WatchBackend:
+    '''A source of file system events for FsRadar.
+
+    A backend watches directories, identified by a watch descriptor, and
+    reports what happens inside them as inotify events (inotify_simple
+    Event): CREATE|ISDIR for new directories, CLOSE_WRITE for written files,
+    DELETE/MOVED_FROM/MOVED_TO for entries removed or renamed, IGNORED when
+    a watch is gone and Q_OVERFLOW (wd -1) when some events got lost.
+
+    Watch descriptors of polling backends are negative.
+    '''
+
+    polled = False
+    # does every watch use a (scarce) kernel resource?
+    limited_watches = False
+    # are the events unrelated to the file system (e.g. replayed)?
+    offline = False
+    # must the backend know the new path of a renamed directory (see
+    # rename_watch)?
+    tracks_paths = False
+
+    def add_watch(self, path, mask):
+        '''Start to watch the directory at `path`.
+
+        @param int mask inotify flags of the events to report
+        @return int the watch descriptor
+        @raise OSError (ENOSPC) if the backend is out of watches
+        '''
+        raise NotImplementedError
+
+    def rm_watch(self, wd):
+        '''Stop watching the directory watched by `wd`'''
+        raise NotImplementedError
+
+    def rename_watch(self, wd, path):
+        '''The directory watched by `wd` is now at `path`'''
+        pass
+
+    def read(self):
+        '''Return the events available right now'''
+        raise NotImplementedError
+
+    def attach(self, loop, on_events):
+        '''Call `on_events` with a list of events, inside the event loop
+        `loop`, whenever some are available'''
+        raise NotImplementedError
+
+    def detach(self):
+        '''Stop reporting the events to the event loop'''
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class InotifyBackend(WatchBackend):
+    '''Receive the events from the kernel through inotify.
+
+    Events are read into a reusable buffer and decoded in place. After an
+    idle period they are read as soon as they arrive; during a burst the
+    reads are spaced out by a delay that doubles at every read (up to
+    MAX_BATCH_DELAY), so the kernel coalesces repeated events and each read
+    returns a bigger batch.
+    '''
+
+    limited_watches = True
+
+    def __init__(self):
+        self.inotify = INotify(nonblocking=True)
+        self.buffer = bytearray(INOTIFY_READ_SIZE)
+        self.batch_delay = 0
+        self.loop = None
+        self.delay_handle = None
+
+    def add_watch(self, path, mask):
+        return self.inotify.add_watch(path, mask)
+
+    def rm_watch(self, wd):
+        self.inotify.rm_watch(wd)
+
+    def read(self):
+        try:
+            size = os.readv(self.inotify.fileno(), [self.buffer])
+        except BlockingIOError:
+            return []
+        return decode_inotify_events(self.buffer, size)
+
+    def attach(self, loop, on_events):
+        self.loop = loop
+        fd = self.inotify.fileno()
+
+        armed_at = monotonic()
+
+        def on_readable():
+            nonlocal armed_at
+            idle_time = monotonic() - armed_at
+            events = self.read()
+            on_events(events)
+
+            self.batch_delay = get_next_batch_delay(self.batch_delay, len(events), idle_time)
+            if self.batch_delay and self.loop:
+                loop.remove_reader(fd)
+                self.delay_handle = loop.call_later(self.batch_delay, on_delay_expired)
+            else:
+                armed_at = monotonic()
+
+        def on_delay_expired():
+            nonlocal armed_at
+            self.delay_handle = None
+            armed_at = monotonic()
+            loop.add_reader(fd, on_readable)
+
+        loop.add_reader(fd, on_readable)
+
+    def detach(self):
+        if self.delay_handle:
+            self.delay_handle.cancel()
+            self.delay_handle = None
+        self.loop.remove_reader(self.inotify.fileno())
+        self.loop = None
+
+    def close(self):
+        logger.debug('Close inotify descriptor')
+        self.inotify.close()
+
+
+def decode_inotify_events(buffer, size):
+    '''Decode the first `size` bytes of `buffer` (a bytearray), as read
+    from an inotify file descriptor, in a list of Event'''
+    events = []
+    append = events.append
+    unpack_from = INOTIFY_EVENT_HEADER.unpack_from
+    header_size = INOTIFY_EVENT_HEADER.size
+    find = buffer.find
+    offset = 0
+
+    while offset < size:
+        wd, mask, cookie, name_size = unpack_from(buffer, offset)
+        offset += header_size
+        if name_size:
+            end = find(0, offset, offset + name_size)
+            name = buffer[offset:end if end >= 0 else offset + name_size].decode(FS_ENCODING, 'surrogateescape')
+            offset += name_size
+        else:
+            name = ''
+        append(Event(wd, mask, cookie, name))
+
+    return events
+
+
+def get_next_batch_delay(delay, events_count, idle_time):
+    '''Return the seconds to wait before the next read.
+
+    @param float delay the current delay
+    @param int events_count number of events just read
+    @param float idle_time seconds spent waiting for those events
+    '''
+    if events_count < BURST_EVENTS and idle_time > BURST_GAP:
+        return 0
+    return min(max(delay * 2, MIN_BATCH_DELAY), MAX_BATCH_DELAY)
+
+
+def get_fs_type(path):
+    '''Return the type of the file system holding `path` (e.g. 'ext4'),
+    or None if unknown'''
+    path = os.path.realpath(path)
+    best_mount_point, fs_type = '', None
+
+    try:
+        with open(MOUNTS_PATH) as fp:
+            for line in fp:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = _unescape_mount_field(fields[1])
+                prefix = mount_point.rstrip('/') + '/'
+                if (path == mount_point or path.startswith(prefix)) and len(mount_point) >= len(best_mount_point):
+                    best_mount_point, fs_type = mount_point, fields[2]
+    except OSError:
+        return None
+
+    return fs_type
+
+
+def is_inotify_blind(fs_type):
+    '''Is inotify unable to see (all) the changes on a file system of type `fs_type`?'''
+    return fs_type is not None and (fs_type in INOTIFY_BLIND_FS_TYPES or fs_type.startswith('fuse.'))
+
+
+def _unescape_mount_field(field):
+    # spaces, tabs, newlines and backslashes are escaped as octal numbers
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
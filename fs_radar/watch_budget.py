@@ -0,0 +1,96 @@
+import logging
+import os
+from os.path import dirname
+
+from fs_radar.path_filter import makeDirFilter
+
+logger = logging.getLogger(__name__)
+
+MAX_USER_WATCHES_PATH = '/proc/sys/fs/inotify/max_user_watches'
+
+# watches left to other programs (and to the directories created later on)
+WATCHES_RESERVE = 1024
+
+
+def get_max_user_watches():
+    '''Return the max number of inotify watches of a user, or None if unknown'''
+    try:
+        with open(MAX_USER_WATCHES_PATH) as fp:
+            return int(fp.read())
+    except (OSError, ValueError):
+        return None
+
+
+def count_used_watches():
+    '''Count the inotify watches already in use by the processes of the
+    current user (best effort: processes we can't inspect are skipped)'''
+    uid = os.getuid()
+    count = 0
+
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        proc_path = os.path.join('/proc', pid)
+        try:
+            if os.stat(proc_path).st_uid != uid:
+                continue
+            fds = os.listdir(os.path.join(proc_path, 'fd'))
+        except OSError:
+            continue
+
+        for fd in fds:
+            try:
+                if os.readlink(os.path.join(proc_path, 'fd', fd)) != 'anon_inode:inotify':
+                    continue
+                with open(os.path.join(proc_path, 'fdinfo', fd)) as fp:
+                    count += sum(1 for line in fp if line.startswith('inotify wd:'))
+            except OSError:
+                continue
+
+    return count
+
+
+def get_watches_budget(max_watches=None):
+    '''Return how many inotify watches we can use.
+
+    @param int max_watches configured limit, if any
+    @return int|None the number of watches, None if there is no known limit
+    '''
+    max_user_watches = get_max_user_watches()
+    if max_user_watches is None:
+        return max_watches
+
+    used = count_used_watches()
+    budget = max(0, max_user_watches - used - WATCHES_RESERVE)
+    logger.debug('Inotify watches: limit %d, in use %d, budget %d', max_user_watches, used, budget)
+
+    return budget if max_watches is None else min(budget, max_watches)
+
+
+def sort_dirs_by_priority(paths, groups, basedir):
+    '''Sort `paths` by the importance of watching them.
+
+    A directory is as important as the most important group whose rules
+    match it: the group with the highest `priority` option first, then
+    the group whose rules match less directories (it's more specific).
+    Between directories equally important the shallower comes first.
+    '''
+    relpaths = {path: os.path.relpath(path, basedir) for path in paths}
+
+    groups_ranking = []
+    for group in groups.values():
+        dir_filter = makeDirFilter(group['rules'])
+        matched = set(path for path, relpath in relpaths.items() if dir_filter(relpath))
+        groups_ranking.append(((group.get('priority') or 0, -len(matched)), matched))
+
+    def get_rank(path):
+        rank = max((rank for rank, matched in groups_ranking if path in matched), default=(0, -len(paths)))
+        return (-rank[0], -rank[1], relpaths[path].count('/'))
+
+    return sorted(paths, key=get_rank)
+
+
+def get_subtree_roots(paths):
+    '''Return the paths in `paths` whose parent is not in `paths`'''
+    paths_set = set(path.rstrip('/') for path in paths)
+    return sorted(path for path in paths_set if dirname(path) not in paths_set)
@@ -0,0 +1,232 @@
+'''The table of the watched directories.
+
+The paths are kept as a tree of nodes, one per component of a watched
+path. A node is a slot of a few parallel arrays holding the index of its
+parent node and its (interned) name, so that a prefix shared by many
+directories is stored once. A full path is built only when asked for, and
+a renamed directory is a single node moving to another parent, whatever
+the size of its subtree.
+'''
+
+from array import array
+from collections.abc import MutableMapping
+import os
+import sys
+
+# index of the missing node (e.g. the parent of a root)
+NO_NODE = -1
+
+
+class WatchTable(MutableMapping):
+    '''Map the watch descriptors to the paths of the watched directories
+    (like a dict, plus lookups by path and moves of whole subtrees)'''
+
+    def __init__(self):
+        # by node: parent node, interned name, number of child nodes, the
+        # child nodes (dict name => node, None if there's none) and the
+        # watch descriptor (0 if the directory is not watched)
+        self.parents = array('i')
+        self.names = []
+        self.child_counts = array('i')
+        self.children = []
+        self.node_wds = array('i')
+        self.free_nodes = []
+        # nodes without parent, by name ('' for the root of absolute paths)
+        self.roots = {}
+
+        # nodes of the watch descriptors, by wd (and by -wd for the negative
+        # ones), NO_NODE for the unknown ones
+        self.nodes_by_wd = array('i')
+        self.nodes_by_negative_wd = array('i')
+        # node => the other wds of the same directory (e.g. polled twice)
+        self.extra_wds = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for wd, node in enumerate(self.nodes_by_wd):
+            if node != NO_NODE:
+                yield wd
+        for wd, node in enumerate(self.nodes_by_negative_wd):
+            if node != NO_NODE:
+                yield -wd
+
+    def __contains__(self, wd):
+        return self._get_node(wd) != NO_NODE
+
+    def __getitem__(self, wd):
+        node = self._get_node(wd)
+        if node == NO_NODE:
+            raise KeyError(wd)
+        return self._get_path(node)
+
+    def __setitem__(self, wd, path):
+        if wd in self:
+            del self[wd]
+
+        node = self._make_node(path.split(os.sep))
+        if self.node_wds[node]:
+            self.extra_wds.setdefault(node, []).append(wd)
+        else:
+            self.node_wds[node] = wd
+        self._set_node(wd, node)
+        self.count += 1
+
+    def __delitem__(self, wd):
+        node = self._get_node(wd)
+        if node == NO_NODE:
+            raise KeyError(wd)
+
+        self._set_node(wd, NO_NODE)
+        self.count -= 1
+
+        extra_wds = self.extra_wds.get(node)
+        if extra_wds:
+            if self.node_wds[node] == wd:
+                self.node_wds[node] = extra_wds.pop()
+            else:
+                extra_wds.remove(wd)
+            if not extra_wds:
+                del self.extra_wds[node]
+        else:
+            self.node_wds[node] = 0
+            self._prune(node)
+
+    def get_wd(self, path):
+        '''Return the watch descriptor of the directory at `path` (None if
+        it isn't watched)'''
+        node = self._find_node(path)
+        if node == NO_NODE or not self.node_wds[node]:
+            return None
+        return self.node_wds[node]
+
+    def get_subtree_wds(self, path):
+        '''Return the watch descriptors of `path` and of its descendants'''
+        node = self._find_node(path)
+        return self._get_subtree_wds(node) if node != NO_NODE else []
+
+    def move(self, old_path, new_path):
+        '''The directory at `old_path` was renamed `new_path`: move the
+        watches of its subtree
+
+        @return list the watch descriptors moved
+        '''
+        node = self._find_node(old_path)
+        if node == NO_NODE:
+            return []
+
+        *parent_names, name = new_path.split(os.sep)
+        new_parent = self._make_node(parent_names) if parent_names else NO_NODE
+        old_parent = self.parents[node]
+
+        self._unlink(node)
+        self._link(node, new_parent, name)
+        self._prune(old_parent)
+
+        return self._get_subtree_wds(node)
+
+    def _get_node(self, wd):
+        nodes, index = (self.nodes_by_wd, wd) if wd >= 0 else (self.nodes_by_negative_wd, -wd)
+        return nodes[index] if index < len(nodes) else NO_NODE
+
+    def _set_node(self, wd, node):
+        nodes, index = (self.nodes_by_wd, wd) if wd >= 0 else (self.nodes_by_negative_wd, -wd)
+        if index >= len(nodes):
+            nodes.extend([NO_NODE] * (index + 1 - len(nodes)))
+        nodes[index] = node
+
+    def _get_path(self, node):
+        names = []
+        while node != NO_NODE:
+            names.append(self.names[node])
+            node = self.parents[node]
+        names.reverse()
+        return os.sep.join(names)
+
+    def _get_siblings(self, parent):
+        return self.roots if parent == NO_NODE else self.children[parent]
+
+    def _find_node(self, path):
+        node = NO_NODE
+        for name in path.split(os.sep):
+            siblings = self._get_siblings(node)
+            if not siblings or name not in siblings:
+                return NO_NODE
+            node = siblings[name]
+        return node
+
+    def _make_node(self, names):
+        '''Return the node of the path made of `names`, creating the
+        nodes missing'''
+        node = NO_NODE
+        for name in names:
+            siblings = self._get_siblings(node)
+            child = siblings.get(name, NO_NODE) if siblings else NO_NODE
+            if child == NO_NODE:
+                child = self._new_node()
+                self._link(child, node, name)
+            node = child
+        return node
+
+    def _new_node(self):
+        if self.free_nodes:
+            return self.free_nodes.pop()
+
+        self.parents.append(NO_NODE)
+        self.names.append(None)
+        self.child_counts.append(0)
+        self.children.append(None)
+        self.node_wds.append(0)
+        return len(self.names) - 1
+
+    def _link(self, node, parent, name):
+        '''Make `node` the child `name` of `parent`'''
+        name = sys.intern(name)
+        self.parents[node] = parent
+        self.names[node] = name
+        if parent == NO_NODE:
+            self.roots[name] = node
+        else:
+            if self.children[parent] is None:
+                self.children[parent] = {}
+            # a node already there (e.g. a directory replaced by the move
+            # whose removal is yet to be notified) stays reachable by its wd
+            self.children[parent][name] = node
+            self.child_counts[parent] += 1
+
+    def _unlink(self, node):
+        '''Detach `node` from its parent'''
+        parent = self.parents[node]
+        siblings = self._get_siblings(parent)
+        name = self.names[node]
+        if siblings and siblings.get(name) == node:
+            del siblings[name]
+        if parent != NO_NODE:
+            self.child_counts[parent] -= 1
+            if not siblings:
+                self.children[parent] = None
+
+    def _prune(self, node):
+        '''Free `node`, and then its ancestors, as long as they are
+        neither watched nor on the path of a watched directory'''
+        while node != NO_NODE and not self.node_wds[node] and not self.child_counts[node]:
+            parent = self.parents[node]
+            self._unlink(node)
+            self.names[node] = None
+            self.parents[node] = NO_NODE
+            self.free_nodes.append(node)
+            node = parent
+
+    def _get_subtree_wds(self, node):
+        wds = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if self.node_wds[node]:
+                wds.append(self.node_wds[node])
+                wds.extend(self.extra_wds.get(node, ()))
+            if self.children[node]:
+                stack.extend(self.children[node].values())
+        return wds
@@ -0,0 +1,97 @@
+import os
+import pytest
+import unittest
+
+from fs_radar.change_detector import ChangeDetector
+
+
+class ChangeDetectorTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        self.tmpdir = tmpdir
+        self.path = str(tmpdir.join('file.txt'))
+        self.write('hello')
+        self.detector = ChangeDetector()
+
+    def write(self, content, path=None):
+        '''Write `content` making sure the mtime changes'''
+        path = path or self.path
+        with open(path, 'w') as fp:
+            fp.write(content)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    def test_first_check_is_a_change(self):
+        assert self.detector.has_changed(self.path)
+
+    def test_untouched_file(self):
+        self.detector.has_changed(self.path)
+
+        assert not self.detector.has_changed(self.path)
+
+    def test_same_content_saved_again(self):
+        self.detector.has_changed(self.path)
+        self.write('hello')
+        # never hashed before
+        assert self.detector.has_changed(self.path)
+
+        self.write('hello')
+        assert not self.detector.has_changed(self.path)
+
+    def test_size_changed_without_hashing(self):
+        self.detector._hash = lambda path, size: self.fail('hashed')
+        assert self.detector.has_changed(self.path)
+
+        self.write('hello!')
+        assert self.detector.has_changed(self.path)
+
+    def test_content_changed(self):
+        self.detector.has_changed(self.path)
+        self.write('world')
+        assert self.detector.has_changed(self.path)
+
+        self.write('hello!')
+        assert self.detector.has_changed(self.path)
+
+    def test_replaced_by_rename(self):
+        self.detector.has_changed(self.path)
+        self.write('hello')
+        self.detector.has_changed(self.path)
+        tmp_path = str(self.tmpdir.join('file.txt.tmp'))
+        self.write('hello', tmp_path)
+        os.rename(tmp_path, self.path)
+        assert not self.detector.has_changed(self.path)
+
+        self.write('world', tmp_path)
+        os.rename(tmp_path, self.path)
+        assert self.detector.has_changed(self.path)
+
+    def test_too_big_to_hash(self):
+        detector = ChangeDetector(max_hash_size=1)
+        detector.has_changed(self.path)
+        self.write('hello')
+
+        assert detector.has_changed(self.path)
+
+    def test_missing_file(self):
+        assert self.detector.has_changed(str(self.tmpdir.join('missing')))
+
+    def test_bounded(self):
+        detector = ChangeDetector(max_entries=2)
+        paths = [str(self.tmpdir.join('f%d' % i)) for i in range(3)]
+        for path in paths:
+            self.write('x', path)
+            detector.has_changed(path)
+
+        assert len(detector) == 2
+        assert sorted(detector.keys_by_path) == paths[1:]
+        assert detector.has_changed(paths[0])
+
+    def test_forget(self):
+        self.detector.has_changed(self.path)
+        self.detector.forget(self.path)
+        self.detector.forget(self.path)
+
+        assert len(self.detector) == 0
+        assert self.detector.has_changed(self.path)
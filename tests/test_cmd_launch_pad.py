@@ -0,0 +1,232 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from fs_radar.cmd_launch_pad import CmdLaunchPad, make_cmd_lines
+
+
+class MakeCmdLinesTest(unittest.TestCase):
+
+    def test_single_path(self):
+        assert make_cmd_lines('echo {}', ['a.txt']) == ['echo a.txt']
+
+    def test_latest_path_without_list_token(self):
+        assert make_cmd_lines('echo {}', ['a.txt', 'b.txt']) == ['echo b.txt']
+
+    def test_list_token(self):
+        assert make_cmd_lines('ls {*}', ['a.txt', 'b c.txt']) == ["ls a.txt 'b c.txt'"]
+
+    def test_list_token_with_latest_path(self):
+        assert make_cmd_lines('ls {*} && echo {}', ['a', 'b']) == ['ls a b && echo b']
+
+    def test_tokens_in_paths_are_not_substituted(self):
+        assert make_cmd_lines('ls {*} && echo {}', ['{}', 'a{*}']) == ["ls '{}' 'a{*}' && echo a{*}"]
+
+    def test_split_paths_in_chunks(self):
+        paths = ['file%d' % i for i in range(10)]
+        cmd_lines = make_cmd_lines('ls {*}', paths, max_length=30)
+
+        assert len(cmd_lines) > 1
+        assert all(len(cmd_line) <= 30 for cmd_line in cmd_lines)
+        assert ' '.join(cmd_line[3:] for cmd_line in cmd_lines) == ' '.join(paths)
+
+    def test_path_longer_than_max_length_is_not_lost(self):
+        assert make_cmd_lines('ls {*}', ['a' * 50], max_length=30) == ['ls ' + 'a' * 50]
+
+
+class CmdLaunchPadTest(unittest.TestCase):
+
+    def test_normalize_quoted_tokens(self):
+        lp = CmdLaunchPad('''echo '{}' "{*}" {}''')
+
+        assert lp.cmd_template == 'echo {} {*} {}'
+
+    def test_debounce_coalesce_paths(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        lp = CmdLaunchPad('ls {*}', options={'debounce_ms': 10}, loop=loop)
+        cmd_lines = []
+        lp.run_process = cmd_lines.append
+
+        for path in ['a', 'b', 'a', 'c']:
+            lp.on_parameter_received(path)
+
+        assert cmd_lines == []
+        loop.run_until_complete(asyncio.sleep(0.05))
+
+        assert cmd_lines == ['ls a b c']
+        assert lp.debounce_handle is None
+
+    def test_run_command_in_event_loop(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        lp = CmdLaunchPad('exit 3', options={'bash_profile': os.devnull}, loop=loop)
+        lp.on_parameter_received('a')
+        assert lp.is_process_alive()
+
+        async def wait_process_end():
+            while lp.is_process_alive():
+                await asyncio.sleep(0.01)
+
+        loop.run_until_complete(asyncio.wait_for(wait_process_end(), 10))
+
+        assert lp.jobs == {}
+
+    def test_skip_unchanged(self):
+        lp = CmdLaunchPad('ls {}', options={'skip_unchanged': True})
+        received = []
+        lp.on_parameter_received = received.append
+
+        with tempfile.NamedTemporaryFile() as fp:
+            lp.add_item_to_process(fp.name)
+            lp.add_item_to_process(fp.name)
+            fp.write(b'data')
+            fp.flush()
+            lp.add_item_to_process(fp.name)
+
+        assert received == [fp.name, fp.name]
+
+    def test_content_of_discarded_request_is_not_skipped(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        lp = CmdLaunchPad('sleep 5 # {}', options={'bash_profile': os.devnull, 'skip_unchanged': True}, loop=loop)
+        self.addCleanup(lp.close)
+        with tempfile.NamedTemporaryFile() as fp:
+            lp.add_item_to_process(fp.name)
+            fp.write(b'data')
+            fp.flush()
+            # discarded while the command runs, saved again with the same content
+            lp.add_item_to_process(fp.name)
+            lp.add_item_to_process(fp.name)
+
+        assert lp.counters == {'requests': 3, 'started': 1, 'discarded': 2}
+
+    def test_failed_start_frees_the_group(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        lp = CmdLaunchPad('echo {}', options={'bash_profile': os.devnull, 'cwd': '/nonexistent'}, loop=loop)
+        self.addCleanup(lp.close)
+        for path in ['a', 'b']:
+            lp.add_item_to_process(path)
+
+        assert lp.jobs == {}
+        assert not lp.is_busy()
+        assert lp.counters == {'requests': 2, 'failed_to_start': 2}
+
+    def test_metrics_counters(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        lp = CmdLaunchPad('sleep 5', options={'bash_profile': os.devnull}, loop=loop)
+        self.addCleanup(lp.close)
+        lp.add_item_to_process('a')
+        lp.add_item_to_process('b')
+        lp.options['stop_previous_process'] = True
+        lp.options['discard_if_already_running'] = False
+        lp.add_item_to_process('c')
+
+        assert lp.counters == {'requests': 3, 'started': 2, 'discarded': 1, 'interrupted': 1}
+        assert lp.latency_histogram.count == 2
+        assert lp.duration_histogram.count == 1
+
+    def test_max_parallel(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        lp = CmdLaunchPad('sleep 5 # {}', options={
+            'bash_profile': os.devnull,
+            'max_parallel': 2,
+            'discard_if_already_running': False,
+            'stop_previous_process': True,
+        }, loop=loop)
+        self.addCleanup(lp.close)
+        for path in ['a', 'b', 'c', 'c', 'a']:
+            lp.add_item_to_process(path)
+
+        # the path already running is restarted, once a slot is free
+        assert sorted(job.cmd_line for job in lp.jobs.values()) == ['sleep 5 # b', 'sleep 5 # c']
+        assert list(lp.pending_cmd_lines) == ['sleep 5 # a']
+        assert lp.counters == {'requests': 5, 'started': 3, 'interrupted': 1}
+
+    def test_max_parallel_discard_per_path(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        lp = CmdLaunchPad('sleep 5 # {}', options={'bash_profile': os.devnull, 'max_parallel': 2}, loop=loop)
+        self.addCleanup(lp.close)
+        for path in ['a', 'b', 'a']:
+            lp.add_item_to_process(path)
+
+        assert len(lp.jobs) == 2
+        assert lp.counters == {'requests': 3, 'started': 2, 'discarded': 1}
+
+    def test_hold_paths_while_running(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        lp = CmdLaunchPad('sleep 0.2 # {*}', options={
+            'bash_profile': os.devnull,
+            'discard_if_already_running': False,
+        }, loop=loop)
+        self.addCleanup(lp.close)
+        for path in ['a', 'b', 'c', 'b']:
+            lp.add_item_to_process(path)
+
+        assert lp.held == {None: {'c': True, 'b': True}}
+        assert lp.get_queue_depth() == 2
+
+        async def wait_second_process():
+            while lp.counters['started'] < 2:
+                await asyncio.sleep(0.01)
+
+        loop.run_until_complete(asyncio.wait_for(wait_second_process(), 10))
+
+        # the paths held run together, the latest last
+        assert [job.cmd_line for job in lp.jobs.values()] == ['sleep 0.2 # c b']
+        assert lp.held == {}
+        assert lp.counters == {'requests': 4, 'started': 2, 'held': 3}
+
+    def test_held_paths_are_bounded(self):
+        lp = CmdLaunchPad('ls {*}', options={'max_pending': 2})
+        for path in ['a', 'b', 'c']:
+            lp.hold(None, [path])
+
+        assert lp.held == {None: {'b': True, 'c': True}}
+        assert lp.get_queue_depth() == 2
+        assert lp.counters['discarded'] == 1
+
+    def test_held_paths_are_dropped_in_order_of_arrival(self):
+        lp = CmdLaunchPad('ls {}', options={'max_pending': 2, 'max_parallel': 2})
+        lp.hold('x', ['a'])
+        lp.hold('y', ['b'])
+        lp.hold('x', ['c'])
+
+        assert lp.held == {'x': {'c': True}, 'y': {'b': True}}
+        assert lp.counters['discarded'] == 1
+
+    def test_hold_paths_of_single_path_command(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        lp = CmdLaunchPad('sleep 0.2 # {}', options={
+            'bash_profile': os.devnull,
+            'discard_if_already_running': False,
+        }, loop=loop)
+        self.addCleanup(lp.close)
+        for path in ['x', 'a', 'b', 'c']:
+            lp.add_item_to_process(path)
+
+        async def wait_held_processes():
+            while lp.counters['started'] < 4:
+                await asyncio.sleep(0.01)
+
+        loop.run_until_complete(asyncio.wait_for(wait_held_processes(), 10))
+
+        # every path held gets its own run, none is lost
+        assert [job.cmd_line for job in lp.jobs.values()] == ['sleep 0.2 # c']
+        assert lp.counters == {'requests': 4, 'started': 4, 'held': 3}
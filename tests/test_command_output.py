@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import pytest
+import unittest
+
+from fs_radar.command_output import CommandOutput
+
+
+class CommandOutputTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        self.tmpdir = tmpdir
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_batches_are_logged_together(self):
+        output = CommandOutput('g', self.loop)
+        self.addCleanup(output.close)
+
+        with self.assertLogs('fs_radar.command_output', logging.INFO) as logs:
+            output.write(['foo', 'bar'])
+            output.write(['baz'])
+            self.loop.run_until_complete(asyncio.sleep(0.2))
+
+        assert logs.output == ['INFO:fs_radar.command_output:[g] foo\n[g] bar\n[g] baz']
+
+    def test_oldest_lines_are_dropped(self):
+        output = CommandOutput('g', self.loop, max_lines=3)
+        self.addCleanup(output.close)
+
+        with self.assertLogs('fs_radar.command_output', logging.INFO) as logs:
+            output.write(['1', '2'])
+            output.write(['3', '4', '5'])
+            output.flush()
+
+        assert logs.output == [
+            'WARNING:fs_radar.command_output:[g] 2 lines of output dropped',
+            'INFO:fs_radar.command_output:[g] 3\n[g] 4\n[g] 5',
+        ]
+        assert output.counters['output_lines_dropped'] == 2
+        assert output.flush_handle is None
+
+    def test_file_is_rotated(self):
+        path = self.tmpdir.join('output.log')
+        output = CommandOutput('g', self.loop, path=str(path), max_bytes=20, backup_count=1)
+
+        output.write(['a' * 9, 'b' * 9])
+        output.write(['c' * 9])
+        output.close()
+
+        assert path.read() == 'c' * 9 + '\n'
+        assert self.tmpdir.join('output.log.1').read() == 'a' * 9 + '\n' + 'b' * 9 + '\n'
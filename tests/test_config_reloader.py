@@ -0,0 +1,121 @@
+import asyncio
+import os
+import pytest
+import unittest
+
+from fs_radar import FsRadar
+from fs_radar.__main__ import ConfigReloader, get_pairs_rules2launch_pads, make_abspath_filter
+from fs_radar.config import load_from_toml
+from fs_radar.groups import get_dir_filter
+from fs_radar.observer import Observer
+from fs_radar.path_dispatcher import PathDispatcher
+
+CONFIG = '''
+[fs_radar]
+basedir = "{basedir}"
+{extra}
+[group.a]
+cmd = "echo a {{}}"
+rules = ["./a/*.txt"]
+[group.b]
+cmd = "echo b {{}}"
+rules = ["{rules_b}"]
+'''
+
+
+class ConfigReloaderTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        tmpdir.chdir()  # change to pytest-provided temporary directory
+        self.tmpdir = tmpdir
+        self.basedir = str(tmpdir.join('tree'))
+        for path in ['a', 'b/c', 'd/e']:
+            tmpdir.join('tree').ensure(path, dir=True)
+        self.config_path = str(tmpdir.join('config.toml'))
+
+    def write_config(self, rules_b='./b/*.txt', extra=''):
+        with open(self.config_path, 'w') as fp:
+            fp.write(CONFIG.format(basedir=self.basedir, rules_b=rules_b, extra=extra))
+
+    def start(self):
+        self.write_config()
+        cfg = load_from_toml(self.config_path)
+
+        self.dispatcher = PathDispatcher()
+        self.launch_pads = []
+        for rules, lp in get_pairs_rules2launch_pads(cfg):
+            self.dispatcher.add(lp, rules)
+            self.launch_pads.append(lp)
+
+        self.fsr = FsRadar(make_abspath_filter(get_dir_filter(cfg['group']), self.basedir), Observer())
+        self.addCleanup(self.fsr.close)
+        for path in ['a', 'b']:
+            self.fsr.add_watch(os.path.join(self.basedir, path))
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        reloader = ConfigReloader(self.config_path, cfg, self.fsr, self.dispatcher, self.launch_pads)
+        reloader.attach(loop)
+        self.addCleanup(reloader.close)
+        return reloader
+
+    def test_reload_when_the_file_changes(self):
+        reloader = self.start()
+        reloaded = []
+        reloader.reload = lambda: reloaded.append(True)
+
+        self.write_config(rules_b='./d/e/*.txt')
+        reloader.loop.run_until_complete(asyncio.sleep(reloader.RELOAD_DELAY * 3))
+
+        assert reloaded == [True]
+
+    def get_launch_pads(self):
+        return {lp.options['name']: lp for lp in self.launch_pads}
+
+    def get_watched(self):
+        return sorted(os.path.relpath(path, self.basedir) for path in self.fsr.wds.values())
+
+    def test_only_changed_groups_are_restarted(self):
+        reloader = self.start()
+        before = self.get_launch_pads()
+
+        self.write_config(rules_b='./d/e/*.txt')
+        assert reloader.reload()
+
+        after = self.get_launch_pads()
+        assert after['a'] is before['a']
+        assert after['b'] is not before['b']
+        assert after['b'].loop is reloader.loop
+        assert self.dispatcher.match('b/x.txt') == ()
+        assert self.dispatcher.match('d/e/x.txt') == (after['b'],)
+
+    def test_watches_follow_the_rules(self):
+        reloader = self.start()
+
+        self.write_config(rules_b='./d/e/*.txt')
+        reloader.reload()
+
+        assert self.get_watched() == ['a', 'd/e']
+        assert self.fsr.dir_filter(os.path.join(self.basedir, 'd', 'e'))
+
+    def test_invalid_config_is_ignored(self):
+        reloader = self.start()
+        before = self.get_launch_pads()
+
+        self.tmpdir.join('config.toml').write('[fs_radar')
+
+        assert not reloader.reload()
+        assert self.get_launch_pads() == before
+        assert self.get_watched() == ['a', 'b']
+
+    def test_global_options_require_a_restart(self):
+        reloader = self.start()
+        basedir = self.basedir
+
+        self.write_config(extra='backend = "poll"')
+        self.basedir = str(self.tmpdir)
+        self.write_config(extra='backend = "poll"')
+        reloader.reload()
+
+        assert reloader.cfg['fs_radar'] == {'basedir': basedir}
@@ -0,0 +1,131 @@
+import asyncio
+from collections import namedtuple
+import os
+import pytest
+import unittest
+
+from fs_radar.daemon import Daemon
+
+FakeEvent = namedtuple('FakeEvent', ['data'])
+
+CONFIG = '''
+[fs_radar]
+basedir = "{basedir}"
+[group.g]
+cmd = "echo {{}}"
+rules = ["{rule}"]
+'''
+
+
+class DaemonTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        tmpdir.chdir()  # change to pytest-provided temporary directory
+        self.tmpdir = tmpdir
+        for path in ['tree/a', 'tree/b', 'tree/c']:
+            tmpdir.ensure(path, dir=True)
+
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.daemon = Daemon(str(tmpdir.join('daemon.sock')))
+        self.daemon.loop = self.loop
+        self.addCleanup(self.daemon.close)
+
+    def run_until_complete(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def handle_command(self, line):
+        return self.run_until_complete(self.daemon.handle_command(line))
+
+    def write_config(self, name, rule, basedir='tree'):
+        path = str(self.tmpdir.join(name))
+        with open(path, 'w') as fp:
+            fp.write(CONFIG.format(basedir=str(self.tmpdir.join(basedir)), rule=rule))
+        return path
+
+    def get_watched(self):
+        return sorted(os.path.relpath(path, str(self.tmpdir)) for path in self.daemon.fsr.wds.values())
+
+    def collect_requests(self, config_path):
+        requests = []
+        for lp in self.daemon.projects[config_path].launch_pads:
+            lp.add_item_to_process = requests.append
+        return requests
+
+    def test_watches_are_shared(self):
+        first = self.write_config('first.toml', './a/*.txt')
+        second = self.write_config('second.toml', '*.txt')
+
+        assert self.run_until_complete(self.daemon.register(first)) == 1
+        assert self.run_until_complete(self.daemon.register(second)) == 3
+        assert self.get_watched() == ['tree', 'tree/a', 'tree/b', 'tree/c']
+
+        assert self.daemon.unregister(second) == 3
+        assert self.get_watched() == ['tree/a']
+
+    def test_dispatch_to_every_project(self):
+        first = self.write_config('first.toml', './a/*.txt')
+        second = self.write_config('second.toml', '*.txt', basedir='tree/a')
+        self.run_until_complete(self.daemon.register(first))
+        self.run_until_complete(self.daemon.register(second))
+        first_requests = self.collect_requests(first)
+        second_requests = self.collect_requests(second)
+
+        self.tmpdir.join('tree', 'a', 'file.txt').write('foo')
+        self.daemon.fsr.on_events(self.daemon.fsr.backend.read())
+
+        assert first_requests == ['a/file.txt']
+        assert second_requests == ['file.txt']
+        assert self.daemon.projects[second].launch_pads[0].options['cwd'] == str(self.tmpdir.join('tree', 'a'))
+
+    def test_skip_unchanged_files(self):
+        config_path = self.write_config('first.toml', './a/*.txt')
+        with open(config_path, 'a') as fp:
+            fp.write('skip_unchanged = true\n')
+        self.run_until_complete(self.daemon.register(config_path))
+        lp = self.daemon.projects[config_path].launch_pads[0]
+        lp.run_process = lambda cmd_line: None
+
+        # the daemon doesn't run from basedir, the paths are relative to it
+        path = str(self.tmpdir.join('tree', 'a', 'a.txt'))
+        self.tmpdir.join('tree', 'a', 'a.txt').write('foo')
+        for i in range(2):
+            self.daemon.on_file_match(FakeEvent(path))
+
+        assert lp.counters == {'requests': 2, 'skipped_unchanged': 1}
+
+    def test_commands(self):
+        config_path = self.write_config('first.toml', './a/*.txt')
+
+        assert self.handle_command('register %s\n' % config_path) == ['ok 1 directories added']
+        assert self.handle_command('register %s' % config_path)[0].startswith('error')
+        assert self.handle_command('list') == [
+            '%s %s g' % (config_path, self.tmpdir.join('tree')),
+            'ok',
+        ]
+        assert self.handle_command('register missing.toml')[0].startswith('error')
+        assert self.handle_command('unregister %s' % config_path) == ['ok 1 directories removed']
+        assert self.handle_command('unregister %s' % config_path)[0].startswith('error')
+        assert self.handle_command('foo')[0].startswith('error')
+
+    def test_control_socket(self):
+        loop = self.loop
+        config_path = self.write_config('first.toml', './a/*.txt')
+
+        async def send(commands):
+            reader, writer = await asyncio.open_unix_connection(self.daemon.socket_path)
+            writer.write(b''.join(command.encode('utf-8') + b'\n' for command in commands))
+            lines = [(await reader.readline()).decode('utf-8') for i in range(len(commands) + 1)]
+            writer.close()
+            return lines
+
+        loop.run_until_complete(self.daemon.start_server())
+        assert os.stat(self.daemon.socket_path).st_mode & 0o077 == 0
+        try:
+            lines = loop.run_until_complete(send(['register %s' % config_path, 'list']))
+        finally:
+            self.daemon.server.close()
+            loop.run_until_complete(self.daemon.server.wait_closed())
+
+        assert lines == ['ok 1 directories added\n', '%s %s g\n' % (config_path, self.tmpdir.join('tree')), 'ok\n']
@@ -0,0 +1,40 @@
+import os
+import pytest
+import unittest
+
+from fs_radar.dir_scanner import DirScanner
+
+
+class DirScannerTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        self.basedir = str(tmpdir)
+
+        for path in ['a/b/c', 'a/d', 'node_modules/x/y', 'e']:
+            tmpdir.ensure(path, dir=True)
+        tmpdir.ensure('a/file.txt')
+        os.symlink(os.path.join(self.basedir, 'a'), os.path.join(self.basedir, 'link'))
+
+    def relpaths(self, paths):
+        return sorted(os.path.relpath(path, self.basedir) for path in paths)
+
+    def test_scan_every_directory(self):
+        scanner = DirScanner(batch_size=1)
+        paths = list(scanner.scan(self.basedir))
+
+        assert paths[0] == self.basedir
+        assert self.relpaths(paths) == [
+            '.', 'a', 'a/b', 'a/b/c', 'a/d', 'e', 'node_modules', 'node_modules/x', 'node_modules/x/y'
+        ]
+        assert scanner.dirs_count == 9
+
+    def test_skip_subtrees(self):
+        scanner = DirScanner(subtree_filter=lambda path: not path.endswith('node_modules'))
+
+        assert self.relpaths(scanner.scan(self.basedir)) == ['.', 'a', 'a/b', 'a/b/c', 'a/d', 'e']
+
+    def test_missing_directory(self):
+        assert list(DirScanner().scan(os.path.join(self.basedir, 'missing'))) == [
+            os.path.join(self.basedir, 'missing')
+        ]
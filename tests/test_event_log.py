@@ -0,0 +1,104 @@
+import asyncio
+import os
+import pytest
+import unittest
+
+from inotify_simple import Event, flags
+
+from fs_radar import FsRadar, FsRadarEvent
+from fs_radar.event_log import EventRecorder, ReplayBackend, read_event_log
+from fs_radar.observer import Observer
+
+
+class EventLogTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        tmpdir.chdir()  # change to pytest-provided temporary directory
+        self.tmpdir = tmpdir
+        self.log_path = str(tmpdir.join('events.log'))
+
+        tree = tmpdir.join('tree').mkdir()
+        tree.join('sub1').mkdir().ensure('file_a.txt')
+        tree.join('sub2').mkdir()
+
+    def path(self, relpath):
+        return os.path.normpath(str(self.tmpdir.join('tree', relpath)))
+
+    def make_radar(self, backend=None):
+        self.events = []
+        observer = Observer()
+        observer.subscribe(FsRadarEvent.FILE_MATCH, lambda ev: self.events.append(('match', ev.data)))
+        observer.subscribe(FsRadarEvent.FILE_GONE, lambda ev: self.events.append(('gone', ev.data)))
+
+        fsr = FsRadar(lambda path: True, observer, backend=backend)
+        self.addCleanup(fsr.close)
+
+        for path in ['.', 'sub1', 'sub2']:
+            fsr.add_watch(self.path(path))
+
+        return fsr
+
+    def test_round_trip(self):
+        recorder = EventRecorder(self.log_path)
+        wds = {1: '/tree/sub1', 2: '/tree/sub2'}
+        recorder.record([Event(1, flags.CLOSE_WRITE, 0, 'a.txt'), Event(2, flags.DELETE, 0, 'b.txt')], wds)
+        recorder.record([Event(-1, flags.Q_OVERFLOW, 0, ''), Event(1, flags.MOVED_FROM, 7, 'é.txt')], wds)
+        recorder.close()
+
+        records = list(read_event_log(self.log_path))
+
+        assert [record[1:] for record in records] == [
+            ('/tree/sub1', flags.CLOSE_WRITE, 0, 'a.txt'),
+            ('/tree/sub2', flags.DELETE, 0, 'b.txt'),
+            (None, flags.Q_OVERFLOW, 0, ''),
+            ('/tree/sub1', flags.MOVED_FROM, 7, 'é.txt'),
+        ]
+        assert records[0][0] == records[1][0] <= records[2][0] == records[3][0]
+
+    def test_not_an_event_log(self):
+        self.tmpdir.join('events.log').write('definitely not an event log')
+        with pytest.raises(ValueError):
+            list(read_event_log(self.log_path))
+
+    def test_replay_only_watched_paths(self):
+        recorder = EventRecorder(self.log_path)
+        recorder.record([Event(1, flags.CLOSE_WRITE, 0, 'a.txt'), Event(2, flags.CLOSE_WRITE, 0, 'b.txt')],
+                        {1: '/tree/sub1', 2: '/tree/sub2'})
+        recorder.close()
+
+        backend = ReplayBackend(self.log_path)
+        assert backend.paths == ['/tree/sub1', '/tree/sub2']
+        assert len(backend) == 2
+
+        wd = backend.add_watch('/tree/sub2')
+        assert backend.read() == [Event(wd, flags.CLOSE_WRITE, 0, 'b.txt')]
+        assert backend.is_finished()
+        assert backend.read() == []
+
+    def test_record_and_replay(self):
+        fsr = self.make_radar()
+        fsr.recorder = EventRecorder(self.log_path)
+        self.tmpdir.join('tree', 'sub1', 'file_a.txt').write('foo')
+        self.tmpdir.join('tree', 'sub1', 'file_a.txt').rename(self.tmpdir.join('tree', 'sub2', 'file_b.txt'))
+        self.tmpdir.join('tree', 'sub2', 'new_dir').mkdir()
+        fsr.on_events(fsr.backend.read())
+        fsr.recorder.close()
+        recorded = sorted(self.events)
+
+        # the replay must not need the tree
+        self.tmpdir.join('tree').remove()
+        fsr = self.make_radar(backend=ReplayBackend(self.log_path, speed=0))
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        fsr.backend.on_finished = loop.stop
+        fsr.attach(loop)
+        loop.run_forever()
+        fsr.detach()
+
+        assert sorted(self.events) == recorded == [
+            ('gone', self.path('sub1/file_a.txt')),
+            ('match', self.path('sub1/file_a.txt')),
+            ('match', self.path('sub2/file_b.txt')),
+        ]
+        assert self.path('sub2/new_dir') in fsr.wds.values()
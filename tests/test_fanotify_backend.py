@@ -0,0 +1,86 @@
+import pytest
+import unittest
+
+from inotify_simple import flags
+
+from fs_radar import FsRadar, FsRadarEvent
+from fs_radar.fanotify_backend import FanotifyBackend
+from fs_radar.observer import Observer
+
+
+def fanotify_available():
+    try:
+        FanotifyBackend().close()
+    except OSError:
+        return False
+    return True
+
+
+@unittest.skipUnless(fanotify_available(), 'fanotify requires root and Linux 5.9')
+class FanotifyBackendTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        self.tmpdir = tmpdir
+        tmpdir.ensure('watched/sub', dir=True)
+        tmpdir.ensure('other', dir=True)
+
+        self.backend = FanotifyBackend()
+        self.addCleanup(self.backend.close)
+        self.wd = self.backend.add_watch(str(tmpdir.join('watched')), flags.CLOSE_WRITE | flags.CREATE)
+
+    def test_same_directory_same_watch_descriptor(self):
+        assert self.wd > 0
+        assert self.backend.add_watch(str(self.tmpdir.join('watched')), flags.CLOSE_WRITE) == self.wd
+        assert self.backend.add_watch(str(self.tmpdir.join('watched/sub')), flags.CLOSE_WRITE) != self.wd
+
+    def test_only_watched_directories_are_reported(self):
+        self.tmpdir.join('other', 'file.txt').write('foo')
+        self.tmpdir.join('watched', 'sub', 'file.txt').write('foo')
+        self.tmpdir.join('watched', 'file.txt').write('foo')
+        self.tmpdir.join('watched', 'new_dir').mkdir()
+
+        events = self.backend.read()
+        assert [(event.wd, event.name) for event in events] == [(self.wd, 'file.txt'), (self.wd, 'new_dir')]
+        assert events[0].mask & flags.CLOSE_WRITE
+        assert events[1].mask == flags.CREATE | flags.ISDIR
+
+    def test_removed_watch(self):
+        self.backend.rm_watch(self.wd)
+        self.tmpdir.join('watched', 'file.txt').write('foo')
+
+        assert self.backend.read() == []
+
+
+@unittest.skipUnless(fanotify_available(), 'fanotify requires root and Linux 5.9')
+class FsRadarWithFanotifyTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        self.tmpdir = tmpdir
+        tmpdir.ensure('sub', dir=True)
+
+        self.events = []
+        observer = Observer()
+        observer.subscribe(FsRadarEvent.FILE_MATCH, lambda ev: self.events.append(('match', ev.data)))
+        observer.subscribe(FsRadarEvent.FILE_GONE, lambda ev: self.events.append(('gone', ev.data)))
+
+        self.fsr = FsRadar(lambda path: True, observer, max_watches=0, backend=FanotifyBackend())
+        self.addCleanup(self.fsr.close)
+        for path in [str(tmpdir), str(tmpdir.join('sub'))]:
+            self.fsr.add_watch(path)
+
+    def test_events(self):
+        assert not any(self.fsr.is_polled(wd) for wd in self.fsr.wds)
+
+        self.tmpdir.join('sub', 'file.txt').write('foo')
+        self.tmpdir.join('new_dir').mkdir()
+        self.fsr.on_events(self.fsr.backend.read())
+        self.tmpdir.join('sub').remove()
+        self.fsr.on_events(self.fsr.backend.read())
+
+        assert self.events == [
+            ('match', str(self.tmpdir.join('sub', 'file.txt'))),
+            ('gone', str(self.tmpdir.join('sub'))),
+        ]
+        assert str(self.tmpdir.join('new_dir')) in self.fsr.wds.values()
@@ -1,12 +1,21 @@
+import os
 import pytest
+import time
 import unittest
 
+from inotify_simple import Event, flags
+
+from fs_radar import MAX_PENDING_MOVES, FsRadar, FsRadarEvent
+from fs_radar.observer import Observer
+from fs_radar.stat_poller import StatPoller
+
 
 class FsRadarTest(unittest.TestCase):
 
     @pytest.fixture(autouse=True)
     def initdir(self, tmpdir):
         tmpdir.chdir()  # change to pytest-provided temporary directory
+        self.tmpdir = tmpdir
 
         tmpdir.ensure('file_zero.txt')
 
@@ -21,3 +30,162 @@ class FsRadarTest(unittest.TestCase):
         sub2_1 = sub2.join('sub2_1').mkdir()
         sub2_1.ensure('file_e.gz')
         sub2_1.ensure('file_f.tgz')
+
+    def make_radar(self, dir_filter=lambda path: True, backend=None):
+        self.events = []
+        observer = Observer()
+        observer.subscribe(FsRadarEvent.FILE_MATCH, lambda ev: self.events.append(('match', ev.data)))
+        observer.subscribe(FsRadarEvent.FILE_GONE, lambda ev: self.events.append(('gone', ev.data)))
+
+        fsr = FsRadar(dir_filter, observer, backend=backend)
+        self.addCleanup(fsr.close)
+
+        for path in ['.', 'sub1', 'sub2', 'sub2/sub2_1']:
+            fsr.add_watch(self.path(path))
+
+        return fsr
+
+    def path(self, relpath):
+        return os.path.normpath(str(self.tmpdir.join(relpath)))
+
+    def age_files(self, seconds):
+        for dirpath, dirnames, filenames in os.walk(str(self.tmpdir)):
+            for name in filenames:
+                mtime = time.time() - seconds
+                os.utime(os.path.join(dirpath, name), (mtime, mtime))
+
+    def test_file_written(self):
+        fsr = self.make_radar()
+        self.tmpdir.join('sub1', 'file_a.gz').write('foo')
+
+        fsr.on_events(fsr.backend.read())
+
+        assert self.events == [('match', self.path('sub1/file_a.gz'))]
+
+    def test_dir_index_follows_changes(self):
+        fsr = self.make_radar()
+        wd = next(wd for wd, path in fsr.wds.items() if path == self.path('sub1'))
+        st = os.stat(self.path('sub1'))
+        os.utime(self.path('sub1'), ns=(st.st_atime_ns, st.st_mtime_ns - 10 ** 9))
+        fsr.update_dir_index(wd, self.path('sub1'))
+
+        self.tmpdir.join('sub1', 'file_new').write('foo')
+        fsr.on_events(fsr.backend.read())
+
+        assert fsr.dir_index[wd][1] == os.stat(self.path('sub1')).st_mtime_ns
+
+    def test_queue_overflow(self):
+        self.age_files(3600)
+        fsr = self.make_radar()
+
+        self.tmpdir.join('sub1', 'file_a.gz').write('foo')
+        self.tmpdir.join('sub2', 'new_dir').mkdir().ensure('file_g')
+        self.tmpdir.join('sub2', 'sub2_1').remove()
+
+        fsr.on_queue_overflow(time.time_ns())
+
+        assert sorted(self.events) == [
+            ('gone', self.path('sub2/sub2_1')),
+            ('match', self.path('sub1/file_a.gz')),
+            ('match', self.path('sub2/new_dir/file_g')),
+        ]
+        assert self.path('sub2/new_dir') in fsr.wds.values()
+        assert self.path('sub2/sub2_1') not in fsr.wds.values()
+
+    def test_polling_backend(self):
+        fsr = self.make_radar(backend=StatPoller())
+        assert all(fsr.is_polled(wd) for wd in fsr.wds)
+        assert fsr.poller is fsr.backend
+
+        self.tmpdir.join('sub1', 'file_a.gz').write('foo')
+        self.tmpdir.join('sub2', 'new_dir').mkdir().ensure('file_g')
+        self.tmpdir.join('sub2', 'sub2_1').remove()
+        fsr.on_events(fsr.backend.read())
+
+        assert sorted(self.events) == [
+            ('gone', self.path('sub2/sub2_1')),
+            ('match', self.path('sub1/file_a.gz')),
+            ('match', self.path('sub2/new_dir/file_g')),
+        ]
+        assert self.path('sub2/new_dir') in fsr.wds.values()
+
+    def read_events(self, fsr):
+        self.events = []
+        fsr.on_events(fsr.backend.read())
+        return sorted(self.events)
+
+    def test_file_renamed(self):
+        fsr = self.make_radar()
+        self.tmpdir.join('sub1', 'file_a.gz').rename(self.tmpdir.join('sub2', 'file_a.txt'))
+
+        assert self.read_events(fsr) == [
+            ('gone', self.path('sub1/file_a.gz')),
+            ('match', self.path('sub2/file_a.txt')),
+        ]
+        assert fsr.pending_moves == {}
+
+    def test_dir_renamed(self):
+        fsr = self.make_radar()
+        wds = dict((path, wd) for wd, path in fsr.wds.items())
+        self.tmpdir.join('sub2').rename(self.tmpdir.join('sub1', 'moved'))
+
+        assert self.read_events(fsr) == [
+            ('gone', self.path('sub2')),
+            ('match', self.path('sub1/moved/file_c.gz')),
+            ('match', self.path('sub1/moved/file_d.tgz')),
+            ('match', self.path('sub1/moved/sub2_1/file_e.gz')),
+            ('match', self.path('sub1/moved/sub2_1/file_f.tgz')),
+        ]
+        # the same watches, with the new paths
+        assert fsr.wds[wds[self.path('sub2')]] == self.path('sub1/moved')
+        assert fsr.wds[wds[self.path('sub2/sub2_1')]] == self.path('sub1/moved/sub2_1')
+
+        self.tmpdir.join('sub1', 'moved', 'sub2_1', 'file_e.gz').write('foo')
+        assert self.read_events(fsr) == [('match', self.path('sub1/moved/sub2_1/file_e.gz'))]
+
+    def test_dir_moved_out(self):
+        fsr = self.make_radar()
+        outside = self.tmpdir.dirpath().join('outside_%s' % os.getpid())
+        self.tmpdir.join('sub2').rename(outside)
+        self.addCleanup(outside.remove)
+
+        assert self.read_events(fsr) == []
+        assert len(fsr.pending_moves) == 1
+
+        fsr.expire_pending_moves()
+        assert self.events == [('gone', self.path('sub2'))]
+        assert sorted(fsr.wds.values()) == [self.path('.'), self.path('sub1')]
+
+    def test_dir_moved_in(self):
+        fsr = self.make_radar()
+        outside = self.tmpdir.dirpath().join('outside_%s' % os.getpid())
+        outside.ensure('deep', 'file_h', dir=False)
+        self.addCleanup(lambda: outside.check() and outside.remove())
+        outside.rename(self.tmpdir.join('sub1', 'moved_in'))
+
+        assert self.read_events(fsr) == [('match', self.path('sub1/moved_in/deep/file_h'))]
+        assert self.path('sub1/moved_in') in fsr.wds.values()
+        assert self.path('sub1/moved_in/deep') in fsr.wds.values()
+
+    def test_events_of_removed_watch(self):
+        fsr = self.make_radar()
+        root_wd = fsr.wds.get_wd(self.path('.'))
+        sub2_wd = fsr.wds.get_wd(self.path('sub2'))
+        # the backend can't pair the moves, the watches of sub2 go at once
+        fsr.on_events([
+            Event(root_wd, flags.MOVED_FROM | flags.ISDIR, 0, 'sub2'),
+            Event(sub2_wd, flags.CLOSE_WRITE, 0, 'file_c.gz'),
+            Event(sub2_wd, flags.CREATE | flags.ISDIR, 0, 'new'),
+            Event(root_wd, flags.CLOSE_WRITE, 0, 'file_zero.txt'),
+        ])
+
+        assert self.events == [('gone', self.path('sub2')), ('match', self.path('file_zero.txt'))]
+
+    def test_unpaired_moves_are_bounded(self):
+        fsr = self.make_radar()
+        wd = next(iter(fsr.wds))
+        for cookie in range(1, MAX_PENDING_MOVES + 2):
+            fsr.on_watch_event(Event(wd, flags.MOVED_FROM, cookie, 'file_%d' % cookie))
+
+        assert len(fsr.pending_moves) == MAX_PENDING_MOVES
+        assert self.events == [('gone', self.path('file_1'))]
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import pytest
+import unittest
+
+from inotify_simple import Event, flags
+
+from fs_radar import FsRadar
+from fs_radar.cmd_launch_pad import CmdLaunchPad
+from fs_radar.metrics import (
+    Histogram, Metric, MetricsServer, collect_launch_pads_metrics, collect_radar_metrics,
+    parse_metrics_address, render_metrics
+)
+from fs_radar.observer import Observer
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_observe(self):
+        histogram = Histogram([1, 5])
+        for value in [0.5, 1, 3, 10]:
+            histogram.observe(value)
+
+        assert histogram.get_samples({'group': 'g'}) == [
+            ('_bucket', {'group': 'g', 'le': '1'}, 2),
+            ('_bucket', {'group': 'g', 'le': '5'}, 3),
+            ('_bucket', {'group': 'g', 'le': '+Inf'}, 4),
+            ('_sum', {'group': 'g'}, 14.5),
+            ('_count', {'group': 'g'}, 4),
+        ]
+
+
+class MetricsTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        tmpdir.chdir()  # change to pytest-provided temporary directory
+        self.tmpdir = tmpdir
+
+    def test_render(self):
+        text = render_metrics([
+            Metric('foo_total', 'counter', 'Foos', [('', {'group': 'a "b"'}, 3)]),
+            Metric('bar', 'gauge', 'Bars', [('', {}, 0.5)]),
+        ])
+
+        assert text == (
+            '# HELP foo_total Foos\n'
+            '# TYPE foo_total counter\n'
+            'foo_total{group="a \\"b\\""} 3\n'
+            '# HELP bar Bars\n'
+            '# TYPE bar gauge\n'
+            'bar 0.5\n'
+        )
+
+    def test_parse_address(self):
+        assert parse_metrics_address('unix:/run/fs_radar.sock') == ('unix', '/run/fs_radar.sock')
+        assert parse_metrics_address('0.0.0.0:9000') == ('tcp', '0.0.0.0', 9000)
+        assert parse_metrics_address(9000) == ('tcp', '127.0.0.1', 9000)
+        assert parse_metrics_address('[::1]:9000') == ('tcp', '::1', 9000)
+        for address in ['unix:', 'localhost', 'localhost:99999']:
+            with pytest.raises(ValueError):
+                parse_metrics_address(address)
+
+    def test_collect(self):
+        fsr = FsRadar(lambda path: True, Observer())
+        self.addCleanup(fsr.close)
+        fsr.add_watch(str(self.tmpdir))
+        self.tmpdir.join('b').mkdir()
+        wd, = fsr.wds
+        fsr.on_events([Event(wd, flags.CREATE, 0, 'a'), Event(wd, flags.CLOSE_WRITE, 0, 'a'),
+                       Event(wd, flags.CREATE | flags.ISDIR, 0, 'b')])
+        lp = CmdLaunchPad('ls', options={'name': 'ls'})
+        lp.on_parameter_received = lambda path: None
+        lp.add_item_to_process('a')
+
+        text = render_metrics(collect_radar_metrics(fsr) + collect_launch_pads_metrics([lp]))
+
+        assert 'fs_radar_events_total{flag="CREATE"} 2\n' in text
+        assert 'fs_radar_events_total{flag="ISDIR"} 1\n' in text
+        assert 'fs_radar_watches{kind="kernel"} 2\n' in text  # b was watched too
+        assert 'fs_radar_matches_total{group="ls"} 1\n' in text
+        assert 'fs_radar_spawn_latency_seconds_count{group="ls"} 0\n' in text
+
+    def test_server(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        path = str(self.tmpdir.join('metrics.sock'))
+        server = MetricsServer('unix:' + path, lambda: [Metric('foo', 'gauge', 'Foo', [('', {}, 1)])])
+
+        async def get(target):
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(b'GET ' + target + b' HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            return response
+
+        loop.run_until_complete(server.start())
+        try:
+            response = loop.run_until_complete(get(b'/metrics'))
+            not_found = loop.run_until_complete(get(b'/foo'))
+        finally:
+            server.close()
+
+        assert response.startswith(b'HTTP/1.0 200 OK\r\n')
+        assert response.endswith(b'\r\n\r\n# HELP foo Foo\n# TYPE foo gauge\nfoo 1\n')
+        assert not_found.startswith(b'HTTP/1.0 404')
+        assert not os.path.exists(path)
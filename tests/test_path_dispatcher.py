@@ -0,0 +1,79 @@
+import unittest
+
+from fs_radar.path_dispatcher import PathDispatcher
+from fs_radar.path_filter import makePathFilter
+
+
+RULES = {
+    'name': ['foo.txt'],
+    'suffix': ['*.py'],
+    'suffix_in_dir': ['./src/*_test.py'],
+    'first_dir': ['./docs/'],
+    'any_dir': ['build/'],
+    'double_asterisk': ['a/**/x'],
+    'generic': ['**a'],
+    'everything': ['.'],
+    'excluded': ['*.c', '!vendor/', '+vendor/keep.c'],
+    'only_keep': ['+foo.txt'],
+}
+
+PATHS = [
+    'foo.txt', 'a/b/foo.txt', './foo.txt', 'foo.txtx',
+    'x.py', 'src/x_test.py', 'src/sub/x_test.py', 'x_test.py',
+    'docs', 'docs/index.md', 'a/docs/index.md',
+    'build/out.o', 'a/build', 'a/buildx/c',
+    'a/x', 'a/b/x', 'a/b/c/x',
+    'ba', 'x/y/a', 'bar',
+    'main.c', 'vendor/lib.c', 'vendor/keep.c',
+    '.', '',
+]
+
+
+class PathDispatcherTest(unittest.TestCase):
+
+    def make_dispatcher(self, rules_by_target):
+        d = PathDispatcher()
+        for target, rules in rules_by_target.items():
+            d.add(target, rules)
+        return d
+
+    def test_same_result_of_path_filters(self):
+        d = self.make_dispatcher(RULES)
+        filters = {target: makePathFilter(rules) for target, rules in RULES.items()}
+
+        for path in PATHS:
+            expected = tuple(target for target, f in filters.items() if f(path))
+            assert d.match(path) == expected, path
+
+    def test_no_targets(self):
+        assert PathDispatcher().match('foo.txt') == ()
+
+    def test_remove_target(self):
+        d = self.make_dispatcher({'a': ['*.txt'], 'b': ['foo.txt']})
+        d.remove('a')
+
+        assert d.match('foo.txt') == ('b',)
+        assert d.match('bar.txt') == ()
+
+    def test_order_of_registration(self):
+        d = self.make_dispatcher({'z': ['*.txt'], 'a': ['foo.txt'], 'm': ['.']})
+
+        assert d.match('foo.txt') == ('z', 'a', 'm')
+
+    def test_cache_decisions(self):
+        d = self.make_dispatcher({'a': ['*.txt']})
+
+        d.match('foo.txt')
+        d.match('foo.txt')
+        d.match('bar.txt')
+
+        assert d.cache_info().hits == 1
+        assert d.cache_info().misses == 2
+
+    def test_cache_invalidated_when_rules_change(self):
+        d = self.make_dispatcher({'a': ['*.txt']})
+        assert d.match('foo.txt') == ('a',)
+
+        d.add('b', ['foo.txt'])
+        assert d.match('foo.txt') == ('a', 'b')
+        assert d.cache_info().currsize == 1
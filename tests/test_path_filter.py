@@ -1,7 +1,7 @@
 import pytest
 import unittest
 
-from fs_radar.path_filter import makePathFilter, makeDirFilter
+from fs_radar.path_filter import makePathFilter, makeDirFilter, makeSubtreeFilter
 
 
 class MakePathFilterTest(unittest.TestCase):
@@ -269,3 +269,64 @@ class MakeDirFilterTest(unittest.TestCase):
         assert f('./a/b1/b2/c')
         assert f('./a/b/d') is False
         assert f('a/b/c')
+
+
+class MakeSubtreeFilterTest(unittest.TestCase):
+
+    def test_empty_rules(self):
+        f = makeSubtreeFilter([])
+
+        assert f('.') is False
+        assert f('a') is False
+
+    def test_rule_at_any_depth(self):
+        f = makeSubtreeFilter([
+            '*.txt'
+        ])
+
+        assert f('.')
+        assert f('a/b')
+
+    def test_anchored_rule(self):
+        f = makeSubtreeFilter([
+            './a/*/c/foo.txt'
+        ])
+
+        assert f('.')
+        assert f('a')
+        assert f('a/b')
+        assert f('a/b/c')
+        assert f('a/b/c/d')
+        assert f('a/b/d') is False
+        assert f('b') is False
+
+    def test_anchored_rule_with_multi_asterisks(self):
+        f = makeSubtreeFilter([
+            './a/**/c/'
+        ])
+
+        assert f('a/b1/b2/b3')
+        assert f('b') is False
+
+    def test_excluded_subtree(self):
+        f = makeSubtreeFilter([
+            '*.js',
+            '!node_modules/',
+            '!./build/',
+            '+./build/keep/'
+        ])
+
+        assert f('node_modules') is False
+        assert f('a/node_modules/b') is False
+        assert f('build')
+        assert f('build/keep')
+        assert f('build/other') is False
+        assert f('a/build')
+
+    def test_excluded_files_do_not_exclude_subtree(self):
+        f = makeSubtreeFilter([
+            '*.js',
+            '!app/cache/*.txt'
+        ])
+
+        assert f('app/cache/foo.txt')
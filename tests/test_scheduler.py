@@ -0,0 +1,119 @@
+import asyncio
+import os
+import unittest
+
+from fs_radar.cmd_launch_pad import CmdLaunchPad
+from fs_radar.scheduler import ProcessScheduler
+
+
+class FakeLaunchPad:
+
+    def __init__(self, name, pending, priority=0, weight=1, max_parallel=10):
+        self.options = {'name': name, 'priority': priority, 'weight': weight}
+        self.pending = pending
+        self.max_parallel = max_parallel
+        self.jobs = {}
+
+    def wants_slot(self):
+        return self.pending > 0 and len(self.jobs) < self.max_parallel
+
+    def run_next_cmd_line(self):
+        self.pending -= 1
+        self.jobs[len(self.jobs)] = True
+
+
+class ProcessSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def make_scheduler(self, **kwargs):
+        scheduler = ProcessScheduler(**kwargs)
+        scheduler.attach(self.loop)
+        self.addCleanup(scheduler.close)
+        return scheduler
+
+    def run_dispatch(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_priorities_first(self):
+        scheduler = self.make_scheduler(max_processes=2)
+        low = FakeLaunchPad('low', 2)
+        high = FakeLaunchPad('high', 1, priority=5)
+        scheduler.submit(low)
+        scheduler.submit(high)
+        self.run_dispatch()
+
+        assert (len(high.jobs), len(low.jobs)) == (1, 1)
+        assert scheduler.running == 2
+        assert list(scheduler.waiting) == [low]
+
+        scheduler.release()
+        self.run_dispatch()
+
+        assert len(low.jobs) == 2
+        assert scheduler.waiting == {}
+
+    def test_weights_share_the_slots(self):
+        scheduler = self.make_scheduler(max_processes=3)
+        light = FakeLaunchPad('light', 10)
+        heavy = FakeLaunchPad('heavy', 10, weight=2)
+        scheduler.submit(light)
+        scheduler.submit(heavy)
+        self.run_dispatch()
+
+        assert (len(light.jobs), len(heavy.jobs)) == (1, 2)
+
+    def test_hold_back_while_overloaded(self):
+        scheduler = self.make_scheduler(min_available_memory=1 << 62)
+        lp = FakeLaunchPad('lp', 3)
+        scheduler.submit(lp)
+        self.run_dispatch()
+
+        # one process at least is always allowed
+        assert len(lp.jobs) == 1
+        assert scheduler.throttled == 1
+        assert scheduler.dispatch_handle is not None
+
+    def test_launch_pads_share_the_cap(self):
+        scheduler = self.make_scheduler(max_processes=1)
+        launch_pads = []
+        for name in ['a', 'b']:
+            lp = CmdLaunchPad('sleep 5 # {}', options={'bash_profile': os.devnull, 'name': name}, loop=self.loop)
+            lp.attach(self.loop, scheduler)
+            self.addCleanup(lp.close)
+            lp.add_item_to_process('path')
+            launch_pads.append(lp)
+        self.run_dispatch()
+
+        assert [len(lp.jobs) for lp in launch_pads] == [1, 0]
+        assert launch_pads[1].is_busy()
+
+        launch_pads[0].close()
+        self.run_dispatch()
+
+        # the slot is free once the process terminated, not before
+        assert [len(lp.jobs) for lp in launch_pads] == [0, 0]
+        assert scheduler.running == 1
+
+        async def wait_second_process():
+            while not launch_pads[1].jobs:
+                await asyncio.sleep(0.01)
+
+        self.loop.run_until_complete(asyncio.wait_for(wait_second_process(), 10))
+
+        assert scheduler.running == 1
+
+    def test_failed_start_releases_the_slot(self):
+        scheduler = self.make_scheduler(max_processes=1)
+        lp = CmdLaunchPad('echo {}', options={'bash_profile': os.devnull, 'cwd': '/nonexistent'}, loop=self.loop)
+        lp.attach(self.loop, scheduler)
+        self.addCleanup(lp.close)
+        for path in ['a', 'b']:
+            lp.add_item_to_process(path)
+        self.run_dispatch()
+
+        assert lp.counters['failed_to_start'] == 2
+        assert scheduler.running == 0
+        assert scheduler.waiting == {}
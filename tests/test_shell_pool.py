@@ -0,0 +1,112 @@
+import asyncio
+import os
+import pytest
+from time import monotonic
+import unittest
+
+from fs_radar.shell_pool import ShellPool
+
+
+class ShellPoolTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        self.tmpdir = tmpdir
+        # count how many times it is sourced
+        self.profile = tmpdir.join('profile')
+        self.profile.write('echo sourced >> %s\nalias hello="echo hello"\n' % tmpdir.join('sourced'))
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.lines = []
+        self.exit_statuses = []
+
+    def make_pool(self, **kwargs):
+        pool = ShellPool(bash_profile=str(self.profile), cwd=str(self.tmpdir), **kwargs)
+        pool.attach(self.loop)
+        self.addCleanup(pool.close)
+        return pool
+
+    def run_command(self, pool, cmd, timeout=10):
+        p = pool.make_command(cmd)
+        p.start(self.loop, self.lines.extend, self.on_exit)
+        self.loop.call_later(timeout, self.loop.stop)
+        self.loop.run_forever()
+        return p
+
+    def on_exit(self, exit_status):
+        self.exit_statuses.append(exit_status)
+        self.loop.stop()
+
+    def get_live_group_members(self, pgid):
+        '''Pids of the process group `pgid` (zombies waiting to be reaped
+        by init are dead already)'''
+        members = []
+        for pid in filter(str.isdigit, os.listdir('/proc')):
+            try:
+                with open('/proc/%s/stat' % pid) as fp:
+                    fields = fp.read().rpartition(')')[2].split()
+            except OSError:
+                continue
+            if int(fields[2]) == pgid and fields[0] != 'Z':
+                members.append(int(pid))
+        return members
+
+    def count_sourced(self):
+        return len(self.tmpdir.join('sourced').readlines())
+
+    def test_output_and_exit_status(self):
+        pool = self.make_pool()
+        p = self.run_command(pool, 'hello; pwd; echo bar >&2; sh -c "exit 3"')
+
+        assert self.lines == ['hello', str(self.tmpdir), 'bar']
+        assert self.exit_statuses == [3]
+        assert not p.is_running()
+
+    def test_shells_are_reused_then_recycled(self):
+        pool = self.make_pool(size=1, max_runs=2)
+        for i in range(3):
+            self.run_command(pool, 'echo $$')
+
+        assert self.exit_statuses == [0, 0, 0]
+        assert self.lines[0] == self.lines[1] != self.lines[2]
+        # the first shell and its replacement
+        assert self.count_sourced() == 2
+
+    def test_long_command_written_without_blocking(self):
+        # the shell is still sourcing its profile, the command doesn't fit the pipe
+        self.profile.write('sleep 0.5\n', mode='a')
+        pool = self.make_pool()
+        p = pool.make_command(': %s; echo done' % ('x' * 4 * 1024 * 1024))
+        started_at = monotonic()
+        p.start(self.loop, self.lines.extend, self.on_exit)
+
+        assert monotonic() - started_at < 0.5
+        self.loop.call_later(10, self.loop.stop)
+        self.loop.run_forever()
+
+        assert self.lines == ['done']
+        assert self.exit_statuses == [0]
+
+    def test_terminate_process_group(self):
+        pool = self.make_pool()
+        p = pool.make_command('sleep 30 & sleep 30; echo never')
+        p.start(self.loop, self.lines.extend, self.on_exit)
+
+        self.loop.call_later(0.2, p.terminate)
+
+        async def wait_process_end():
+            while p.is_running():
+                await asyncio.sleep(0.01)
+
+        self.loop.run_until_complete(asyncio.wait_for(wait_process_end(), 5))
+
+        assert self.lines == []
+        assert self.exit_statuses == []
+        assert p.returncode != 0
+        assert self.get_live_group_members(p.job_pid) == []
+
+        # the shell survived and runs the next command
+        self.run_command(pool, 'echo next')
+        assert self.lines == ['next']
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import unittest
+
+from fs_radar.shell_process import ShellCommand
+
+
+class ShellCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.lines = []
+        self.exit_statuses = []
+
+    def run_command(self, cmd, timeout=10):
+        p = ShellCommand(cmd, bash_profile=os.devnull)
+        p.start(self.loop, self.lines.extend, self.on_exit)
+        self.loop.call_later(timeout, self.loop.stop)
+        self.loop.run_forever()
+        return p
+
+    def on_exit(self, exit_status):
+        self.exit_statuses.append(exit_status)
+        self.loop.stop()
+
+    def test_output_and_exit_status(self):
+        p = self.run_command('echo foo; echo bar; sh -c "exit 3"')
+
+        assert self.lines == ['foo', 'bar']
+        assert self.exit_statuses == [3]
+        assert not p.is_running()
+
+    def test_output_without_trailing_newline(self):
+        self.run_command('printf "foo\\nbar"')
+
+        assert self.lines == ['foo', 'bar']
+        assert self.exit_statuses == [0]
+
+    def test_terminate_process_group(self):
+        p = ShellCommand('sleep 30; echo never', bash_profile=os.devnull)
+        p.start(self.loop, self.lines.extend, self.on_exit)
+
+        self.loop.call_later(0.2, p.terminate)
+
+        async def wait_process_end():
+            while p.is_running():
+                await asyncio.sleep(0.01)
+
+        self.loop.run_until_complete(asyncio.wait_for(wait_process_end(), 5))
+
+        assert self.lines == []
+        assert self.exit_statuses == []
+        assert p.returncode is not None
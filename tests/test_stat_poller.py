@@ -0,0 +1,109 @@
+import os
+import pytest
+import time
+import unittest
+
+from inotify_simple import Event, flags
+
+from fs_radar.stat_poller import StatPoller
+
+
+class StatPollerTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        self.tmpdir = tmpdir
+        tmpdir.ensure('file_a.txt')
+        tmpdir.ensure('sub', dir=True)
+
+        self.poller = StatPoller()
+        self.wd = self.poller.add_watch(str(tmpdir))
+
+    def touch_later(self, path, content):
+        '''Write `content` making sure the mtime changes'''
+        path = self.tmpdir.join(path)
+        path.write(content)
+        st = os.stat(str(path))
+        os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    def test_negative_watch_descriptors(self):
+        assert self.wd < -1
+        assert self.poller.add_watch(str(self.tmpdir.join('sub'))) < self.wd
+
+    def test_nothing_changed(self):
+        assert self.poller.read() == []
+
+    def test_file_modified(self):
+        self.touch_later('file_a.txt', 'foo')
+
+        assert self.poller.read() == [Event(self.wd, flags.CLOSE_WRITE, 0, 'file_a.txt')]
+        assert self.poller.read() == []
+
+    def test_entries_added_and_removed(self):
+        self.tmpdir.join('file_a.txt').remove()
+        self.tmpdir.ensure('new_dir', dir=True)
+        self.touch_later('file_b.txt', 'foo')
+        self.bump_dir_mtime()
+
+        assert sorted(self.poller.read()) == sorted([
+            Event(self.wd, flags.DELETE, 0, 'file_a.txt'),
+            Event(self.wd, flags.CREATE | flags.ISDIR, 0, 'new_dir'),
+            Event(self.wd, flags.CLOSE_WRITE, 0, 'file_b.txt'),
+        ])
+
+    def test_watched_dir_removed(self):
+        sub_wd = self.poller.add_watch(str(self.tmpdir.join('sub')))
+        self.tmpdir.join('sub').remove()
+
+        assert Event(sub_wd, flags.IGNORED, 0, '') in self.poller.read()
+        assert sub_wd not in self.poller.watches
+
+    def bump_dir_mtime(self):
+        st = os.stat(str(self.tmpdir))
+        os.utime(str(self.tmpdir), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+class StatPollerIntervalTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        self.tmpdir = tmpdir
+        tmpdir.ensure('file_a.txt')
+
+        self.poller = StatPoller(interval=1, max_interval=4)
+        self.wd = self.poller.add_watch(str(tmpdir))
+        self.watch = self.poller.watches[self.wd]
+
+    def test_first_check_within_interval(self):
+        now = time.monotonic()
+        wd = self.poller.add_watch(str(self.tmpdir))
+
+        assert now <= self.poller.watches[wd].due <= now + 1
+
+    def test_quiet_directory_is_checked_less_often(self):
+        now = self.watch.due
+        for expected_interval in [2, 4, 4]:
+            assert self.poller.read_due(now) == []
+            assert self.watch.interval == expected_interval
+            assert self.poller.read_due(now + expected_interval - 0.5) == []
+            now += expected_interval
+            assert self.watch.due == now
+
+    def test_busy_directory_goes_back_to_the_base_interval(self):
+        now = self.watch.due
+        self.poller.read_due(now)
+        self.poller.read_due(now + 2)
+        assert self.watch.interval == 4
+
+        self.tmpdir.join('file_a.txt').write('foo')
+        st = os.stat(str(self.tmpdir.join('file_a.txt')))
+        os.utime(str(self.tmpdir.join('file_a.txt')), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+        assert self.poller.read_due(now + 6) == [Event(self.wd, flags.CLOSE_WRITE, 0, 'file_a.txt')]
+        assert self.watch.interval == 1
+
+    def test_removed_watch_is_not_checked(self):
+        self.poller.rm_watch(self.wd)
+
+        assert self.poller.read_due(self.watch.due) == []
+        assert self.poller.schedule == []
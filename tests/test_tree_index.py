@@ -0,0 +1,131 @@
+import os
+import pytest
+import unittest
+
+from fs_radar.tree_index import TreeIndex, make_index_key
+
+
+class TreeIndexTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def initdir(self, tmpdir):
+        self.basedir = str(tmpdir.mkdir('tree'))
+        self.index_path = str(tmpdir.join('index'))
+        self.key = make_index_key(self.basedir, ['*.txt'])
+
+        tmpdir.ensure('tree/a/b', dir=True)
+        tmpdir.ensure('tree/node_modules/x', dir=True)
+        tmpdir.join('tree/a/one.txt').write('1')
+        tmpdir.join('tree/a/b/two.txt').write('2')
+        tmpdir.join('tree/a/other.md').write('3')
+
+    def path(self, relpath):
+        return os.path.join(self.basedir, relpath)
+
+    def relpaths(self, paths):
+        return sorted(os.path.relpath(path, self.basedir) for path in paths)
+
+    def refresh(self, index):
+        return index.refresh(
+            lambda path: True,
+            lambda path: not path.endswith('node_modules'),
+            lambda path: path.endswith('.txt')
+        )
+
+    def build(self):
+        index = TreeIndex.load(self.index_path, self.basedir, self.key)
+        result = self.refresh(index)
+        index.save(self.index_path)
+        return result
+
+    def reload(self):
+        return self.refresh(TreeIndex.load(self.index_path, self.basedir, self.key))
+
+    def touch(self, relpath, data):
+        # same size, different content and mtime, same directory mtime
+        dir_st = os.stat(os.path.dirname(self.path(relpath)))
+        with open(self.path(relpath), 'w') as fp:
+            fp.write(data)
+        st = os.stat(self.path(relpath))
+        os.utime(self.path(relpath), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        os.utime(os.path.dirname(self.path(relpath)), ns=(dir_st.st_atime_ns, dir_st.st_mtime_ns))
+
+    def test_first_build_reports_nothing(self):
+        dirs, changed, gone = self.build()
+
+        assert self.relpaths(dirs) == ['.', 'a', 'a/b']
+        assert changed == [] and gone == []
+
+    def test_save_and_load(self):
+        self.build()
+        index = TreeIndex.load(self.index_path, self.basedir, self.key)
+
+        assert index.loaded
+        assert self.relpaths(index.dirs) == ['.', 'a', 'a/b']
+        assert self.relpaths(index.files) == ['a/b/two.txt', 'a/one.txt']
+
+    def test_nothing_changed(self):
+        self.build()
+        dirs, changed, gone = self.reload()
+
+        assert self.relpaths(dirs) == ['.', 'a', 'a/b']
+        assert changed == [] and gone == []
+
+    def test_key_mismatch(self):
+        self.build()
+        index = TreeIndex.load(self.index_path, self.basedir, make_index_key(self.basedir, ['*.md']))
+
+        assert not index.loaded
+        assert index.dirs == {} and index.files == {}
+
+    def test_file_modified_in_place(self):
+        self.build()
+        self.touch('a/one.txt', '9')
+
+        dirs, changed, gone = self.reload()
+        assert self.relpaths(changed) == ['a/one.txt']
+        assert gone == []
+
+    def test_files_added_and_removed(self):
+        self.build()
+        with open(self.path('a/three.txt'), 'w') as fp:
+            fp.write('3')
+        with open(self.path('a/ignored.md'), 'w') as fp:
+            fp.write('3')
+        os.unlink(self.path('a/b/two.txt'))
+
+        dirs, changed, gone = self.reload()
+        assert self.relpaths(changed) == ['a/three.txt']
+        assert self.relpaths(gone) == ['a/b/two.txt']
+
+    def test_new_subtree(self):
+        self.build()
+        os.makedirs(self.path('a/c/d'))
+        with open(self.path('a/c/d/four.txt'), 'w') as fp:
+            fp.write('4')
+
+        dirs, changed, gone = self.reload()
+        assert self.relpaths(dirs) == ['.', 'a', 'a/b', 'a/c', 'a/c/d']
+        assert self.relpaths(changed) == ['a/c/d/four.txt']
+
+    def test_update_keeps_the_touched_files(self):
+        index = TreeIndex.load(self.index_path, self.basedir, self.key)
+        self.refresh(index)
+        with open(self.path('a/b/five.txt'), 'w') as fp:
+            fp.write('5')
+        index.on_path_touched(type('Event', (), {'data': self.path('a/b/five.txt')}))
+        index.update(set(index.dirs), lambda path: path.endswith('.txt'))
+        index.save(self.index_path)
+
+        dirs, changed, gone = self.reload()
+        assert changed == [] and gone == []
+
+    def test_update_drops_the_deleted_files(self):
+        index = TreeIndex.load(self.index_path, self.basedir, self.key)
+        self.refresh(index)
+        os.unlink(self.path('a/one.txt'))
+        index.update(set(index.dirs), lambda path: path.endswith('.txt'))
+        index.save(self.index_path)
+
+        dirs, changed, gone = self.reload()
+        assert changed == [] and gone == []
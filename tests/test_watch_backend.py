@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from inotify_simple import Event, flags, parse_events
+
+from fs_radar import watch_backend
+from fs_radar.watch_backend import (
+    BURST_EVENTS, INOTIFY_EVENT_HEADER, MAX_BATCH_DELAY, MIN_BATCH_DELAY, InotifyBackend,
+    decode_inotify_events, get_fs_type, get_next_batch_delay, is_inotify_blind
+)
+
+MOUNTS = '''\
+/dev/sda1 / ext4 rw,relatime 0 0
+server:/export /mnt/nfs nfs4 rw,relatime 0 0
+sshfs#host: /mnt/with\\040space fuse.sshfs rw 0 0
+tmpfs /mnt/nfs/tmp tmpfs rw 0 0
+'''
+
+
+class GetFsTypeTest(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile('w', delete=False) as fp:
+            fp.write(MOUNTS)
+        self.mounts_path = fp.name
+        self.addCleanup(os.unlink, fp.name)
+
+    def get_fs_type(self, path):
+        with mock.patch.object(watch_backend, 'MOUNTS_PATH', self.mounts_path), \
+                mock.patch('os.path.realpath', lambda path: path):
+            return get_fs_type(path)
+
+    def test_longest_mount_point_wins(self):
+        assert self.get_fs_type('/home/user') == 'ext4'
+        assert self.get_fs_type('/mnt/nfs') == 'nfs4'
+        assert self.get_fs_type('/mnt/nfs/src') == 'nfs4'
+        assert self.get_fs_type('/mnt/nfs/tmp/x') == 'tmpfs'
+        assert self.get_fs_type('/mnt/nfsother') == 'ext4'
+
+    def test_escaped_mount_point(self):
+        assert self.get_fs_type('/mnt/with space/src') == 'fuse.sshfs'
+
+    def test_inotify_blind(self):
+        assert is_inotify_blind('nfs4')
+        assert is_inotify_blind('fuse.sshfs')
+        assert not is_inotify_blind('ext4')
+        assert not is_inotify_blind(None)
+
+
+class InotifyBackendTest(unittest.TestCase):
+
+    def test_decode_events(self):
+        data = bytearray()
+        for wd, mask, cookie, name in [
+            (1, 8, 0, b'file.txt'),
+            (2, 1024, 0, b''),
+            (1, 64, 7, b'caf\xc3\xa9-' + b'x' * 20),
+        ]:
+            padded = name + b'\0' * (-len(name) % 16 if name else 0)
+            data += INOTIFY_EVENT_HEADER.pack(wd, mask, cookie, len(padded)) + padded
+        buffer = data + bytearray(100)
+
+        assert decode_inotify_events(buffer, len(data)) == parse_events(bytes(data))
+        assert decode_inotify_events(buffer, 0) == []
+
+    def test_read_into_buffer(self):
+        with tempfile.TemporaryDirectory() as path:
+            backend = InotifyBackend()
+            self.addCleanup(backend.close)
+            wd = backend.add_watch(path, flags.CLOSE_WRITE)
+            assert backend.read() == []
+
+            with open(os.path.join(path, 'file.txt'), 'w') as fp:
+                fp.write('foo')
+
+            assert backend.read() == [Event(wd, flags.CLOSE_WRITE, 0, 'file.txt')]
+            assert backend.read() == []
+
+    def test_batch_delay(self):
+        # idle stream: read as soon as possible
+        assert get_next_batch_delay(0, 1, 10) == 0
+        assert get_next_batch_delay(MAX_BATCH_DELAY, 1, 10) == 0
+        # events already waiting, or many of them: a burst
+        assert get_next_batch_delay(0, 1, 0) == MIN_BATCH_DELAY
+        assert get_next_batch_delay(0, BURST_EVENTS, 10) == MIN_BATCH_DELAY
+        assert get_next_batch_delay(MIN_BATCH_DELAY, 1, 0) == MIN_BATCH_DELAY * 2
+        assert get_next_batch_delay(MAX_BATCH_DELAY, BURST_EVENTS * 10, 0) == MAX_BATCH_DELAY
@@ -0,0 +1,32 @@
+import unittest
+
+from fs_radar.watch_budget import get_subtree_roots, sort_dirs_by_priority
+
+
+class SortDirsByPriorityTest(unittest.TestCase):
+
+    def test_configured_priority_first(self):
+        groups = {
+            'a': {'rules': ['./a/'], 'priority': 0},
+            'b': {'rules': ['./b/'], 'priority': 1},
+        }
+        paths = ['/base/a', '/base/a/x', '/base/b/y', '/base/b']
+
+        assert sort_dirs_by_priority(paths, groups, '/base') == ['/base/b', '/base/b/y', '/base/a', '/base/a/x']
+
+    def test_specific_rules_first(self):
+        groups = {
+            'everything': {'rules': ['*.txt']},
+            'only_c': {'rules': ['./c/*.txt']},
+        }
+        paths = ['/base', '/base/a', '/base/b', '/base/c']
+
+        assert sort_dirs_by_priority(paths, groups, '/base')[0] == '/base/c'
+
+
+class GetSubtreeRootsTest(unittest.TestCase):
+
+    def test_roots(self):
+        paths = ['/a/b', '/a/b/c', '/a/b/c/d', '/a/e', '/f/']
+
+        assert get_subtree_roots(paths) == ['/a/b', '/a/e', '/f']
@@ -0,0 +1,69 @@
+import unittest
+
+from fs_radar.watch_table import WatchTable
+
+
+class WatchTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = WatchTable()
+        for wd, path in [(1, '/tree'), (2, '/tree/a'), (3, '/tree/a/b'), (4, '/tree/c'), (-2, '/tree/c/polled')]:
+            self.table[wd] = path
+
+    def count_nodes(self):
+        return sum(1 for name in self.table.names if name is not None)
+
+    def test_mapping(self):
+        assert len(self.table) == 5
+        assert list(self.table) == [1, 2, 3, 4, -2]
+        assert self.table[3] == '/tree/a/b'
+        assert self.table.get(5) is None
+        assert -2 in self.table and 5 not in self.table
+        assert dict(self.table) == {1: '/tree', 2: '/tree/a', 3: '/tree/a/b', 4: '/tree/c', -2: '/tree/c/polled'}
+
+    def test_paths_share_their_prefix(self):
+        # '' (the root), tree, a, b, c, polled
+        assert self.count_nodes() == 6
+
+        self.table[10] = '/other/deep/dir'
+        assert self.count_nodes() == 9
+
+        # the nodes no longer on the path of a watched directory are freed
+        assert self.table.pop(10) == '/other/deep/dir'
+        assert self.count_nodes() == 6
+        del self.table[1]
+        assert self.count_nodes() == 6  # still on the path of /tree/a
+        assert self.table.get_wd('/tree') is None
+        assert self.table.get_wd('/tree/a') == 2
+
+    def test_subtree_wds(self):
+        assert sorted(self.table.get_subtree_wds('/tree/a')) == [2, 3]
+        assert sorted(self.table.get_subtree_wds('/tree/c')) == [-2, 4]
+        assert self.table.get_subtree_wds('/tree/missing') == []
+
+    def test_move(self):
+        assert sorted(self.table.move('/tree/a', '/tree/c/moved')) == [2, 3]
+
+        assert self.table[3] == '/tree/c/moved/b'
+        assert self.table.get_wd('/tree/a/b') is None
+        assert sorted(self.table.get_subtree_wds('/tree/c')) == [-2, 2, 3, 4]
+
+    def test_move_over_a_watched_directory(self):
+        # /tree/c replaced by /tree/a, its IGNORED event comes later
+        self.table.move('/tree/a', '/tree/c')
+
+        assert self.table[2] == '/tree/c'
+        assert self.table[4] == '/tree/c'
+        assert self.table.get_wd('/tree/c') == 2
+
+        del self.table[4]
+        del self.table[-2]
+        assert self.table[3] == '/tree/c/b'
+        assert self.count_nodes() == 4
+
+    def test_same_directory_watched_twice(self):
+        self.table[-3] = '/tree/c/polled'
+        del self.table[-2]
+
+        assert self.table.get_wd('/tree/c/polled') == -3
+        assert self.table.get_subtree_wds('/tree/c/polled') == [-3]